@@ -1,18 +1,41 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+import gzip
+import hashlib
+import json
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from collections import OrderedDict
 from functools import wraps
-from flask import Flask, request, jsonify, Response, send_from_directory, render_template_string, redirect, url_for, session
+from flask import Flask, request, jsonify, Response, send_from_directory, render_template, redirect, url_for, session, g
 from flask_cors import CORS
 import secrets
+import threading
 import time
 import numpy as np
 
 from backend import llm_service
 from backend import data_manager
 from backend import sentiment_service
-from backend.config import VERSION_MAP, EXPERIMENT_STEPS, INSTRUCTION_VERSION_MAP
-from backend.localization import get_localization_for_page
+from backend import metrics
+from backend import llm_usage
+from backend import event_log
+from backend.config import (
+    VERSION_MAP, EXPERIMENT_STEPS, INSTRUCTION_VERSION_MAP,
+    POST_TURN_WORKERS, POST_TURN_QUEUE_SIZE, POST_TURN_QUEUE_PUT_TIMEOUT_SECONDS, POST_TURN_WAIT_TIMEOUT_SECONDS,
+    POST_TURN_POLL_INTERVAL_SECONDS,
+    TURN_ANALYSIS_WORKERS,
+    METRICS_PORT, METRICS_BIND_HOST
+)
+from backend.job_queue import BackgroundJobQueue
+from backend.localization import (
+    get_localization_for_page, get_localization_bundle_json, check_localization,
+    LOCALIZATION_STRINGS, LOCALIZATION_VERSION, SUPPORTED_LANGUAGES
+)
+
+log = event_log.get_event_logger(__name__)
 
 # --- Flask App Setup ---
 project_root = os.path.dirname(os.path.abspath(__file__))
@@ -22,8 +45,135 @@ app.secret_key = os.getenv("FLASK_SECRET_KEY") or os.getenv("ADMIN_SESSION_SECRE
 CORS(app)
 
 data_manager.create_data_dir()
+check_localization()
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
 
+# 每个请求的 MongoDB 读次数统计 (约束: 同一请求内同一参与者文档只读取一次)
+request_read_stats = {"requests": 0, "reads": 0, "writes": 0, "max_reads": 0, "duplicate_participant_fetches": 0}
+_request_read_stats_lock = threading.Lock()
+
+
+# --- 请求指标 (按 Flask endpoint 统计) ---
+REQUEST_DURATION = metrics.registry.histogram(
+    "http_request_duration_seconds", "Request latency by endpoint (streams: until the last chunk).",
+    ("endpoint", "method")
+)
+REQUESTS_TOTAL = metrics.registry.counter(
+    "http_requests_total", "Requests by endpoint and status code.", ("endpoint", "method", "status")
+)
+REQUESTS_IN_FLIGHT = metrics.registry.gauge(
+    "http_requests_in_flight", "Requests currently being handled (including open streams).", ("endpoint",)
+)
+STREAM_FIRST_BYTE = metrics.registry.histogram(
+    "http_stream_first_byte_seconds", "Time to the first chunk of a streamed response.", ("endpoint",)
+)
+STREAM_DURATION = metrics.registry.histogram(
+    "http_stream_duration_seconds", "Time until a streamed response finished.", ("endpoint",)
+)
+
+
+class _ObservedStream:
+    """包装流式响应体：记录首字节时间和总时长，流结束 (或客户端断开) 时才减少 in-flight 计数"""
+
+    def __init__(self, body, endpoint: str, method: str, started: float):
+        self._body = body
+        self._endpoint = endpoint
+        self._method = method
+        self._started = started
+        self._first_chunk_seen = False
+        self._closed = False
+
+    def __iter__(self):
+        for chunk in self._body:
+            if not self._first_chunk_seen:
+                self._first_chunk_seen = True
+                STREAM_FIRST_BYTE.observe(time.perf_counter() - self._started, self._endpoint)
+            yield chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            close = getattr(self._body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            duration = time.perf_counter() - self._started
+            STREAM_DURATION.observe(duration, self._endpoint)
+            REQUEST_DURATION.observe(duration, self._endpoint, self._method)
+            REQUESTS_IN_FLIGHT.dec(self._endpoint)
+
+
+@app.before_request
+def begin_request_scope():
+    g.request_started = time.perf_counter()
+    # 关联 ID: 沿用上游 (反向代理) 传入的 X-Request-ID，否则生成一个
+    g.request_id = request.headers.get("X-Request-ID") or event_log.new_request_id()
+    g.log_tokens = event_log.bind_request(g.request_id)
+    g.metrics_endpoint = request.endpoint or "unmatched"
+    g.metrics_pending = True
+    REQUESTS_IN_FLIGHT.inc(g.metrics_endpoint)
+    data_manager.begin_operation_scope()
+
+
+@app.after_request
+def record_request_metrics(response):
+    if not g.get("metrics_pending"):
+        return response
+    g.metrics_pending = False
+    response.headers["X-Request-ID"] = g.request_id
+    endpoint = g.metrics_endpoint
+    REQUESTS_TOTAL.inc(endpoint, request.method, response.status_code)
+    if response.is_streamed and not response.direct_passthrough:
+        response.response = _ObservedStream(response.response, endpoint, request.method, g.request_started)
+    else:
+        REQUEST_DURATION.observe(time.perf_counter() - g.request_started, endpoint, request.method)
+        REQUESTS_IN_FLIGHT.dec(endpoint)
+    return response
+
+
+@app.teardown_request
+def end_request_scope(exc=None):
+    if g.get("metrics_pending"):
+        # 未经过 after_request (例如处理过程中抛出的异常)
+        g.metrics_pending = False
+        REQUESTS_TOTAL.inc(g.metrics_endpoint, request.method, 500)
+        REQUEST_DURATION.observe(time.perf_counter() - g.request_started, g.metrics_endpoint, request.method)
+        REQUESTS_IN_FLIGHT.dec(g.metrics_endpoint)
+    counts = data_manager.end_operation_scope()
+    duplicates = {pid: n for pid, n in counts["participant_fetches"].items() if n > 1}
+    with _request_read_stats_lock:
+        request_read_stats["requests"] += 1
+        request_read_stats["reads"] += counts["reads"]
+        request_read_stats["writes"] += counts["writes"]
+        request_read_stats["max_reads"] = max(request_read_stats["max_reads"], counts["reads"])
+        if duplicates:
+            request_read_stats["duplicate_participant_fetches"] += 1
+    if duplicates:
+        log.warning("duplicate_participant_fetch",
+                    f"⚠️ Participant status fetched more than once in {request.method} {request.path}: {duplicates}",
+                    path=request.path, fetches=duplicates)
+    if g.get("log_tokens"):
+        event_log.unbind_request(g.pop("log_tokens"))
+
+
+# --- Request-scoped participant context ---
+def get_request_participant_status(participant_id: str) -> dict:
+    """同一个请求内只加载一次参与者状态文档，后续调用复用 g 上的同一份数据"""
+    statuses = g.setdefault("participant_statuses", {})
+    status = statuses.get(participant_id)
+    event_log.bind_participant(participant_id)
+    if not status:
+        status = data_manager.get_participant_status(participant_id)
+        statuses[participant_id] = status
+    return status
+
+
+def update_request_participant_status(participant_id: str, fields: dict):
+    """写入数据库成功后同步更新请求内的状态副本，避免再次读取"""
+    get_request_participant_status(participant_id).update(fields)
+
 
 # (calculate_text_metrics 保持不变)
 def calculate_text_metrics(text: str) -> dict:
@@ -41,37 +191,159 @@ def calculate_text_metrics(text: str) -> dict:
     }
 
 
+# --- Compiled template cache ---
+# html/ 下的页面和 index.html 在启动时读入并编译一次，之后每次请求只执行已编译的模板。
+# TEMPLATE_AUTO_RELOAD=1 时按文件 mtime 检查并重新编译 (开发用)。
+TEMPLATE_AUTO_RELOAD = os.getenv("TEMPLATE_AUTO_RELOAD", "0") == "1"
+_template_cache = {}  # file_path -> (mtime, compiled Template)
+_template_cache_lock = threading.Lock()
+
+
+def _template_file_path(template_file_name: str) -> str:
+    if template_file_name == 'index.html':
+        return os.path.join(app.static_folder, template_file_name)
+    return os.path.join(app.static_folder, 'html', template_file_name)
+
+
+def get_compiled_template(template_file_name: str):
+    """返回已编译的模板；文件不存在时抛出 FileNotFoundError"""
+    file_path = _template_file_path(template_file_name)
+    entry = _template_cache.get(file_path)
+    if entry is not None and not TEMPLATE_AUTO_RELOAD:
+        return entry[1]
+
+    mtime = os.path.getmtime(file_path)
+    if entry is not None and entry[0] == mtime:
+        return entry[1]
+
+    with _template_cache_lock:
+        entry = _template_cache.get(file_path)
+        if entry is None or entry[0] != mtime:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                template = app.jinja_env.from_string(f.read())
+            entry = (mtime, template)
+            _template_cache[file_path] = entry
+    return entry[1]
+
+
+def preload_templates():
+    """启动时预编译所有页面模板"""
+    template_names = ['index.html'] + sorted(
+        name for name in os.listdir(os.path.join(app.static_folder, 'html')) if name.endswith('.html')
+    )
+    for template_name in template_names:
+        try:
+            get_compiled_template(template_name)
+        except Exception as e:
+            log.warning("template_precompile_failed", f"⚠️ Failed to precompile template {template_name}: {e}",
+                        template=template_name, error=str(e))
+    log.info("templates_precompiled",
+             f"📄 Precompiled {len(_template_cache)} templates (auto reload: {TEMPLATE_AUTO_RELOAD})",
+             count=len(_template_cache))
+
+
+preload_templates()
+
+
+# --- Rendered page cache ---
+# 页面输出只取决于 (模板, 语言, context: current_step_index / current_step_name / is_xai_condition)，
+# 与具体参与者无关，因此按这些输入缓存完整的渲染结果 (可选预压缩 gzip)，并附带强 ETag。
+RENDER_CACHE_MAX_ENTRIES = int(os.getenv("RENDER_CACHE_MAX_ENTRIES", "256"))
+RENDER_CACHE_GZIP = os.getenv("RENDER_CACHE_GZIP", "1") == "1"
+_render_cache = OrderedDict()
+_render_cache_lock = threading.Lock()
+_render_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "not_modified": 0}
+
+
+def _render_cache_key(template_file_name: str, module_name: str, language: str, context: dict) -> tuple:
+    return template_file_name, module_name, language, tuple(sorted((context or {}).items()))
+
+
+def _get_rendered_page(key: tuple, template):
+    with _render_cache_lock:
+        entry = _render_cache.get(key)
+        # 开启 TEMPLATE_AUTO_RELOAD 时模板可能被重新编译，旧的渲染结果随之作废
+        if entry is not None and entry["template"] is template:
+            _render_cache.move_to_end(key)
+            _render_cache_stats["hits"] += 1
+            return entry
+        _render_cache_stats["misses"] += 1
+    return None
+
+
+def _store_rendered_page(key: tuple, template, html: str) -> dict:
+    body = html.encode('utf-8')
+    entry = {
+        "template": template,
+        "body": body,
+        "gzip_body": gzip.compress(body, compresslevel=6) if RENDER_CACHE_GZIP else None,
+        "etag": hashlib.sha256(body).hexdigest()[:32],
+    }
+    with _render_cache_lock:
+        _render_cache[key] = entry
+        _render_cache.move_to_end(key)
+        while len(_render_cache) > RENDER_CACHE_MAX_ENTRIES:
+            _render_cache.popitem(last=False)
+            _render_cache_stats["evictions"] += 1
+    return entry
+
+
+def _rendered_page_response(entry: dict) -> Response:
+    use_gzip = entry["gzip_body"] is not None and "gzip" in request.accept_encodings
+    response = Response(entry["gzip_body"] if use_gzip else entry["body"], mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    if use_gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    # 不同编码的表示必须使用不同的强 ETag
+    response.set_etag(f"{entry['etag']}-gzip" if use_gzip else entry['etag'])
+    # 页面访问受步骤校验控制，浏览器每次都需回源校验，命中时返回 304
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.make_conditional(request)
+    if response.status_code == 304:
+        with _render_cache_lock:
+            _render_cache_stats["not_modified"] += 1
+    return response
+
+
+def get_render_cache_stats() -> dict:
+    with _render_cache_lock:
+        stats = dict(_render_cache_stats)
+        stats["size"] = len(_render_cache)
+    stats["max_entries"] = RENDER_CACHE_MAX_ENTRIES
+    stats["gzip"] = RENDER_CACHE_GZIP
+    return stats
+
+
 # (render_template_page 保持不变, 但现在会接收更多 context 变量)
 def render_template_page(template_file_name: str, module_name: str, participant_id: str, context: dict = None):
     """
     根据受试者ID从状态中获取语言，然后用正确的本地化文本和附加 context 渲染 HTML 模板。
+    相同输入的渲染结果直接从缓存返回。
     """
-    language = data_manager.get_participant_language(participant_id)
-    strings = get_localization_for_page(module_name, language)
-
-    # 确定文件路径
-    if template_file_name == 'index.html':
-        file_path = os.path.join(app.static_folder, template_file_name)
-    else:
-        file_path = os.path.join(app.static_folder, 'html', template_file_name)
+    language = data_manager.get_participant_language(participant_id, get_request_participant_status(participant_id))
 
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            html_content = f.read()
+        template = get_compiled_template(template_file_name)
     except FileNotFoundError:
         return Response(f"Template not found: {template_file_name}", status=404)
 
-    # 合并 context 变量
-    render_context = {"strings": strings}
-    if context:
-        render_context.update(context)
+    cache_key = _render_cache_key(template_file_name, module_name, language, context)
+    entry = _get_rendered_page(cache_key, template)
+    if entry is None:
+        strings = get_localization_for_page(module_name, language)
 
-    # 使用 render_template_string 渲染
-    return render_template_string(html_content, **render_context)
+        # 合并 context 变量
+        render_context = {"strings": strings}
+        if context:
+            render_context.update(context)
 
+        # 直接执行已编译的模板
+        entry = _store_rendered_page(cache_key, template, render_template(template, **render_context))
 
-def render_invite_status_page(title: str, message: str, status_code: int = 200):
-    html_content = """
+    return _rendered_page_response(entry)
+
+
+INVITE_STATUS_PAGE_TEMPLATE = """
     <!DOCTYPE html>
     <html lang="en">
     <head>
@@ -117,7 +389,11 @@ def render_invite_status_page(title: str, message: str, status_code: int = 200):
     </body>
     </html>
     """
-    return Response(render_template_string(html_content, title=title, message=message), status=status_code)
+_invite_status_template = app.jinja_env.from_string(INVITE_STATUS_PAGE_TEMPLATE)
+
+
+def render_invite_status_page(title: str, message: str, status_code: int = 200):
+    return Response(render_template(_invite_status_template, title=title, message=message), status=status_code)
 
 
 def is_admin_authenticated() -> bool:
@@ -138,7 +414,7 @@ def build_absolute_invite_url(token: str) -> str:
 
 
 def participant_status_or_error(participant_id: str):
-    status = data_manager.get_participant_status(participant_id)
+    status = get_request_participant_status(participant_id)
     if not status:
         return None, jsonify({"error": "Participant session not found. Please use a valid experiment link."}), 404
     return status, None
@@ -166,7 +442,7 @@ def serve_index():
     if not participant_id:
         return redirect('/landing')
 
-    status = data_manager.get_participant_status(participant_id)
+    status = get_request_participant_status(participant_id)
     if not status:
         return render_invite_status_page(
             "Session Not Found",
@@ -179,8 +455,9 @@ def serve_index():
 
     if expected_index != -1:
         # 如果不是 -1，重定向到他们应该在的页面
-        print(
-            f"⚠️ Access Violation: PID {participant_id} requested Consent page but is on step {expected_index}. Redirecting.")
+        log.warning("access_violation",
+                    f"⚠️ Access Violation: PID {participant_id} requested Consent page but is on step {expected_index}. "
+                    f"Redirecting.", participant_id=participant_id, requested="index.html", step_index=expected_index)
         return redirect_to_expected_step(participant_id, status)
 
     # 正常渲染 Consent 页面 (注入 step index)
@@ -217,7 +494,7 @@ def redeem_invite(token):
             )
 
         participant_id = invite["participant_id"]
-        participant_status = data_manager.get_participant_status(participant_id)
+        participant_status = get_request_participant_status(participant_id)
 
         if not participant_status:
             llm_service.clear_session(participant_id)
@@ -227,12 +504,12 @@ def redeem_invite(token):
                 invite["language"],
                 invite.get("invite_type", "participant")
             )
-            participant_status = data_manager.get_participant_status(participant_id)
+            participant_status = get_request_participant_status(participant_id)
 
         return redirect_to_expected_step(participant_id, participant_status)
 
     except Exception as e:
-        print(f"Error redeeming invite token: {e}")
+        log.exception("invite_redeem_failed", f"Error redeeming invite token: {e}", error=str(e))
         return render_invite_status_page(
             "Link Error",
             "An unexpected error occurred while opening this invitation link. Please try again later.",
@@ -324,25 +601,142 @@ def get_invite_batch_links(batch_id):
     return jsonify({"success": True, "links": links})
 
 
+@app.route('/admin/cache-stats')
+@require_admin_auth
+def get_cache_stats():
+    return jsonify({
+        "success": True,
+        "participant_status": data_manager.get_status_cache_stats(),
+        "routing": data_manager.get_routing_stats(),
+        "write_buffer": data_manager.get_write_buffer_stats(),
+        "rendered_pages": get_render_cache_stats(),
+        "sentiment": sentiment_service.get_sentiment_cache_stats(),
+        "sentiment_tiers": sentiment_service.get_tier_stats(),
+        "post_turn_queue": post_turn_queue.get_stats(),
+        "summaries": llm_service.get_summary_stats(),
+        "sessions": llm_service.get_session_stats(),
+        "context": llm_service.get_context_stats(),
+        "llm_usage": llm_usage.get_usage_stats(),
+        "logging": event_log.get_logging_stats(),
+        "mongo_operations": {
+            **dict(request_read_stats),
+            "avg_reads_per_request": round(request_read_stats["reads"] / request_read_stats["requests"], 3)
+            if request_read_stats["requests"] else 0.0,
+            "totals": data_manager.get_operation_totals()
+        }
+    })
+
+
+def _collect_app_stats() -> list:
+    """把已有的统计字典在导出时转换成指标 (缓存、后台队列、会话、数据库操作)"""
+    families = []
+    # 每个指标只输出一个 family (重复的 HELP/TYPE 会让 Prometheus 拒绝整次抓取)，各缓存作为 cache 标签的取值
+    caches = (("status", data_manager.get_status_cache_stats()),
+              ("render", get_render_cache_stats()),
+              ("sentiment", sentiment_service.get_sentiment_cache_stats()))
+    for field in ("hits", "misses", "evictions"):
+        families.append((f"app_cache_{field}_total", "counter", f"Cache {field} by cache.",
+                         [({"cache": cache_name}, stats.get(field, 0)) for cache_name, stats in caches]))
+    families.append(("app_cache_entries", "gauge", "Cache entries by cache.",
+                     [({"cache": cache_name}, stats.get("size", 0)) for cache_name, stats in caches]))
+    tiers = sentiment_service.get_tier_stats()
+    families.append(("app_sentiment_local_attempts_total", "counter", "Texts tried on the local sentiment tier.",
+                     [({}, tiers["attempts"])]))
+    families.append(("app_sentiment_local_hits_total", "counter",
+                     "Texts answered by the local sentiment tier without Gemini.", [({}, tiers["hits"])]))
+    families.append(("app_sentiment_local_compared_total", "counter",
+                     "Local predictions compared with Gemini, by local confidence bucket.",
+                     [({"confidence": bucket}, entry["compared"])
+                      for bucket, entry in tiers["agreement_by_confidence"].items()]))
+    families.append(("app_sentiment_local_agreed_total", "counter",
+                     "Local predictions that matched Gemini, by local confidence bucket.",
+                     [({"confidence": bucket}, entry["agreed"])
+                      for bucket, entry in tiers["agreement_by_confidence"].items()]))
+    queues = (("post_turn", post_turn_queue.get_stats()), ("summary", llm_service.get_summary_stats()["queue"]),
+              ("sentiment_shadow", tiers["shadow_queue"]))
+    families.append(("app_job_queue_depth", "gauge", "Jobs waiting in a background queue.",
+                     [({"queue": name}, stats["depth"]) for name, stats in queues]))
+    families.append(("app_job_queue_pending", "gauge", "Jobs queued or running in a background queue.",
+                     [({"queue": name}, stats["pending"]) for name, stats in queues]))
+    for field in ("completed", "failed", "dropped", "ran_inline"):
+        families.append((f"app_job_queue_{field}_total", "counter", f"Background jobs {field}.",
+                         [({"queue": name}, stats[field]) for name, stats in queues]))
+    sessions = llm_service.get_session_stats()
+    families.append(("app_llm_sessions_resident", "gauge", "LLM sessions held in process memory.",
+                     [({}, sessions.get("resident_sessions", 0))]))
+    families.append(("app_llm_sessions_bytes", "gauge", "Approximate memory used by resident LLM sessions.",
+                     [({}, sessions.get("approx_bytes", 0))]))
+    write_buffer = data_manager.get_write_buffer_stats()
+    if write_buffer["enabled"]:
+        families.append(("app_mongo_write_buffer_unflushed", "gauge", "Records waiting in the Mongo write buffer.",
+                         [({}, write_buffer["unflushed"])]))
+        for field in ("written", "failed"):
+            families.append((f"app_mongo_write_buffer_{field}_total", "counter",
+                             f"Buffered records {field} by the Mongo write buffer.", [({}, write_buffer[field])]))
+    totals = data_manager.get_operation_totals()
+    families.append(("app_mongo_operations_total", "counter", "MongoDB round trips issued by this process.",
+                     [({"kind": kind}, count) for kind, count in totals.items()]))
+    return families
+
+
+metrics.registry.register_collector(_collect_app_stats)
+if METRICS_PORT:
+    # 多个 worker 进程时每个进程的指标独立，只有第一个绑定成功的进程会在这个端口上导出
+    metrics.start_metrics_server(METRICS_PORT, METRICS_BIND_HOST)
+
+
+@app.route('/metrics')
+@require_admin_auth
+def get_metrics():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route('/admin/debug-prompts')
+@require_admin_auth
+def get_debug_prompts():
+    """最近几次发送给 Gemini 的完整 prompt (需设置 LLM_DEBUG_PROMPT_CAPTURE=1)"""
+    return jsonify({"success": True, "prompts": llm_service.get_debug_prompts()})
+
+
 # --- NEW HELPER: Redirect to expected step ---
 def redirect_to_expected_step(participant_id: str, status: dict = None):
     """根据状态文件中的 expected_index 重定向用户"""
     if not status:
-        status = data_manager.get_participant_status(participant_id)
+        status = get_request_participant_status(participant_id)
 
+    expected_index = status.get("current_step_index", -1)
+    expected_url = expected_step_url(participant_id, status)
+
+    log.info("step_redirect", f"🔄 Redirecting PID {participant_id} to expected step {expected_index} at {expected_url}",
+             participant_id=participant_id, step_index=expected_index, url=expected_url)
+    return redirect(expected_url)
+
+
+def expected_step_url(participant_id: str, status: dict) -> str:
+    """参与者当前应该所在页面的 URL (携带 PID)"""
     expected_index = status.get("current_step_index", -1)
     condition = status.get("condition", "NON_XAI")  # 获取当前条件
 
     if expected_index == -1:
-        expected_url = f"/index.html?pid={participant_id}"
+        return f"/index.html?pid={participant_id}"
     elif expected_index >= len(EXPERIMENT_STEPS):  # 超出范围，去 Debrief
-        expected_url = f"/html/debrief.html?pid={participant_id}"
-    else:
-        expected_step_key = EXPERIMENT_STEPS[expected_index]
-        expected_url = get_url_for_step(expected_step_key, condition, participant_id)
+        return f"/html/debrief.html?pid={participant_id}"
+    expected_step_key = EXPERIMENT_STEPS[expected_index]
+    return get_url_for_step(expected_step_key, condition, participant_id)
 
-    print(f"🔄 Redirecting PID {participant_id} to expected step {expected_index} at {expected_url}")
-    return redirect(expected_url)
+
+def stale_step_body(participant_id: str, current_status: dict) -> dict:
+    """提交的步骤已过期或乱序 (状态已被其他请求推进) 时的 409 响应体，告知参与者当前应在的步骤"""
+    return {
+        "success": False,
+        "error": "This step has already been submitted or is out of order. Please continue from the current step.",
+        "next_url": expected_step_url(participant_id, current_status),
+        "next_step_index": current_status.get("current_step_index", -1)
+    }
+
+
+def stale_step_response(participant_id: str, current_status: dict):
+    return jsonify(stale_step_body(participant_id, current_status)), 409
 
 
 # --- NEW HELPER: Get URL for a step key ---
@@ -369,7 +763,8 @@ def get_url_for_step(step_key: str, condition: str, participant_id: str) -> str:
         url_path = "/html/baseline_mood.html"
     else:
         # Fallback or error case? Default to debrief?
-        print(f"⚠️ Unknown step key encountered: {step_key}. Defaulting to debrief.")
+        log.warning("unknown_step_key", f"⚠️ Unknown step key encountered: {step_key}. Defaulting to debrief.",
+                    step_key=step_key)
         url_path = "/html/debrief.html"
 
     return f"{url_path}?pid={participant_id}"
@@ -395,14 +790,16 @@ def serve_html(filename):
 
     # 2. 如果没有 PID 就试图访问任何其他 HTML 页面，踢回 admin 设置
     if not participant_id:
-        print(f"🚫 Access Denied: Attempted to access {filename} without PID.")
+        log.warning("access_denied_no_pid", f"🚫 Access Denied: Attempted to access {filename} without PID.",
+                    requested=filename)
         return redirect('/landing')
 
     # 3. 核心：状态验证与渲染逻辑
     try:
-        status = data_manager.get_participant_status(participant_id)
+        status = get_request_participant_status(participant_id)
         if not status:  # 如果状态文件丢失 (不应发生)
-            print(f"🚫 Critical Error: Status file missing for PID {participant_id}.")
+            log.error("participant_status_missing", f"🚫 Critical Error: Status file missing for PID {participant_id}.",
+                      participant_id=participant_id)
             return redirect('/landing')
 
         expected_index = status.get("current_step_index", -1)
@@ -416,7 +813,9 @@ def serve_html(filename):
                 # 允许访问 Debrief 页面
                 return render_template_page(filename, "debrief", participant_id)
             else:  # 状态无效或试图访问非 Debrief 页面，重定向
-                print(f"⚠️ Invalid state index {expected_index} for PID {participant_id}. Redirecting.")
+                log.warning("invalid_step_index",
+                            f"⚠️ Invalid state index {expected_index} for PID {participant_id}. Redirecting.",
+                            participant_id=participant_id, step_index=expected_index)
                 return redirect_to_expected_step(participant_id, status)
 
         # 获取预期的步骤 Key 和对应的 URL
@@ -427,8 +826,11 @@ def serve_html(filename):
 
         # 检查请求的文件名是否与预期匹配
         if filename != expected_filename:
-            print(
-                f"⚠️ Access Violation: PID {participant_id} requested {filename} but expected {expected_filename} (step {expected_index}). Redirecting.")
+            log.warning("access_violation",
+                        f"⚠️ Access Violation: PID {participant_id} requested {filename} but expected "
+                        f"{expected_filename} (step {expected_index}). Redirecting.",
+                        participant_id=participant_id, requested=filename, expected=expected_filename,
+                        step_index=expected_index)
             return redirect(expected_url)
 
         # --- 验证通过 ---
@@ -473,10 +875,10 @@ def serve_html(filename):
         return render_template_page(expected_filename, module_name, participant_id, context=context)
 
     except Exception as e:
-        print(f"Error during step validation/rendering for {participant_id} on {filename}: {e}")
-        # Log the full traceback for debugging
-        import traceback
-        traceback.print_exc()
+        # 带完整堆栈
+        log.exception("page_render_failed",
+                      f"Error during step validation/rendering for {participant_id} on {filename}: {e}",
+                      participant_id=participant_id, requested=filename, error=str(e))
         return "An error occurred during state validation.", 500
 
 
@@ -487,6 +889,26 @@ def serve_assets(filename):
     return send_from_directory(os.path.join(app.static_folder, 'assets'), filename)
 
 
+@app.route('/localization/<module_name>.json')
+def serve_localization_bundle(module_name):
+    """
+    以 JSON 提供预计算的本地化 bundle，供前端 JS 使用。
+    带上 ?v=<LOCALIZATION_VERSION> 请求时可被长期缓存。
+    """
+    language = request.args.get('lang', 'en')
+    if module_name not in LOCALIZATION_STRINGS or language not in SUPPORTED_LANGUAGES:
+        return jsonify({"error": "Unknown localization module or language."}), 404
+
+    response = Response(get_localization_bundle_json(module_name, language), mimetype='application/json')
+    response.set_etag(f"{LOCALIZATION_VERSION}-{module_name}-{language}")
+    response.headers['X-Localization-Version'] = LOCALIZATION_VERSION
+    if request.args.get('v') == LOCALIZATION_VERSION:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 # --- MODIFIED: start_experiment ---
 @app.route('/start_experiment', methods=['POST'])
 def start_experiment():
@@ -521,7 +943,7 @@ def start_experiment():
     except ValueError as e:  # Catch invalid condition_order
         return jsonify({"error": str(e)}), 400
     except Exception as e:
-        print(f"Error in /start_experiment: {e}")
+        log.exception("route_failed", f"Error in /start_experiment: {e}", route="/start_experiment", error=str(e))
         return jsonify({"error": f"Internal server error: {e}"}), 500
 
 
@@ -545,19 +967,23 @@ def save_data():
         status, error_response = participant_status_or_error(participant_id)
         if error_response:
             return error_response
+        status_fields = {}  # 随步骤推进一起写入的其他状态字段
 
         # --- (NEW) Washout 验证 ---
         if step_name == "WASHOUT":
             start_ts = status.get("washout_start_ts")
             if not start_ts:  # 如果没有开始时间戳 (不应发生)
-                print(f"Error: Washout start timestamp missing for {participant_id}")
+                log.error("washout_start_missing", f"Error: Washout start timestamp missing for {participant_id}",
+                          participant_id=participant_id)
                 return jsonify({"error": "Washout start time missing."}), 400
 
             duration = time.time() - start_ts
             skip_washout = bool(step_data.get("skip_washout"))
 
             if duration < 300 and not skip_washout:  # 强制 5 分钟，除非触发隐藏跳过
-                print(f"Info: PID {participant_id} tried to submit Washout early ({duration:.1f}s). Denied.")
+                log.info("washout_early_submit",
+                         f"Info: PID {participant_id} tried to submit Washout early ({duration:.1f}s). Denied.",
+                         participant_id=participant_id, duration_seconds=round(duration, 1))
                 return jsonify({"success": False,
                                 "error": get_localization_for_page("washout", status.get("language", "en")).get(
                                     "error_early_submit", "Please wait for the full 5-minute break.")}), 400
@@ -569,15 +995,16 @@ def save_data():
 
             if skip_washout:
                 step_data["skip_method"] = "konami_code"
-                print(f"✅ Washout skipped for PID {participant_id} after {duration:.1f}s via Konami Code.")
+                log.info("washout_complete",
+                         f"✅ Washout skipped for PID {participant_id} after {duration:.1f}s via Konami Code.",
+                         participant_id=participant_id, duration_seconds=round(duration, 1), skipped=True)
             else:
-                print(f"✅ Washout complete for PID {participant_id} after {duration:.1f}s.")
+                log.info("washout_complete", f"✅ Washout complete for PID {participant_id} after {duration:.1f}s.",
+                         participant_id=participant_id, duration_seconds=round(duration, 1), skipped=False)
 
-            # (NEW) 清除 LLM 会话并更新到下一个 condition
-            llm_service.clear_session(participant_id)
-            if not data_manager.update_participant_condition(participant_id):
-                # 如果更新 condition 失败，也应阻止流程继续
-                return jsonify({"error": "Failed to update participant condition after washout."}), 500
+            # (NEW) 切换到下一个 condition (与步骤推进在同一次写入中完成)
+            status_fields["condition"] = data_manager.switched_condition(status)
+            status_fields["washout_completed"] = True
 
         # --- (NEW) XAI 问卷字段填充 ---
         if step_name in ["POST_QUESTIONNAIRE_1", "POST_QUESTIONNAIRE_2"]:
@@ -589,26 +1016,32 @@ def save_data():
                 step_data["expl_sufficient"] = step_data.get("expl_sufficient", None)
                 step_data["expl_trusthelp"] = step_data.get("expl_trusthelp", None)
 
-        # 1. 保存当前步骤的数据
-        if not data_manager.save_participant_data(participant_id, step_name, step_data):
-            return jsonify({"error": "Failed to save participant data."}), 500
-
-        # 2. 确定下一个步骤的索引
+        # 1. 确定下一个步骤的索引
         next_step_index = current_step_index + 1
 
-        # 3. 更新状态文件中的步骤索引
-        if not data_manager.update_participant_step(participant_id, next_step_index):
-            return jsonify({"error": "Failed to update participant step."}), 500
+        # --- Washout 开始时间戳记录 (进入 Washout 时写入) ---
+        washout_starting = step_name == "POST_QUESTIONNAIRE_1" and next_step_index == EXPERIMENT_STEPS.index("WASHOUT")
+        if washout_starting:
+            status_fields["washout_start_ts"] = time.time()
 
-        # --- Washout 开始时间戳记录 ---
-        if step_name == "POST_QUESTIONNAIRE_1":
-            status_data = data_manager.get_participant_status(participant_id)
-            if status_data.get("current_step_index") == EXPERIMENT_STEPS.index("WASHOUT"):
-                data_manager.record_washout_start(participant_id, time.time())
-                print(f"⏱️ Washout timer started for PID {participant_id}")
+        # 2. 保存当前步骤的数据并推进步骤 (服务器端拒绝过期 / 乱序的步骤索引)
+        updated_status, advanced = data_manager.advance_participant_step(
+            participant_id, step_name, step_data, current_step_index, next_step_index, status_fields, status=status
+        )
+        if updated_status is None:
+            return jsonify({"error": "Failed to save participant data."}), 500
+        update_request_participant_status(participant_id, updated_status)
+        if not advanced:
+            return stale_step_response(participant_id, updated_status)
 
-        # 4. 确定下一个页面的 URL (使用更新后的状态)
-        status = data_manager.get_participant_status(participant_id)  # 确保使用最新状态
+        if step_name == "WASHOUT":
+            # 新 condition 从空会话开始
+            llm_service.clear_session(participant_id)
+        if washout_starting:
+            log.info("washout_started", f"⏱️ Washout timer started for PID {participant_id}",
+                     participant_id=participant_id)
+
+        # 3. 确定下一个页面的 URL (status 已随写入同步更新，无需重新读取)
         current_condition = status.get("condition")
 
         if next_step_index >= len(EXPERIMENT_STEPS):
@@ -619,7 +1052,7 @@ def save_data():
             next_url_path = get_url_for_step(next_step_key, current_condition, participant_id).split('?')[
                 0]  # Remove PID for response
 
-        # 5. 返回下一个页面的 URL (携带 PID)
+        # 4. 返回下一个页面的 URL (携带 PID)
         return jsonify({
             "success": True,
             "next_url": f"{next_url_path}?pid={participant_id}",
@@ -627,12 +1060,84 @@ def save_data():
         })
 
     except Exception as e:
-        print(f"Error in /save_data: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("route_failed", f"Error in /save_data: {e}", route="/save_data", error=str(e))
         return jsonify({"error": f"Internal server error: {e}"}), 500
 
 
+# --- 后台 post-turn 处理 (情绪分析 + 写入 dialogue_turns) ---
+post_turn_queue = BackgroundJobQueue(
+    "post_turn",
+    workers=POST_TURN_WORKERS,
+    max_size=POST_TURN_QUEUE_SIZE,
+    put_timeout=POST_TURN_QUEUE_PUT_TIMEOUT_SECONDS
+)
+
+
+def process_post_turn(participant_id: str, user_input: str, ai_message_text: str,
+                      condition: str, turn: int, session_part: int, user_metrics: dict, explanation_shown: bool,
+                      request_id: str = None):
+    """在后台线程中对一轮对话做情绪分析，并保存到 dialogue_turns (日志沿用发起请求的关联 ID)"""
+    with event_log.log_context(participant_id, request_id):
+        try:
+            _analyze_and_save_turn(participant_id, user_input, ai_message_text, condition, turn, session_part,
+                                   user_metrics, explanation_shown)
+        finally:
+            # 记在会话存储中，其他 worker 进程处理 end_dialogue 时也能知道这一轮已处理完
+            llm_service.mark_post_turn_done(participant_id)
+
+
+def _analyze_and_save_turn(participant_id: str, user_input: str, ai_message_text: str,
+                           condition: str, turn: int, session_part: int, user_metrics: dict, explanation_shown: bool):
+    agent_metrics = calculate_text_metrics(ai_message_text)
+
+    # 1. 情绪分析 (User + Agent)，一次批量调用
+    with llm_usage.participant_scope(participant_id):
+        user_sentiment, agent_sentiment = sentiment_service.analyze_sentiment_batch(
+            [user_input, ai_message_text], record_stats=[True, False]
+        )
+    u_label = user_sentiment.get("top_emotion")
+    u_conf = user_sentiment.get("top_score", 0.0)
+    u_score = sentiment_service.calculate_weighted_score(u_label, u_conf)
+
+    a_label = agent_sentiment.get("top_emotion")
+    a_conf = agent_sentiment.get("top_score", 0.0)
+    a_score = sentiment_service.calculate_weighted_score(a_label, a_conf)
+
+    # 2. 追加会话中的情绪分数 (用于 fluctuation 计算)
+    llm_service.append_sentiment_score(participant_id, u_score)
+
+    # 3. 构造数据
+    turn_data = {
+        "user_id": participant_id,
+        "condition": condition,
+        "turn": turn,
+        "session_part": session_part,
+
+        "user_input_length_token": user_metrics["length_token"],
+        "agent_response_length_token": agent_metrics["length_token"],
+        "explanation_shown": explanation_shown if condition == "XAI" else False,
+
+        # User Sentiment
+        "user_sentiment_label": u_label,
+        "user_sentiment_confidence": round(u_conf, 4),
+        "user_sentiment_score": round(u_score, 4),
+        # 修复：现在明确获取 raw_scores
+        "user_raw_sentiment": user_sentiment.get("raw_scores", {}),
+        # 来源：本地词典 (Local-Lexicon) 或模型名；分析失败的兜底结果为 None
+        "user_sentiment_model": user_sentiment.get("model_used"),
+
+        # Agent Sentiment
+        "agent_sentiment_label": a_label,
+        "agent_sentiment_confidence": round(a_conf, 4),
+        "agent_sentiment_score": round(a_score, 4),
+        # 修复：现在明确获取 raw_scores
+        "agent_raw_sentiment": agent_sentiment.get("raw_scores", {}),
+        "agent_sentiment_model": agent_sentiment.get("model_used"),
+    }
+
+    data_manager.save_turn_data(participant_id, turn_data)
+
+
 # --- MODIFIED: chat 路由 ---
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -648,89 +1153,175 @@ def chat():
         return Response(error_response.get_data(as_text=True), status=404, mimetype='application/json')
 
     condition = status.get("condition", "UNKNOWN")
-    current_index = status.get("current_step_index")
-
-    session_part = 1
-    # 简单的逻辑判断是否为第二阶段
-    if current_index is not None and current_index >= 5:
-        session_part = 2
+    session_part = chat_session_part(status)
 
     session = llm_service.get_session(participant_id)
     current_turn = session['turn_count'] + 1
     user_metrics = calculate_text_metrics(user_input)
+    request_id = g.request_id
 
     def generate_stream_and_log():
         full_ai_reply = b''
         stream_error = None
 
         try:
-            stream = llm_service.get_llm_response_stream(participant_id, user_input)
-            for chunk in stream:
-                full_ai_reply += chunk
-                yield chunk
+            # 客户端提前断开时先关闭内层流，AI 回复写回会话之后才排队 post-turn 任务
+            with closing(llm_service.get_llm_response_stream(participant_id, user_input)) as stream:
+                for chunk in stream:
+                    full_ai_reply += chunk
+                    yield chunk
 
         except Exception as e:
             stream_error = e
-            print(f"Error during LLM stream: {e}")
+            # 流式响应在请求上下文结束后才迭代，关联 ID 需要显式传入
+            log.error("llm_stream_failed", f"Error during LLM stream: {e}",
+                      participant_id=participant_id, request_id=request_id, error=str(e))
             yield f"⚠️ Backend LLM error: {e}".encode('utf-8')
 
         finally:
             if not stream_error and full_ai_reply:
-                # 1. 获取 AI 文本
-                ai_message_text = ""
-                if session.get('history') and session['history'][-1]['role'] == 'ai':
-                    ai_message_text = session['history'][-1]['content']
-
-                agent_metrics = calculate_text_metrics(ai_message_text)
-
-                # 2. 情绪分析 (User)
-                user_sentiment = sentiment_service.analyze_sentiment(user_input)
-                u_label = user_sentiment.get("top_emotion")
-                u_conf = user_sentiment.get("top_score", 0.0)
-                u_score = sentiment_service.calculate_weighted_score(u_label, u_conf)
-
-                # 3. 情绪分析 (Agent)
-                agent_sentiment = sentiment_service.analyze_sentiment(ai_message_text)
-                a_label = agent_sentiment.get("top_emotion")
-                a_conf = agent_sentiment.get("top_score", 0.0)
-                a_score = sentiment_service.calculate_weighted_score(a_label, a_conf)
-
-                # 4. 更新内存中的情绪分数 (用于 fluctuation 计算)
-                if 'sentiment_scores' not in session:
-                    session['sentiment_scores'] = []
-                session['sentiment_scores'].append(u_score)
-
-                # 5. 构造数据
-                turn_data = {
-                    "user_id": participant_id,
-                    "condition": condition,
-                    "turn": current_turn,
-                    "session_part": session_part,
-
-                    "user_input_length_token": user_metrics["length_token"],
-                    "agent_response_length_token": agent_metrics["length_token"],
-                    "explanation_shown": explanation_shown if condition == "XAI" else False,
-
-                    # User Sentiment
-                    "user_sentiment_label": u_label,
-                    "user_sentiment_confidence": round(u_conf, 4),
-                    "user_sentiment_score": round(u_score, 4),
-                    # 修复：现在明确获取 raw_scores
-                    "user_raw_sentiment": user_sentiment.get("raw_scores", {}),
-
-                    # Agent Sentiment
-                    "agent_sentiment_label": a_label,
-                    "agent_sentiment_confidence": round(a_conf, 4),
-                    "agent_sentiment_score": round(a_score, 4),
-                    # 修复：现在明确获取 raw_scores
-                    "agent_raw_sentiment": agent_sentiment.get("raw_scores", {}),
-                }
-
-                data_manager.save_turn_data(participant_id, turn_data)
+                queue_post_turn(participant_id, user_input, condition, current_turn, session_part, user_metrics,
+                                explanation_shown, request_id)
 
     return Response(generate_stream_and_log(), mimetype='text/plain')
 
 
+def chat_session_part(status: dict) -> int:
+    # 简单的逻辑判断是否为第二阶段
+    current_index = status.get("current_step_index")
+    if current_index is not None and current_index >= 5:
+        return 2
+    return 1
+
+
+def queue_post_turn(participant_id: str, user_input: str, condition: str, turn: int, session_part: int,
+                    user_metrics: dict, explanation_shown: bool, request_id: str) -> bool:
+    """
+    获取 AI 文本后，情绪分析与写库交给后台队列，流在最后一个 token 后立即结束。
+    只有回复已写入会话 (turn_count 已到本轮) 的轮次才排队；否则 post_turns_done 会超过 turn_count。返回是否排队。
+    """
+    latest_session = llm_service.get_session(participant_id)
+    if latest_session['turn_count'] < turn:
+        log.warning("post_turn_skipped", f"⚠️ Turn {turn} for PID {participant_id} was not completed, no post-turn job",
+                    participant_id=participant_id, request_id=request_id, turn=turn)
+        return False
+    ai_message_text = ""
+    if latest_session.get('history') and latest_session['history'][-1]['role'] == 'ai':
+        ai_message_text = latest_session['history'][-1]['content']
+
+    post_turn_queue.submit(
+        process_post_turn,
+        participant_id, user_input, ai_message_text,
+        condition=condition,
+        turn=turn,
+        session_part=session_part,
+        user_metrics=user_metrics,
+        explanation_shown=explanation_shown,
+        request_id=request_id,
+        key=participant_id
+    )
+    return True
+
+
+# --- /chat_turn: 一个连接上的合并事件流 (NDJSON) ---
+# 每行一个 JSON 事件:
+#   {"type": "sentiment", "sentiment": {...}}      仅 XAI 条件，情绪分类完成后立即发送
+#   {"type": "explanation", "explanation": "..."}  仅 XAI 条件
+#   {"type": "token", "text": "..."}               聊天回复分块
+#   {"type": "error", "stage": "chat" | "analysis", "error": "..."}
+#   {"type": "turn_saved", "turn": N}              最后一个事件：回复已写入会话，本轮记录已交给 post-turn 队列
+# /chat 和 /analyze 保留，旧页面不受影响。
+turn_analysis_pool = ThreadPoolExecutor(max_workers=max(1, TURN_ANALYSIS_WORKERS), thread_name_prefix="turn-analysis")
+
+
+def turn_event(event_type: str, **fields) -> bytes:
+    return (json.dumps({"type": event_type, **fields}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def analyze_turn(participant_id: str, user_input: str, request_id: str, emit):
+    """XAI 轮次的情绪分析 + 解释，每完成一步就 emit 一个事件 (与聊天流并行执行)"""
+    with event_log.log_context(participant_id, request_id), llm_usage.participant_scope(participant_id):
+        try:
+            _, explanation = llm_service.analyze_and_explain(
+                user_input, on_sentiment=lambda sentiment: emit(turn_event("sentiment", sentiment=sentiment))
+            )
+            emit(turn_event("explanation", explanation=explanation))
+        except Exception as e:
+            log.exception("turn_analysis_failed", f"Error analyzing turn: {e}", error=str(e))
+            emit(turn_event("error", stage="analysis", error=str(e)))
+
+
+def _drain_events(events: queue.SimpleQueue):
+    while True:
+        try:
+            yield events.get_nowait()
+        except queue.Empty:
+            return
+
+
+@app.route('/chat_turn', methods=['POST'])
+def chat_turn():
+    """
+    合并 /analyze 和 /chat：一次状态查询、一次情绪分析，所有结果按事件顺序写在同一个流式响应里。
+    WSGI 模式下分析事件在相邻的两个 token 之间发出 (ASGI 模式下完成即发出)。
+    """
+    data = request.json or {}
+    user_input = data.get("message", "")
+    participant_id = data.get("participant_id", "")
+
+    if not user_input or not participant_id:
+        return jsonify({"error": "No message or participant_id provided"}), 400
+
+    status = get_request_participant_status(participant_id)
+    if not status:
+        return jsonify({"error": "Participant session not found. Please use a valid experiment link."}), 404
+
+    condition = status.get("condition", "UNKNOWN")
+    with_analysis = condition == "XAI"
+    explanation_shown = data.get("explanation_shown", with_analysis)
+    session_part = chat_session_part(status)
+
+    session = llm_service.get_session(participant_id)
+    current_turn = session['turn_count'] + 1
+    user_metrics = calculate_text_metrics(user_input)
+    request_id = g.request_id
+
+    def generate_events():
+        events = queue.SimpleQueue()
+        analysis = None
+        if with_analysis:
+            analysis = turn_analysis_pool.submit(analyze_turn, participant_id, user_input, request_id, events.put)
+        full_ai_reply = b''
+        stream_error = None
+        saved = False
+
+        try:
+            with closing(llm_service.get_llm_response_stream(participant_id, user_input, raise_errors=True)) as stream:
+                for chunk in stream:
+                    full_ai_reply += chunk
+                    yield from _drain_events(events)
+                    yield turn_event("token", text=chunk.decode('utf-8', errors='replace'))
+
+        except Exception as e:
+            stream_error = e
+            log.error("llm_stream_failed", f"Error during LLM stream: {e}",
+                      participant_id=participant_id, request_id=request_id, error=str(e))
+            yield turn_event("error", stage="chat", error=str(e))
+
+        finally:
+            if not stream_error and full_ai_reply:
+                saved = queue_post_turn(participant_id, user_input, condition, current_turn, session_part,
+                                        user_metrics, explanation_shown, request_id)
+
+        if analysis is not None:
+            analysis.result()
+            yield from _drain_events(events)
+        if saved:
+            yield turn_event("turn_saved", turn=current_turn)
+
+    return Response(generate_events(), mimetype='application/x-ndjson')
+
+
 # --- NEW ROUTE: /analyze (用于 XAI 和 情绪分析) ---
 @app.route('/analyze', methods=['POST'])
 def analyze():
@@ -751,18 +1342,18 @@ def analyze():
             return error_response
 
         # 1. 运行情绪分析 (Step 1 的成果)
-        print(f"🧠 Analyzing sentiment for PID {participant_id}...")
-        sentiment_result = sentiment_service.analyze_sentiment(user_input)
-
-        # 2. 生成 XAI 解释 (Step 2 的成果)
-        # 只有当条件是 XAI 时才需要生成解释，但为了简单，后端可以总是生成，前端决定显不显示
-        # 或者我们检查状态只为 XAI 生成
-        condition = status.get("condition", "NON_XAI")
-
-        xai_explanation = ""
-        if condition == "XAI":
-            print(f"🤖 Generating XAI explanation using {llm_service.XAI_MODEL_NAME}...")
-            xai_explanation = llm_service.generate_xai_explanation(user_input, sentiment_result)
+        log.debug("sentiment_requested", f"🧠 Analyzing sentiment for PID {participant_id}...")
+        with llm_usage.participant_scope(participant_id):
+            # 2. 生成 XAI 解释 (Step 2 的成果)
+            # 只有 XAI 条件需要解释；默认与情绪分析合并为一次调用 (XAI_ANALYSIS_MODE)
+            condition = status.get("condition", "NON_XAI")
+
+            xai_explanation = ""
+            if condition == "XAI":
+                log.debug("xai_requested", f"🤖 Generating XAI explanation using {llm_service.XAI_MODEL_NAME}...")
+                sentiment_result, xai_explanation = llm_service.analyze_and_explain(user_input)
+            else:
+                sentiment_result = sentiment_service.analyze_sentiment(user_input)
 
         # 3. 返回结果
         return jsonify({
@@ -772,7 +1363,7 @@ def analyze():
         })
 
     except Exception as e:
-        print(f"Error in /analyze: {e}")
+        log.exception("route_failed", f"Error in /analyze: {e}", route="/analyze", error=str(e))
         return jsonify({"error": str(e)}), 500
 
 
@@ -790,77 +1381,111 @@ def end_dialogue():
         if error_response:
             return error_response
 
+        wait_for_post_turn_jobs(participant_id)
         session = llm_service.get_session(participant_id)
-        current_index = status.get("current_step_index")
-
-        # 确定 Step Name
-        step_name = "DIALOGUE_END_UNKNOWN"
-        next_step_index = -1
-        session_part = 1
+        step_name, next_step_index, dialogue_end_data = build_dialogue_end(participant_id, status, session)
 
-        # 逻辑：查找 DIALOGUE_1 或 DIALOGUE_2
-        if "DIALOGUE_1" in EXPERIMENT_STEPS and current_index == EXPERIMENT_STEPS.index("DIALOGUE_1"):
-            step_name = "DIALOGUE_END_1"
-            session_part = 1
-            next_step_index = current_index + 1
-        elif "DIALOGUE_2" in EXPERIMENT_STEPS and current_index == EXPERIMENT_STEPS.index("DIALOGUE_2"):
-            step_name = "DIALOGUE_END_2"
-            session_part = 2
-            next_step_index = current_index + 1
-        else:
-            # Fallback
-            print(f"Warning: end_dialogue at index {current_index}, defaulting advancement.")
-            next_step_index = current_index + 1
-
-        # --- 计算情绪波动 (Emotion Fluctuation) ---
-        # 使用内存中累积的 session['sentiment_scores']
-        sentiment_scores = session.get('sentiment_scores', [])
-        fluctuation = 0.0
-
-        if len(sentiment_scores) > 1:
-            # 计算标准差 (Standard Deviation) 作为波动的代理指标
-            fluctuation = np.std(sentiment_scores)
-
-        # 记录结束数据
-        dialogue_end_data = {
-            "status": "Completed by user",
-            "end_time": time.time(),
-            "total_turns": session.get('turn_count', 0),
-            "session_part": session_part,
-            "emotion_fluctuation": round(fluctuation, 4),  # 写入波动数据
-            "emotion_trajectory": sentiment_scores  # 同时记录轨迹，方便复查
-        }
+        if step_name == "DIALOGUE_END_UNKNOWN":
+            return stale_step_response(participant_id, status)
 
-        if not data_manager.save_participant_data(participant_id, step_name, dialogue_end_data):
+        # 保存对话结束数据并推进步骤 (并发的重复请求只有一个能推进)
+        updated_status, advanced = data_manager.advance_participant_step(
+            participant_id, step_name, dialogue_end_data, status.get("current_step_index"), next_step_index,
+            status=status
+        )
+        if updated_status is None:
             return jsonify({"error": "Failed to save dialogue end data."}), 500
+        update_request_participant_status(participant_id, updated_status)
+        if not advanced:
+            return stale_step_response(participant_id, updated_status)
 
-        # 推进步骤
-        if not data_manager.update_participant_step(participant_id, next_step_index):
-            return jsonify({"error": "Failed to update participant step."}), 500
-
-        # 获取下一个 URL
-        status = data_manager.get_participant_status(participant_id)
-        current_condition = status.get("condition")
-
-        if next_step_index >= len(EXPERIMENT_STEPS):
-            next_url_path = "/html/debrief.html"
-        else:
-            next_step_key = EXPERIMENT_STEPS[next_step_index]
-            next_url_path = get_url_for_step(next_step_key, current_condition, participant_id).split('?')[0]
-
+        # 获取下一个 URL (使用请求内已更新的状态)
         return jsonify({
             "success": True,
-            "next_url": f"{next_url_path}?pid={participant_id}",
+            "next_url": next_step_url(participant_id, next_step_index, status.get("condition")),
             "next_step_index": next_step_index
         })
 
     except Exception as e:
-        print(f"Error in /end_dialogue: {e}")
-        import traceback
-        traceback.print_exc()
+        log.exception("route_failed", f"Error in /end_dialogue: {e}", route="/end_dialogue", error=str(e))
         return jsonify({"error": "Internal server error."}), 500
 
 
+def wait_for_post_turn_jobs(participant_id: str):
+    """等待该参与者尚未完成的 post-turn 任务，保证情绪轨迹包含最后一轮"""
+    deadline = time.monotonic() + POST_TURN_WAIT_TIMEOUT_SECONDS
+    done = post_turn_queue.wait_for_key(participant_id, timeout=POST_TURN_WAIT_TIMEOUT_SECONDS)
+    if done and llm_service.session_store.shared:
+        # 多 worker 部署：最后一轮可能由其他进程处理，按会话中的计数等待 (每轮完成后 post_turns_done 加一)
+        while True:
+            session = llm_service.get_session(participant_id)
+            done = session.get('post_turns_done', 0) >= session.get('turn_count', 0)
+            if done or time.monotonic() >= deadline:
+                break
+            time.sleep(POST_TURN_POLL_INTERVAL_SECONDS)
+    if not done:
+        log.warning("post_turn_pending",
+                    f"⚠️ Post-turn jobs for PID {participant_id} still pending; emotion trajectory may be incomplete.",
+                    participant_id=participant_id)
+
+
+def build_dialogue_end(participant_id: str, status: dict, session: dict) -> tuple:
+    """返回 (step_name, next_step_index, dialogue_end_data)"""
+    current_index = status.get("current_step_index")
+
+    # 确定 Step Name
+    step_name = "DIALOGUE_END_UNKNOWN"
+    next_step_index = -1
+    session_part = 1
+
+    # 逻辑：查找 DIALOGUE_1 或 DIALOGUE_2
+    if "DIALOGUE_1" in EXPERIMENT_STEPS and current_index == EXPERIMENT_STEPS.index("DIALOGUE_1"):
+        step_name = "DIALOGUE_END_1"
+        session_part = 1
+        next_step_index = current_index + 1
+    elif "DIALOGUE_2" in EXPERIMENT_STEPS and current_index == EXPERIMENT_STEPS.index("DIALOGUE_2"):
+        step_name = "DIALOGUE_END_2"
+        session_part = 2
+        next_step_index = current_index + 1
+    else:
+        # 不在对话步骤上 (如重复结束对话)：路由按过期步骤拒绝，不推进
+        log.warning("end_dialogue_unexpected_step",
+                    f"Warning: end_dialogue at index {current_index}, which is not a dialogue step.",
+                    participant_id=participant_id, step_index=current_index)
+        next_step_index = current_index + 1
+
+    # --- 计算情绪波动 (Emotion Fluctuation) ---
+    # 使用会话中累积的 session['sentiment_scores']
+    sentiment_scores = session.get('sentiment_scores', [])
+    fluctuation = 0.0
+
+    if len(sentiment_scores) > 1:
+        # 计算标准差 (Standard Deviation) 作为波动的代理指标
+        fluctuation = np.std(sentiment_scores)
+
+    # 记录结束数据
+    dialogue_end_data = {
+        "status": "Completed by user",
+        "end_time": time.time(),
+        "total_turns": session.get('turn_count', 0),
+        "session_part": session_part,
+        "emotion_fluctuation": round(fluctuation, 4),  # 写入波动数据
+        "emotion_trajectory": sentiment_scores,  # 同时记录轨迹，方便复查
+        # 该参与者到目前为止 (含之前的对话阶段) 各类 LLM 调用的次数、延迟和 token 用量
+        "llm_usage": llm_service.get_participant_usage(participant_id)
+    }
+    return step_name, next_step_index, dialogue_end_data
+
+
+def next_step_url(participant_id: str, next_step_index: int, condition: str) -> str:
+    if next_step_index >= len(EXPERIMENT_STEPS):
+        next_url_path = "/html/debrief.html"
+    else:
+        next_step_key = EXPERIMENT_STEPS[next_step_index]
+        next_url_path = get_url_for_step(next_step_key, condition, participant_id).split('?')[0]
+    return f"{next_url_path}?pid={participant_id}"
+
+
 @app.route('/save_contact', methods=['POST'])
 def save_contact():
     try:
@@ -881,21 +1506,21 @@ def save_contact():
             return jsonify({"error": "Failed to save contact data to DB."}), 500
 
     except Exception as e:
-        print(f"Error in /save_contact: {e}")
+        log.exception("route_failed", f"Error in /save_contact: {e}", route="/save_contact", error=str(e))
         return jsonify({"error": "Internal server error during contact save."}), 500
 
 
 # (运行 Flask 服务器的 main 保持不变)
 if __name__ == "__main__":
-    print("🚀 Starting Flask server on http://127.0.0.1:5000")
-    print("💾 Data will be saved to: MongoDB Atlas (hci_experiment)")
-    print(f"🔄 Experiment Flow Steps: {EXPERIMENT_STEPS}")
+    log.info("server_starting", "🚀 Starting Flask server on http://127.0.0.1:5000")
+    log.info("server_starting", "💾 Data will be saved to: MongoDB Atlas (hci_experiment)")
+    log.info("server_starting", f"🔄 Experiment Flow Steps: {EXPERIMENT_STEPS}", steps=EXPERIMENT_STEPS)
 
-    print("🧠 Initializing Sentiment Engine...")
+    log.info("server_starting", "🧠 Initializing Sentiment Engine...")
     sentiment_service.init_sentiment_model()
 
     # backend/app.py (修改后)
-    print("🚦 Running Flask in MULTI-THREADED mode.")
+    log.info("server_starting", "🚦 Running Flask in MULTI-THREADED mode.")
     # 允许并发处理 /chat 和 /analyze
     app.run(debug=False, port=5000, threaded=True, use_reloader=False)
 
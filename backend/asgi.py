@@ -0,0 +1,464 @@
+# backend/asgi.py
+"""
+ASGI 入口 (异步服务模式):
+
+    uvicorn backend.asgi:app --workers 4
+    gunicorn -k uvicorn.workers.UvicornWorker -w 4 backend.asgi:app
+
+POST /chat、/chat_turn、/analyze、/end_dialogue 在事件循环上处理 (google-genai 的 client.aio + pymongo 的 AsyncMongoClient)，
+进行中的聊天流只是一个协程，不再各占一个线程；路由、请求体和响应格式与 Flask 版本一致，前端无需改动。
+其余路由 (页面、问卷、管理后台) 原样交给 Flask，在 ASGI_WSGI_THREADS 大小的线程池中执行。
+
+WSGI 部署 (gunicorn backend.app:app) 不受影响，两种模式共用同一套业务代码和配置。
+MONGO_URI=mongomock:// 时没有异步驱动，数据库调用退回到线程池 (见 data_manager 的 *_async 函数)。
+"""
+import asyncio
+import io
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+from backend import app as flask_module
+from backend import data_manager, event_log, llm_service, llm_usage, sentiment_service
+from backend.config import ASGI_WSGI_THREADS
+
+log = event_log.get_event_logger(__name__)
+
+_NOT_FOUND_ERROR = "Participant session not found. Please use a valid experiment link."
+
+
+class _Request:
+    def __init__(self, scope: dict, body: bytes):
+        self.scope = scope
+        self.body = body
+        self.headers = {
+            name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope.get("headers", [])
+        }
+
+    def json(self):
+        """请求体解析后的 JSON 对象；不是 JSON 对象时返回 None"""
+        try:
+            data = json.loads(self.body or b"null")
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+
+class _Response:
+    def __init__(self, body: bytes = b"", status: int = 200, content_type: str = "application/json",
+                 stream=None):
+        self.body = body
+        self.status = status
+        self.content_type = content_type
+        self.stream = stream
+
+
+def _json_response(payload: dict, status: int = 200) -> _Response:
+    # 与 Flask jsonify 的输出一致 (紧凑、键排序、末尾换行)
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")) + "\n"
+    return _Response(body.encode("utf-8"), status)
+
+
+def _text_response(text: str, status: int = 200) -> _Response:
+    return _Response(text.encode("utf-8"), status, "text/plain; charset=utf-8")
+
+
+# --- 异步路由 ---
+async def chat(request: _Request, request_id: str) -> _Response:
+    data = request.json() or {}
+    user_input = data.get("message", "")
+    participant_id = data.get("participant_id", "")
+    explanation_shown = data.get("explanation_shown", False)
+
+    if not user_input or not participant_id:
+        return _text_response("⚠️ No message or participant_id provided", 400)
+
+    event_log.bind_participant(participant_id)
+    status = await data_manager.get_participant_status_async(participant_id)
+    if not status:
+        return _json_response({"error": _NOT_FOUND_ERROR}, 404)
+
+    condition = status.get("condition", "UNKNOWN")
+    session_part = flask_module.chat_session_part(status)
+    session = await asyncio.to_thread(llm_service.get_session, participant_id)
+    current_turn = session['turn_count'] + 1
+    user_metrics = flask_module.calculate_text_metrics(user_input)
+
+    async def generate_stream_and_log():
+        full_ai_reply = b''
+        stream_error = None
+
+        try:
+            # 显式关闭内层流，保证 AI 回复写回会话之后才排队 post-turn 任务
+            async with aclosing(llm_service.get_llm_response_stream_async(participant_id, user_input)) as stream:
+                async for chunk in stream:
+                    full_ai_reply += chunk
+                    yield chunk
+
+        except Exception as e:
+            stream_error = e
+            log.error("llm_stream_failed", f"Error during LLM stream: {e}",
+                      participant_id=participant_id, request_id=request_id, error=str(e))
+            yield f"⚠️ Backend LLM error: {e}".encode('utf-8')
+
+        finally:
+            if not stream_error and full_ai_reply:
+                # submit 在队列满时会短暂阻塞 (背压)，放到线程池
+                await asyncio.to_thread(
+                    flask_module.queue_post_turn, participant_id, user_input, condition, current_turn, session_part,
+                    user_metrics, explanation_shown, request_id
+                )
+
+    return _Response(status=200, content_type="text/plain; charset=utf-8", stream=generate_stream_and_log())
+
+
+async def chat_turn(request: _Request, request_id: str) -> _Response:
+    """/chat_turn 的异步版本：分析和聊天流是两个任务，事件按完成顺序写出 (事件格式见 app.py)"""
+    data = request.json() or {}
+    user_input = data.get("message", "")
+    participant_id = data.get("participant_id", "")
+
+    if not user_input or not participant_id:
+        return _json_response({"error": "No message or participant_id provided"}, 400)
+
+    event_log.bind_participant(participant_id)
+    status = await data_manager.get_participant_status_async(participant_id)
+    if not status:
+        return _json_response({"error": _NOT_FOUND_ERROR}, 404)
+
+    condition = status.get("condition", "UNKNOWN")
+    with_analysis = condition == "XAI"
+    explanation_shown = data.get("explanation_shown", with_analysis)
+    session_part = flask_module.chat_session_part(status)
+    session = await asyncio.to_thread(llm_service.get_session, participant_id)
+    current_turn = session['turn_count'] + 1
+    user_metrics = flask_module.calculate_text_metrics(user_input)
+    turn_event = flask_module.turn_event
+
+    async def generate_events():
+        events = asyncio.Queue()  # 事件字节；None 表示某个任务结束
+
+        async def run_analysis():
+            try:
+                with llm_usage.participant_scope(participant_id):
+                    _, explanation = await llm_service.analyze_and_explain_async(
+                        user_input,
+                        on_sentiment=lambda sentiment: events.put_nowait(turn_event("sentiment", sentiment=sentiment))
+                    )
+                    events.put_nowait(turn_event("explanation", explanation=explanation))
+            except Exception as e:
+                log.exception("turn_analysis_failed", f"Error analyzing turn: {e}", error=str(e))
+                events.put_nowait(turn_event("error", stage="analysis", error=str(e)))
+            finally:
+                events.put_nowait(None)
+
+        async def run_chat() -> bool:
+            full_ai_reply = b''
+            stream_error = None
+            saved = False
+            try:
+                async with aclosing(
+                    llm_service.get_llm_response_stream_async(participant_id, user_input, raise_errors=True)
+                ) as stream:
+                    async for chunk in stream:
+                        full_ai_reply += chunk
+                        events.put_nowait(turn_event("token", text=chunk.decode('utf-8', errors='replace')))
+            except Exception as e:
+                stream_error = e
+                log.error("llm_stream_failed", f"Error during LLM stream: {e}",
+                          participant_id=participant_id, request_id=request_id, error=str(e))
+                events.put_nowait(turn_event("error", stage="chat", error=str(e)))
+            finally:
+                if not stream_error and full_ai_reply:
+                    saved = await asyncio.to_thread(
+                        flask_module.queue_post_turn, participant_id, user_input, condition, current_turn,
+                        session_part, user_metrics, explanation_shown, request_id
+                    )
+                events.put_nowait(None)
+            return saved
+
+        chat_task = asyncio.create_task(run_chat())
+        tasks = [chat_task]
+        if with_analysis:
+            tasks.append(asyncio.create_task(run_analysis()))
+        try:
+            running = len(tasks)
+            while running:
+                event = await events.get()
+                if event is None:
+                    running -= 1
+                else:
+                    yield event
+            if chat_task.result():
+                yield turn_event("turn_saved", turn=current_turn)
+        finally:
+            # 客户端断开时停止仍在进行的任务
+            for task in tasks:
+                task.cancel()
+
+    return _Response(status=200, content_type="application/x-ndjson", stream=generate_events())
+
+
+async def analyze(request: _Request, request_id: str) -> _Response:
+    try:
+        data = request.json() or {}
+        user_input = data.get("message", "")
+        participant_id = data.get("participant_id", "")
+
+        if not user_input:
+            return _json_response({"error": "No input provided"}, 400)
+
+        event_log.bind_participant(participant_id)
+        status = await data_manager.get_participant_status_async(participant_id)
+        if not status:
+            return _json_response({"error": _NOT_FOUND_ERROR}, 404)
+
+        log.debug("sentiment_requested", f"🧠 Analyzing sentiment for PID {participant_id}...")
+        with llm_usage.participant_scope(participant_id):
+            xai_explanation = ""
+            if status.get("condition", "NON_XAI") == "XAI":
+                log.debug("xai_requested", f"🤖 Generating XAI explanation using {llm_service.XAI_MODEL_NAME}...")
+                sentiment_result, xai_explanation = await llm_service.analyze_and_explain_async(user_input)
+            else:
+                sentiment_result = await sentiment_service.analyze_sentiment_async(user_input)
+
+        return _json_response({
+            "success": True,
+            "sentiment": sentiment_result,
+            "explanation": xai_explanation
+        })
+
+    except Exception as e:
+        log.exception("route_failed", f"Error in /analyze: {e}", route="/analyze", error=str(e))
+        return _json_response({"error": str(e)}, 500)
+
+
+async def end_dialogue(request: _Request, request_id: str) -> _Response:
+    try:
+        data = request.json() or {}
+        participant_id = data.get("participant_id")
+
+        if not participant_id:
+            return _json_response({"error": "Missing participant_id"}, 400)
+
+        event_log.bind_participant(participant_id)
+        status = await data_manager.get_participant_status_async(participant_id)
+        if not status:
+            return _json_response({"error": _NOT_FOUND_ERROR}, 404)
+
+        await asyncio.to_thread(flask_module.wait_for_post_turn_jobs, participant_id)
+        session = await asyncio.to_thread(llm_service.get_session, participant_id)
+        step_name, next_step_index, dialogue_end_data = flask_module.build_dialogue_end(
+            participant_id, status, session
+        )
+
+        if step_name == "DIALOGUE_END_UNKNOWN":
+            return _json_response(flask_module.stale_step_body(participant_id, status), 409)
+
+        updated_status, advanced = await data_manager.advance_participant_step_async(
+            participant_id, step_name, dialogue_end_data, status.get("current_step_index"), next_step_index,
+            status=status
+        )
+        if updated_status is None:
+            return _json_response({"error": "Failed to save dialogue end data."}, 500)
+        if not advanced:
+            return _json_response(flask_module.stale_step_body(participant_id, updated_status), 409)
+
+        return _json_response({
+            "success": True,
+            "next_url": flask_module.next_step_url(participant_id, next_step_index, status.get("condition")),
+            "next_step_index": next_step_index
+        })
+
+    except Exception as e:
+        log.exception("route_failed", f"Error in /end_dialogue: {e}", route="/end_dialogue", error=str(e))
+        return _json_response({"error": "Internal server error."}, 500)
+
+
+ASYNC_ROUTES = {
+    ("POST", "/chat"): chat,
+    ("POST", "/chat_turn"): chat_turn,
+    ("POST", "/analyze"): analyze,
+    ("POST", "/end_dialogue"): end_dialogue,
+}
+
+
+# --- ASGI 应用 ---
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    return b"".join(chunks)
+
+
+def _wsgi_environ(scope: dict, body: bytes) -> dict:
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    root_path = scope.get("root_path", "")
+    path = scope["path"]
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": root_path.encode("utf-8").decode("latin-1"),
+        "PATH_INFO": path.encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(server[0]),
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif key != "CONTENT_LENGTH":
+            key = f"HTTP_{key}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiApp:
+    def __init__(self, wsgi_app, routes: dict, wsgi_threads: int = ASGI_WSGI_THREADS):
+        self._wsgi_app = wsgi_app
+        self._routes = routes
+        self._executor = ThreadPoolExecutor(max_workers=max(1, wsgi_threads), thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        body = await _read_body(receive)
+        handler = self._routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            await self._call_wsgi(scope, body, send)
+        else:
+            await self._call_async(handler, _Request(scope, body), receive, send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                sentiment_service.init_sentiment_model()
+                log.info("asgi_started", f"🚦 ASGI mode: async routes {sorted(path for _, path in self._routes)}, "
+                                         f"async Mongo driver: {data_manager.async_driver_enabled()}")
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await data_manager.close_async_client()
+                self._executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _call_async(self, handler, request: _Request, receive, send):
+        """执行异步路由，并按 Flask 版本相同的方式记录请求指标和关联 ID"""
+        endpoint = handler.__name__
+        method = request.scope["method"]
+        request_id = request.headers.get("x-request-id") or event_log.new_request_id()
+        log_tokens = event_log.bind_request(request_id)
+        started = time.perf_counter()
+        status = 500
+        flask_module.REQUESTS_IN_FLIGHT.inc(endpoint)
+        try:
+            try:
+                response = await handler(request, request_id)
+            except Exception as e:
+                log.exception("route_failed", f"Error in {request.scope['path']}: {e}",
+                              route=request.scope["path"], error=str(e))
+                response = _json_response({"error": "Internal server error."}, 500)
+            status = response.status
+            headers = [
+                (b"content-type", response.content_type.encode("latin-1")),
+                (b"x-request-id", request_id.encode("latin-1")),
+            ]
+            if response.stream is None:
+                headers.append((b"content-length", str(len(response.body)).encode("latin-1")))
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await send({"type": "http.response.body", "body": response.body})
+            else:
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                await self._send_stream(response.stream, endpoint, started, receive, send)
+        finally:
+            duration = time.perf_counter() - started
+            flask_module.REQUESTS_TOTAL.inc(endpoint, method, status)
+            flask_module.REQUEST_DURATION.observe(duration, endpoint, method)
+            flask_module.REQUESTS_IN_FLIGHT.dec(endpoint)
+            event_log.unbind_request(log_tokens)
+
+    async def _send_stream(self, stream, endpoint: str, started: float, receive, send):
+        # 请求体已读完，之后 receive() 只会在客户端断开时返回；断开后停止生成，与 WSGI 下写入失败关闭生成器一致
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected.set()
+
+        watcher = asyncio.create_task(watch_disconnect())
+        first_chunk_seen = False
+        try:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    if disconnected.is_set():
+                        break
+                    if not first_chunk_seen:
+                        first_chunk_seen = True
+                        flask_module.STREAM_FIRST_BYTE.observe(time.perf_counter() - started, endpoint)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if not disconnected.is_set():
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            flask_module.STREAM_DURATION.observe(time.perf_counter() - started, endpoint)
+
+    async def _call_wsgi(self, scope: dict, body: bytes, send):
+        """在线程池中执行 Flask；响应体逐块转发 (流式响应同样适用)"""
+        loop = asyncio.get_running_loop()
+        environ = _wsgi_environ(scope, body)
+        state = {}
+
+        def start_response(status, headers, exc_info=None):
+            state["status"] = int(status.split(" ", 1)[0])
+            state["headers"] = headers
+            return state.setdefault("written", []).append
+
+        def begin():
+            iterable = self._wsgi_app(environ, start_response)
+            iterator = iter(iterable)
+            return iterable, iterator, next(iterator, None)
+
+        iterable, iterator, chunk = await loop.run_in_executor(self._executor, begin)
+        try:
+            headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in state["headers"]]
+            await send({"type": "http.response.start", "status": state["status"], "headers": headers})
+            for written in state.pop("written", []):
+                await send({"type": "http.response.body", "body": written, "more_body": True})
+            while chunk is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await loop.run_in_executor(self._executor, next, iterator, None)
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                await loop.run_in_executor(self._executor, close)
+
+
+app = AsgiApp(flask_module.app, ASYNC_ROUTES)
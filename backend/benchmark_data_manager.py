@@ -0,0 +1,251 @@
+# backend/benchmark_data_manager.py
+"""
+data_manager 热点函数的微基准测试：记录每次调用的 MongoDB 往返次数和耗时，
+并与已保存的基线比较，超出阈值时以非零状态退出 (可用于 CI)。
+
+默认使用 mongomock (MONGO_URI=mongomock://) 并按 --scale 预置数据，不会访问真实数据库。
+往返次数与机器无关，可以直接比较；耗时基线只在同一台机器 / 同一数据库后端上才有意义，
+更换环境后请先用 --update-baseline 重新生成。
+
+用法:
+    python -m backend.benchmark_data_manager                      # 与基线比较
+    python -m backend.benchmark_data_manager --update-baseline    # 重新生成基线
+    python -m backend.benchmark_data_manager --scale 0.1 --create-sizes 10,1000
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+
+
+def _timed_calls(data_manager, func, iterations: int, before_each=None) -> dict:
+    """执行 func(i) iterations 次，返回耗时分布和每次调用的最大往返次数 (与 timeit 一样，计时期间关闭 GC)"""
+    durations = []
+    round_trips = []
+    gc.collect()
+    gc.disable()
+    try:
+        for i in range(iterations):
+            if before_each:
+                before_each(i)
+            data_manager.begin_operation_scope()
+            started = time.perf_counter()
+            func(i)
+            durations.append(time.perf_counter() - started)
+            counts = data_manager.end_operation_scope()
+            round_trips.append(counts["reads"] + counts["writes"])
+    finally:
+        gc.enable()
+    durations.sort()
+    return {
+        "iterations": iterations,
+        "round_trips": max(round_trips),
+        "median_ms": round(statistics.median(durations) * 1000, 4),
+        "p95_ms": round(durations[max(0, math.ceil(len(durations) * 0.95) - 1)] * 1000, 4),
+        "mean_ms": round(statistics.fmean(durations) * 1000, 4),
+    }
+
+
+def seed_data(data_manager, participants: int, batches: int, links_per_batch: int, rng: random.Random) -> dict:
+    """预置参与者、邀请批次和链接 (全部写入测试库)"""
+    participant_ids = []
+    tokens = []
+    batch_ids = []
+    for b in range(batches):
+        batch = data_manager.create_invite_batch(
+            batch_name=f"bench-{b}", language=rng.choice(["en", "zh-CN"]), condition_order=rng.choice(["AB", "BA"]),
+            quantity=links_per_batch, invite_type="test"
+        )
+        batch_ids.append(batch["batch_id"])
+        tokens.extend(link["token"] for link in batch["links"])
+        for link in batch["links"]:
+            if len(participant_ids) < participants:
+                data_manager.init_participant_session(
+                    link["participant_id"], link["condition_order"], link["language"], "test"
+                )
+                participant_ids.append(link["participant_id"])
+    return {"participant_ids": participant_ids, "tokens": tokens, "batch_ids": batch_ids}
+
+
+def run_benchmarks(data_manager, seeded: dict, create_sizes: list, iterations: int, rng: random.Random) -> dict:
+    participant_ids = seeded["participant_ids"]
+    tokens = seeded["tokens"]
+    batch_ids = seeded["batch_ids"]
+    pick = lambda values: values[rng.randrange(len(values))]
+    results = {}
+
+    results["get_participant_status[cached]"] = _timed_calls(
+        data_manager, lambda i: data_manager.get_participant_status(participant_ids[i % len(participant_ids)]),
+        iterations, before_each=lambda i: data_manager.get_participant_status(participant_ids[i % len(participant_ids)])
+    )
+    results["get_participant_status[uncached]"] = _timed_calls(
+        data_manager, lambda i: data_manager.get_participant_status(participant_ids[i % len(participant_ids)]),
+        iterations, before_each=lambda i: data_manager._status_cache_invalidate(participant_ids[i % len(participant_ids)])
+    )
+    results["save_participant_data"] = _timed_calls(
+        data_manager,
+        lambda i: data_manager.save_participant_data(pick(participant_ids), "BASELINE_MOOD", {"mood": i % 7}),
+        iterations
+    )
+    step_indexes = {participant_id: -1 for participant_id in participant_ids}
+
+    def advance(i):
+        participant_id = participant_ids[i % len(participant_ids)]
+        completed_index = step_indexes[participant_id]
+        data_manager.advance_participant_step(participant_id, "BENCHMARK_STEP", {"step": i}, completed_index,
+                                              completed_index + 1)
+        step_indexes[participant_id] = completed_index + 1
+
+    results["advance_participant_step"] = _timed_calls(data_manager, advance, iterations)
+    results["save_turn_data"] = _timed_calls(
+        data_manager,
+        lambda i: data_manager.save_turn_data(pick(participant_ids), {
+            "turn": i, "condition": "XAI", "user_input": "benchmark message", "ai_response": "benchmark reply",
+            "user_sentiment_score": 0.5, "explanation_shown": True
+        }),
+        iterations
+    )
+    results["redeem_invite_token"] = _timed_calls(
+        data_manager, lambda i: data_manager.redeem_invite_token(tokens[i % len(tokens)]), iterations
+    )
+    results["list_invite_batches"] = _timed_calls(
+        data_manager, lambda i: data_manager.list_invite_batches(), max(1, iterations // 20)
+    )
+    results["list_invite_links_for_batch"] = _timed_calls(
+        data_manager, lambda i: data_manager.list_invite_links_for_batch(pick(batch_ids)), max(1, iterations // 4)
+    )
+    # 创建批次放在最后，避免新增的大批次改变前面列表查询的数据规模
+    for size in create_sizes:
+        # 大批次只跑少量迭代
+        size_iterations = max(1, min(iterations, 10000 // max(size, 1)))
+        results[f"create_invite_batch[{size}]"] = _timed_calls(
+            data_manager,
+            lambda i, size=size: data_manager.create_invite_batch(
+                batch_name=f"bench-create-{size}-{i}", language="en", condition_order="AB", quantity=size,
+                invite_type="test"
+            ),
+            size_iterations
+        )
+    return results
+
+
+def compare_to_baseline(results: dict, baseline: dict, time_threshold: float, min_delta_ms: float) -> list:
+    """
+    返回回归列表。往返次数只要比基线多就算回归；
+    耗时 (中位数) 需同时超过 基线 × (1 + time_threshold) 和 基线 + min_delta_ms 才算回归，以过滤噪声。
+    """
+    regressions = []
+    for name, expected in baseline.get("results", {}).items():
+        actual = results.get(name)
+        if actual is None:
+            continue
+        if actual["round_trips"] > expected["round_trips"]:
+            regressions.append(f"{name}: round trips {expected['round_trips']} -> {actual['round_trips']}")
+        limit = max(expected["median_ms"] * (1 + time_threshold), expected["median_ms"] + min_delta_ms)
+        if actual["median_ms"] > limit:
+            regressions.append(
+                f"{name}: median {expected['median_ms']:.3f}ms -> {actual['median_ms']:.3f}ms (limit {limit:.3f}ms)"
+            )
+    return regressions
+
+
+def print_results(results: dict, baseline: dict):
+    expected = baseline.get("results", {})
+    print(f"\n   {'benchmark':<40}{'trips':>7}{'median ms':>12}{'p95 ms':>10}{'baseline ms':>13}")
+    for name, stats in results.items():
+        base = expected.get(name, {}).get("median_ms")
+        base_text = f"{base:.3f}" if base is not None else "-"
+        print(f"   {name:<40}{stats['round_trips']:>7}{stats['median_ms']:>12.3f}{stats['p95_ms']:>10.3f}"
+              f"{base_text:>13}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the hot data_manager functions.")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="seed size multiplier (1.0 = 1000 participants, 200 batches x 50 links)")
+    parser.add_argument("--create-sizes", default="10,1000,100000", help="create_invite_batch link counts")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mongo-uri", help="default: mongomock://; a real server writes to the test database")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    # mongomock 下同一代码在不同进程间的中位数耗时可相差 40% 左右，默认阈值留足余量
+    parser.add_argument("--time-threshold", type=float, default=1.0,
+                        help="allowed relative slowdown of the median before failing")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="ignore slowdowns smaller than this many milliseconds")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    # 必须在导入 data_manager 之前设置
+    os.environ["MONGO_URI"] = args.mongo_uri or "mongomock://"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    from backend import data_manager
+
+    rng = random.Random(args.seed)
+    create_sizes = [int(size) for size in args.create_sizes.split(",") if size.strip()]
+    participants = max(1, int(1000 * args.scale))
+    batches = max(1, int(200 * args.scale))
+
+    # data_manager 每次写入都会记一条日志 (上面已把级别调到 WARNING)，其余输出在基准测试期间丢弃。
+    # mongomock 的唯一索引检查是逐条扫描 (插入为 O(n²))，因此只在真实服务器上建索引。
+    with contextlib.redirect_stdout(io.StringIO()):
+        if args.mongo_uri:
+            data_manager.create_data_dir()
+        seed_started = time.perf_counter()
+        seeded = seed_data(data_manager, participants, batches, 50, rng)
+        seed_seconds = time.perf_counter() - seed_started
+        results = run_benchmarks(data_manager, seeded, create_sizes, args.iterations, rng)
+
+    print(f"🌱 Seeded {participants} participants, {batches} batches ({len(seeded['tokens'])} links) "
+          f"in {seed_seconds:.1f}s")
+    report = {
+        "config": {"scale": args.scale, "create_sizes": create_sizes, "iterations": args.iterations,
+                   "seed": args.seed, "mongo": "mongomock" if not args.mongo_uri else "server"},
+        "results": results,
+    }
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"\n💾 Baseline written to {args.baseline}")
+        return 0
+
+    if not baseline:
+        print(f"\n⚠️ No baseline at {args.baseline}; run with --update-baseline to create one.")
+        return 0
+    if baseline.get("config", {}).get("scale") != args.scale:
+        print(f"\n⚠️ Baseline was recorded at scale {baseline['config'].get('scale')}; timings may not be comparable.")
+
+    regressions = compare_to_baseline(results, baseline, args.time_threshold, args.min_delta_ms)
+    if regressions:
+        print("\n❌ Regressions against baseline:")
+        for regression in regressions:
+            print(f"   {regression}")
+        return 1
+    print("\n✅ No regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
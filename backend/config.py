@@ -9,6 +9,17 @@ load_dotenv(os.path.join(os.path.dirname(__file__), '.env'))
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL_NAME = "gemini-2.5-flash"
 
+# LLM 后端: "gemini" (默认) 或 "fake" (本地确定性假模型，用于离线压测，不消耗配额)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+# 假模型的延迟分布 (毫秒): 首 token 延迟和 token 间隔均为 均值 ± 抖动 的正态分布，截断到 0 以上
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "400"))
+FAKE_LLM_TTFT_JITTER_MS = float(os.getenv("FAKE_LLM_TTFT_JITTER_MS", "100"))
+FAKE_LLM_INTER_TOKEN_MS = float(os.getenv("FAKE_LLM_INTER_TOKEN_MS", "30"))
+FAKE_LLM_INTER_TOKEN_JITTER_MS = float(os.getenv("FAKE_LLM_INTER_TOKEN_JITTER_MS", "10"))
+FAKE_LLM_REPLY_TOKENS = int(os.getenv("FAKE_LLM_REPLY_TOKENS", "40"))
+# 按参与者汇总 LLM 用量时最多保留的参与者数 (超出后淘汰最久未调用的)
+LLM_USAGE_MAX_PARTICIPANTS = int(os.getenv("LLM_USAGE_MAX_PARTICIPANTS", "10000"))
+
 # LLM 服务的系统提示 (主对话用)
 SYSTEM_PROMPT = (
     "You are a gentle and empathetic conversational partner. "
@@ -19,6 +30,82 @@ SYSTEM_PROMPT = (
 
 # 摘要生成间隔
 SUMMARY_INTERVAL = 5
+# 摘要在后台线程生成，不阻塞当前轮次的流式响应
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_QUEUE_SIZE = int(os.getenv("SUMMARY_QUEUE_SIZE", "64"))
+
+# 参与者状态缓存 (data_manager 进程内读穿透缓存)。多 worker 部署应设置 STATUS_CACHE_ENABLED=0，
+# 否则其他进程推进步骤后本进程会在 TTL 内读到过期的 current_step_index (步骤推进本身仍由数据库条件更新保证)
+STATUS_CACHE_ENABLED = os.getenv("STATUS_CACHE_ENABLED", "1") == "1"
+STATUS_CACHE_TTL_SECONDS = float(os.getenv("STATUS_CACHE_TTL_SECONDS", "30"))
+STATUS_CACHE_MAX_ENTRIES = int(os.getenv("STATUS_CACHE_MAX_ENTRIES", "2000"))
+
+# experiment_events / dialogue_turns 的组提交写缓冲：攒够 MAX_RECORDS 条或最早一条等待 MAX_DELAY 秒后
+# 用一次无序 insert_many 写入；未写入记录超过 MAX_PENDING 条时由请求线程直接写出。步骤推进不经过缓冲
+WRITE_BUFFER_ENABLED = os.getenv("WRITE_BUFFER_ENABLED", "1") == "1"
+WRITE_BUFFER_MAX_RECORDS = int(os.getenv("WRITE_BUFFER_MAX_RECORDS", "50"))
+WRITE_BUFFER_MAX_DELAY_SECONDS = float(os.getenv("WRITE_BUFFER_MAX_DELAY_SECONDS", "1.0"))
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", "5000"))
+WRITE_BUFFER_MAX_ATTEMPTS = int(os.getenv("WRITE_BUFFER_MAX_ATTEMPTS", "3"))
+
+# 旧格式 ID 的数据库路由表容量 (新 ID 自带数据库编码，无需占用路由表)
+ROUTING_MAP_MAX_ENTRIES = int(os.getenv("ROUTING_MAP_MAX_ENTRIES", "10000"))
+
+# 情绪分析结果缓存 (按文本内容哈希，/analyze 与 /chat 共享，并发相同请求合并为一次调用)
+SENTIMENT_CACHE_TTL_SECONDS = float(os.getenv("SENTIMENT_CACHE_TTL_SECONDS", "600"))
+SENTIMENT_CACHE_MAX_ENTRIES = int(os.getenv("SENTIMENT_CACHE_MAX_ENTRIES", "2048"))
+SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv("SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS", "30"))
+
+# 第一层本地情绪分类 (sentiment_lexicon)：置信度达到阈值时直接返回，不调用 Gemini；只处理不超过 MAX_CHARS 的短文本。
+# 命中的文本按 SHADOW_RATE 抽样在后台再请求一次 Gemini，统计两者一致率，用于调整阈值
+SENTIMENT_LOCAL_TIER = os.getenv("SENTIMENT_LOCAL_TIER", "1") == "1"
+SENTIMENT_LOCAL_THRESHOLD = float(os.getenv("SENTIMENT_LOCAL_THRESHOLD", "0.8"))
+SENTIMENT_LOCAL_MAX_CHARS = int(os.getenv("SENTIMENT_LOCAL_MAX_CHARS", "120"))
+SENTIMENT_LOCAL_SHADOW_RATE = float(os.getenv("SENTIMENT_LOCAL_SHADOW_RATE", "0.1"))
+
+# XAI 分析: "fused" = 情绪 + 解释合并为一次结构化调用 (失败时回退到两次调用)，"two_call" = 先情绪分析再生成解释
+XAI_ANALYSIS_MODE = os.getenv("XAI_ANALYSIS_MODE", "fused").lower()
+# fused 模式下仍按此比例走两次调用，持续比较两条路径的延迟 (llm_xai_analysis_duration_seconds)
+XAI_TWO_CALL_SAMPLE_RATE = float(os.getenv("XAI_TWO_CALL_SAMPLE_RATE", "0.05"))
+
+# 后台 post-turn 处理队列 (每轮对话后的情绪分析 + 写库)
+POST_TURN_WORKERS = int(os.getenv("POST_TURN_WORKERS", "4"))
+POST_TURN_QUEUE_SIZE = int(os.getenv("POST_TURN_QUEUE_SIZE", "256"))
+POST_TURN_QUEUE_PUT_TIMEOUT_SECONDS = float(os.getenv("POST_TURN_QUEUE_PUT_TIMEOUT_SECONDS", "2"))
+POST_TURN_WAIT_TIMEOUT_SECONDS = float(os.getenv("POST_TURN_WAIT_TIMEOUT_SECONDS", "20"))
+# 共享会话存储 (mongo) 时 end_dialogue 轮询会话中 post-turn 完成计数的间隔
+POST_TURN_POLL_INTERVAL_SECONDS = float(os.getenv("POST_TURN_POLL_INTERVAL_SECONDS", "0.2"))
+
+# /chat_turn (合并的事件流) 中与聊天流并行的情绪分析 + XAI 解释线程数 (WSGI 模式)
+TURN_ANALYSIS_WORKERS = int(os.getenv("TURN_ANALYSIS_WORKERS", "16"))
+
+# LLM 会话存储后端: "memory" (单进程) 或 "mongo" (多 worker 进程共享)。
+# mongo 后端下会话、post-turn 完成计数和按参与者的 LLM 用量都保存在 MongoDB 中 (同时应关闭 STATUS_CACHE_ENABLED)；
+# 指标、队列统计等运维数据仍然是每个进程各自的
+SESSION_STORE_BACKEND = os.getenv("SESSION_STORE_BACKEND", "memory")
+# 会话内存预算: 空闲超时淘汰、常驻会话数上限 (LRU)、每个会话保留的历史消息条数
+SESSION_IDLE_TTL_SECONDS = float(os.getenv("SESSION_IDLE_TTL_SECONDS", str(6 * 3600)))
+SESSION_MAX_RESIDENT = int(os.getenv("SESSION_MAX_RESIDENT", "5000"))
+SESSION_HISTORY_MAX_MESSAGES = int(os.getenv("SESSION_HISTORY_MAX_MESSAGES", "20"))
+# 每轮发送给主模型的对话历史 token 预算 (估算值)；超出部分由摘要记忆覆盖
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Prometheus 指标: /metrics 需要管理员登录；设置 METRICS_PORT 后额外在独立端口 (默认只绑定本机) 提供
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_BIND_HOST = os.getenv("METRICS_BIND_HOST", "127.0.0.1")
+# ASGI 模式 (uvicorn backend.asgi:app): /chat、/analyze、/end_dialogue 在事件循环上处理，
+# 其余路由转交给 Flask，在这个大小的线程池中执行
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "32"))
+# 结构化日志: 在后台线程写出，LOG_FORMAT=json (每行一个 JSON 对象) 或 text (本地开发)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# 按事件类型覆盖级别和采样率，例如 LOG_EVENT_LEVELS="step_redirect=DEBUG"、LOG_EVENT_SAMPLING="turn_saved=0.1"
+# (采样只作用于 WARNING 以下的事件)
+LOG_EVENT_LEVELS = os.getenv("LOG_EVENT_LEVELS", "")
+LOG_EVENT_SAMPLING = os.getenv("LOG_EVENT_SAMPLING", "")
+# 调试用：捕获最近几次发送给 Gemini 的完整 prompt (默认关闭)
+LLM_DEBUG_PROMPT_CAPTURE = os.getenv("LLM_DEBUG_PROMPT_CAPTURE", "0") == "1"
+LLM_DEBUG_PROMPT_BUFFER_SIZE = int(os.getenv("LLM_DEBUG_PROMPT_BUFFER_SIZE", "20"))
 
 # 实验数据存储路径
 DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
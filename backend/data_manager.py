@@ -1,45 +1,246 @@
+import asyncio
+import functools
 import os
 import time
 import secrets
 import hashlib
+import re
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 from pymongo.mongo_client import MongoClient
 from pymongo.server_api import ServerApi
 from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import certifi
-from backend.config import VERSION_MAP
+from backend.config import (
+    VERSION_MAP, STATUS_CACHE_ENABLED, STATUS_CACHE_TTL_SECONDS, STATUS_CACHE_MAX_ENTRIES, ROUTING_MAP_MAX_ENTRIES,
+    SESSION_IDLE_TTL_SECONDS, WRITE_BUFFER_ENABLED, WRITE_BUFFER_MAX_RECORDS, WRITE_BUFFER_MAX_DELAY_SECONDS,
+    WRITE_BUFFER_MAX_PENDING, WRITE_BUFFER_MAX_ATTEMPTS
+)
+from backend.event_log import get_event_logger
+from backend.write_buffer import WriteBuffer
+
+log = get_event_logger(__name__)
 
 # 1. Load environment variables and connect to MongoDB
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 
 if not MONGO_URI:
-    print("❌ CRITICAL ERROR: MONGO_URI not found. Please check your .env file.")
+    log.error("mongo_uri_missing", "❌ CRITICAL ERROR: MONGO_URI not found. Please check your .env file.")
 
-client = MongoClient(MONGO_URI, server_api=ServerApi('1'), tlsCAFile=certifi.where())
+if MONGO_URI and MONGO_URI.startswith("mongomock://"):
+    # 本地压测 / 离线运行: 使用内存中的 mongomock (可选依赖，需单独 pip install mongomock)
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("❌ MONGO_URI=mongomock:// requires the optional 'mongomock' package (pip install mongomock).")
+    client = mongomock.MongoClient()
+    # mongomock 的 find_one_and_update 等写操作不是原子的，多线程下串行执行，与真实服务器的单文档原子性一致
+    _mongomock_write_lock = threading.Lock()
+    log.warning("mongomock_in_use", "⚠️ Using in-memory mongomock database. Data will not be persisted.")
+else:
+    client = MongoClient(MONGO_URI, server_api=ServerApi('1'), tlsCAFile=certifi.where())
+    _mongomock_write_lock = None
 PRODUCTION_DB_NAME = os.getenv("MONGO_DB_NAME", "hci_experiment")
 TEST_DB_NAME = os.getenv("MONGO_TEST_DB_NAME", "hci_experiment_test")
 prod_db = client[PRODUCTION_DB_NAME]
 test_db = client[TEST_DB_NAME]
 
 
+# --- MongoDB operation accounting ---
+# 每个 collection 都包一层计数代理，按请求 (线程) 统计读/写次数，用于约束每个请求的数据库往返。
+_READ_OPERATIONS = {"find_one", "find", "aggregate", "count_documents", "distinct"}
+_WRITE_OPERATIONS = {"insert_one", "insert_many", "update_one", "update_many", "delete_one", "delete_many",
+                     "find_one_and_update", "bulk_write"}
+_operation_scope = threading.local()
+_operation_totals = {"reads": 0, "writes": 0}
+_operation_totals_lock = threading.Lock()
+
+
+def _record_operation(kind: str):
+    with _operation_totals_lock:
+        _operation_totals[kind] += 1
+    counts = getattr(_operation_scope, "counts", None)
+    if counts is not None:
+        counts[kind] += 1
+
+
+def _record_participant_fetch(participant_id: str):
+    fetches = getattr(_operation_scope, "participant_fetches", None)
+    if fetches is not None:
+        fetches[participant_id] = fetches.get(participant_id, 0) + 1
+
+
+def begin_operation_scope():
+    """Start counting MongoDB operations issued by the current thread (one scope per HTTP request)."""
+    _operation_scope.counts = {"reads": 0, "writes": 0}
+    _operation_scope.participant_fetches = {}
+
+
+def end_operation_scope() -> dict:
+    """Stop counting and return {"reads", "writes", "participant_fetches"} for the finished scope."""
+    counts = getattr(_operation_scope, "counts", None) or {"reads": 0, "writes": 0}
+    fetches = getattr(_operation_scope, "participant_fetches", None) or {}
+    _operation_scope.counts = None
+    _operation_scope.participant_fetches = None
+    return {**counts, "participant_fetches": fetches}
+
+
+def get_operation_totals() -> dict:
+    with _operation_totals_lock:
+        return dict(_operation_totals)
+
+
+class _CountingCollection:
+    """Thin proxy around a pymongo collection that records every round trip it issues."""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in _READ_OPERATIONS:
+            kind = "reads"
+        elif name in _WRITE_OPERATIONS:
+            kind = "writes"
+        else:
+            return attr
+
+        def counted(*args, **kwargs):
+            _record_operation(kind)
+            if kind == "writes" and _mongomock_write_lock is not None:
+                with _mongomock_write_lock:
+                    return attr(*args, **kwargs)
+            return attr(*args, **kwargs)
+        return counted
+
+
 def _collections_for_db(db):
     return {
-        "participants": db["participants_status"],
-        "experiment_data": db["experiment_events"],
-        "turn_data": db["dialogue_turns"],
-        "contacts": db["follow_up_contacts"],
-        "invite_batches": db["invite_batches"],
-        "invite_links": db["invite_links"],
+        "participants": _CountingCollection(db["participants_status"]),
+        "experiment_data": _CountingCollection(db["experiment_events"]),
+        "turn_data": _CountingCollection(db["dialogue_turns"]),
+        "contacts": _CountingCollection(db["follow_up_contacts"]),
+        "invite_batches": _CountingCollection(db["invite_batches"]),
+        "invite_links": _CountingCollection(db["invite_links"]),
+        "llm_sessions": _CountingCollection(db["llm_sessions"]),
+        "llm_usage": _CountingCollection(db["llm_usage"]),
     }
 
 
 prod_collections = _collections_for_db(prod_db)
 test_collections = _collections_for_db(test_db)
 
+# --- Group-commit write buffer ---
+# experiment_events / dialogue_turns 只追加、请求内不回读，按批次用无序 insert_many 写入 (见 write_buffer)。
+# 步骤推进的事件需要在返回下一步 URL 之前落库，不经过缓冲。
+_write_buffer = WriteBuffer(
+    "mongo_writes",
+    max_records=WRITE_BUFFER_MAX_RECORDS,
+    max_delay=WRITE_BUFFER_MAX_DELAY_SECONDS,
+    max_pending=WRITE_BUFFER_MAX_PENDING,
+    max_attempts=WRITE_BUFFER_MAX_ATTEMPTS
+) if WRITE_BUFFER_ENABLED else None
+
+
+def _insert_record(collections, name: str, record: dict, buffered: bool = True) -> bool:
+    """写入一条事件记录；返回 True 表示进入了写缓冲 (尚未落库)"""
+    if buffered and _write_buffer is not None:
+        database_label = "test" if collections is test_collections else "production"
+        _write_buffer.add(f"{database_label}.{name}", collections[name], record)
+        return True
+    collections[name].insert_one(record)
+    return False
+
+
+def flush_writes():
+    """同步写出写缓冲中的全部记录"""
+    if _write_buffer is not None:
+        _write_buffer.flush()
+
+
+def get_write_buffer_stats() -> dict:
+    if _write_buffer is None:
+        return {"enabled": False}
+    return {"enabled": True, **_write_buffer.get_stats()}
+
+# --- Participant status cache ---
+# 每个页面/API 请求都会读取参与者状态，这里做一层进程内的读穿透缓存 (TTL + LRU 容量上限)。
+# 所有修改 participants_status 的函数都会同步更新或失效对应条目。
+# 这只对本进程的修改成立：多 worker 部署时用 STATUS_CACHE_ENABLED=0 关闭缓存，每次都读数据库。
+_status_cache = OrderedDict()
+_status_cache_lock = threading.Lock()
+_status_cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+
+def _status_cache_enabled() -> bool:
+    return STATUS_CACHE_ENABLED and STATUS_CACHE_TTL_SECONDS > 0 and STATUS_CACHE_MAX_ENTRIES > 0
+
+
+def _status_cache_get(participant_id: str):
+    if not _status_cache_enabled():
+        return None
+    with _status_cache_lock:
+        entry = _status_cache.get(participant_id)
+        if entry is None:
+            _status_cache_stats["misses"] += 1
+            return None
+        expires_at, status = entry
+        if expires_at <= time.monotonic():
+            del _status_cache[participant_id]
+            _status_cache_stats["expirations"] += 1
+            _status_cache_stats["misses"] += 1
+            return None
+        _status_cache.move_to_end(participant_id)
+        _status_cache_stats["hits"] += 1
+        return dict(status)
+
+
+def _status_cache_put(participant_id: str, status: dict):
+    if not _status_cache_enabled():
+        return
+    with _status_cache_lock:
+        _status_cache[participant_id] = (time.monotonic() + STATUS_CACHE_TTL_SECONDS, dict(status))
+        _status_cache.move_to_end(participant_id)
+        while len(_status_cache) > STATUS_CACHE_MAX_ENTRIES:
+            _status_cache.popitem(last=False)
+            _status_cache_stats["evictions"] += 1
+
+
+def _status_cache_update(participant_id: str, fields: dict):
+    """Write-through: apply a $set to the cached document (no-op if not cached)."""
+    with _status_cache_lock:
+        entry = _status_cache.get(participant_id)
+        if entry is not None:
+            entry[1].update(fields)
+
+
+def _status_cache_invalidate(participant_id: str = None):
+    with _status_cache_lock:
+        if participant_id is None:
+            _status_cache_stats["invalidations"] += len(_status_cache)
+            _status_cache.clear()
+        elif _status_cache.pop(participant_id, None) is not None:
+            _status_cache_stats["invalidations"] += 1
+
+
+def get_status_cache_stats() -> dict:
+    with _status_cache_lock:
+        stats = dict(_status_cache_stats)
+        stats["size"] = len(_status_cache)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["max_entries"] = STATUS_CACHE_MAX_ENTRIES
+    stats["ttl_seconds"] = STATUS_CACHE_TTL_SECONDS
+    stats["enabled"] = _status_cache_enabled()
+    return stats
+
+
 def create_data_dir():
     """Placeholder for backward compatibility. MongoDB doesn't need local directories."""
-    print("✅ MongoDB Ready. (Local directory creation skipped)")
+    log.info("mongo_ready", "✅ MongoDB Ready. (Local directory creation skipped)")
 
     try:
         for collection_set in (prod_collections, test_collections):
@@ -48,82 +249,214 @@ def create_data_dir():
             collection_set["invite_links"].create_index("token_hash", unique=True)
             collection_set["invite_links"].create_index("participant_id", unique=True)
             collection_set["invite_links"].create_index("batch_id")
+            collection_set["llm_sessions"].create_index("participant_id", unique=True)
+            # 空闲会话由 MongoDB 后台按 updated_at 自动清理
+            collection_set["llm_sessions"].create_index(
+                "updated_at", expireAfterSeconds=int(SESSION_IDLE_TTL_SECONDS)
+            )
+            collection_set["llm_usage"].create_index("participant_id", unique=True)
+            # 步骤事件的幂等键；其他事件没有这个字段
+            collection_set["experiment_data"].create_index("step_event_key", unique=True, sparse=True)
     except Exception as e:
-        print(f"⚠️ Failed to ensure MongoDB indexes: {e}")
+        log.warning("mongo_index_failed", f"⚠️ Failed to ensure MongoDB indexes: {e}", error=str(e))
 
 
 def _collections_for_invite_type(invite_type: str):
     return test_collections if invite_type == "test" else prod_collections
 
 
+def _collections_for_label(database_label: str):
+    return test_collections if database_label == "test" else prod_collections
+
+
+# --- Database routing ---
+# 新生成的 participant_id / batch_id / token 直接编码所属数据库，无需查询即可路由；
+# 旧格式的 ID 第一次被查到后记入有界的内存路由表，之后同样只需一次查询。
+_DB_CODES = {"production": "p", "test": "t"}
+_DB_LABELS = {code: label for label, code in _DB_CODES.items()}
+_ROUTE_PATTERNS = {
+    "participant": re.compile(r"^P([PT])_[0-9A-F]{16}$"),
+    "token": re.compile(r"^([pt])\.[A-Za-z0-9_-]{32}$"),
+    "batch": re.compile(r"^batch_([pt])_[0-9a-f]{16}$"),
+}
+_route_maps = {kind: OrderedDict() for kind in _ROUTE_PATTERNS}
+_route_lock = threading.Lock()
+_routing_stats = {"encoded_hits": 0, "map_hits": 0, "probes": 0, "probe_queries": 0, "map_evictions": 0}
+
+
+def _encoded_database_label(kind: str, key: str):
+    match = _ROUTE_PATTERNS[kind].match(key or "")
+    if not match:
+        return None
+    return _DB_LABELS[match.group(1).lower()]
+
+
+def _resolve_route(kind: str, key: str):
+    """O(1) routing without touching MongoDB. Returns the collection set or None if unknown."""
+    database_label = _encoded_database_label(kind, key)
+    with _route_lock:
+        if database_label:
+            _routing_stats["encoded_hits"] += 1
+        else:
+            database_label = _route_maps[kind].get(key)
+            if database_label is None:
+                return None
+            _route_maps[kind].move_to_end(key)
+            _routing_stats["map_hits"] += 1
+    return _collections_for_label(database_label)
+
+
+def _remember_route(kind: str, key: str, database_label: str):
+    if _encoded_database_label(kind, key):
+        return
+    with _route_lock:
+        route_map = _route_maps[kind]
+        route_map[key] = database_label
+        route_map.move_to_end(key)
+        while len(route_map) > ROUTING_MAP_MAX_ENTRIES:
+            route_map.popitem(last=False)
+            _routing_stats["map_evictions"] += 1
+
+
+def _probe_databases(kind: str, key: str, collection_name: str, query: dict, projection: dict = None):
+    """Legacy fallback: try production, then test, and remember where the document lives."""
+    with _route_lock:
+        _routing_stats["probes"] += 1
+    for database_label in ("production", "test"):
+        collections = _collections_for_label(database_label)
+        with _route_lock:
+            _routing_stats["probe_queries"] += 1
+        document = collections[collection_name].find_one(query, projection)
+        if document:
+            _remember_route(kind, key, database_label)
+            return collections, document
+    return None, None
+
+
+def _routed_find_one(kind: str, key: str, collection_name: str, query: dict, projection: dict = None):
+    """Run the real read against the routed database; only unknown legacy keys fall back to probing."""
+    collections = _resolve_route(kind, key)
+    if collections is not None:
+        return collections, collections[collection_name].find_one(query, projection)
+    return _probe_databases(kind, key, collection_name, query, projection)
+
+
+def get_routing_stats() -> dict:
+    with _route_lock:
+        stats = dict(_routing_stats)
+        stats["map_sizes"] = {kind: len(route_map) for kind, route_map in _route_maps.items()}
+    stats["map_max_entries"] = ROUTING_MAP_MAX_ENTRIES
+    return stats
+
+
 def _find_participant_collections(participant_id: str):
-    if prod_collections["participants"].find_one({"participant_id": participant_id}, {"_id": 1}):
-        return prod_collections
-    if test_collections["participants"].find_one({"participant_id": participant_id}, {"_id": 1}):
-        return test_collections
-    return None
+    collections = _resolve_route("participant", participant_id)
+    if collections is not None:
+        return collections
+    collections, _ = _probe_databases(
+        "participant", participant_id, "participants", {"participant_id": participant_id}, {"_id": 1}
+    )
+    return collections
 
 
 def _find_invite_collections_by_token(token: str):
-    token_hash = _hash_invite_token(token)
-    if prod_collections["invite_links"].find_one({"token_hash": token_hash}, {"_id": 1}):
-        return prod_collections
-    if test_collections["invite_links"].find_one({"token_hash": token_hash}, {"_id": 1}):
-        return test_collections
-    return None
+    collections = _resolve_route("token", token)
+    if collections is not None:
+        return collections
+    collections, _ = _probe_databases(
+        "token", token, "invite_links", {"token_hash": _hash_invite_token(token)}, {"_id": 1}
+    )
+    return collections
 
 
 def _find_invite_collections_by_participant(participant_id: str):
-    if prod_collections["invite_links"].find_one({"participant_id": participant_id}, {"_id": 1}):
-        return prod_collections
-    if test_collections["invite_links"].find_one({"participant_id": participant_id}, {"_id": 1}):
-        return test_collections
-    return None
+    # invite_links 与 participants_status 总在同一个数据库，共用参与者路由
+    collections = _resolve_route("participant", participant_id)
+    if collections is not None:
+        return collections
+    collections, _ = _probe_databases(
+        "participant", participant_id, "invite_links", {"participant_id": participant_id}, {"_id": 1}
+    )
+    return collections
 
 
 def _find_batch_collections(batch_id: str):
-    if prod_collections["invite_batches"].find_one({"batch_id": batch_id}, {"_id": 1}):
-        return prod_collections
-    if test_collections["invite_batches"].find_one({"batch_id": batch_id}, {"_id": 1}):
-        return test_collections
-    return None
+    collections = _resolve_route("batch", batch_id)
+    if collections is not None:
+        return collections
+    collections, _ = _probe_databases(
+        "batch", batch_id, "invite_batches", {"batch_id": batch_id}, {"_id": 1}
+    )
+    return collections
 
 def get_participant_status(participant_id: str) -> dict:
-    """Fetch participant status from MongoDB"""
-    collections = _find_participant_collections(participant_id)
-    if not collections:
+    """Fetch participant status (served from the status cache when fresh, otherwise from MongoDB)"""
+    cached = _status_cache_get(participant_id)
+    if cached is not None:
+        return cached
+    _, status = _routed_find_one(
+        "participant", participant_id, "participants", {"participant_id": participant_id}, {"_id": 0}
+    )
+    if not status:
         return {}
-    status = collections["participants"].find_one({"participant_id": participant_id}, {"_id": 0})
-    return status if status else {}
-
-def get_participant_condition(participant_id: str) -> str:
-    status = get_participant_status(participant_id)
+    _record_participant_fetch(participant_id)
+    _status_cache_put(participant_id, status)
+    return status
+
+def get_participant_condition(participant_id: str, status: dict = None) -> str:
+    """Pass an already-loaded status document to avoid another lookup."""
+    if status is None:
+        status = get_participant_status(participant_id)
     return status.get("condition", "UNKNOWN")
 
-def get_participant_language(participant_id: str) -> str:
-    status = get_participant_status(participant_id)
+def get_participant_language(participant_id: str, status: dict = None) -> str:
+    """Pass an already-loaded status document to avoid another lookup."""
+    if status is None:
+        status = get_participant_status(participant_id)
     return status.get("language", "en")
 
-def save_participant_data(participant_id: str, step_name: str, data: dict):
-    """Save general experiment data (questionnaires, etc.) to experiment_events"""
-    collections = _find_participant_collections(participant_id)
-    if not collections:
-        print(f"❌ Failed to save data: participant {participant_id} not found in any database.")
-        return False
+def get_llm_session_collection(participant_id: str):
+    """llm_sessions 集合与参与者状态位于同一数据库；未知参与者默认写入生产库"""
+    collections = _find_participant_collections(participant_id) or prod_collections
+    return collections["llm_sessions"]
 
-    record = {
+def get_llm_usage_collection(participant_id: str):
+    """按参与者累计的 LLM 用量 (MongoSessionStore)；不随会话清除，也不按空闲时间过期"""
+    collections = _find_participant_collections(participant_id) or prod_collections
+    return collections["llm_usage"]
+
+def _event_record(participant_id: str, step_name: str, data: dict) -> dict:
+    """experiment_events / dialogue_turns 中一条记录的统一格式"""
+    return {
         "timestamp": time.time(),
         "datetime": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
         "participant_id": participant_id,
         "step": step_name,
         "data": data
     }
+
+def save_participant_data(participant_id: str, step_name: str, data: dict, buffered: bool = False):
+    """
+    Save general experiment data (questionnaires, etc.) to experiment_events.
+    buffered=True 时经由写缓冲写入；随后要推进步骤的事件保持默认的直接写入。
+    """
+    collections = _find_participant_collections(participant_id)
+    if not collections:
+        log.error("participant_not_found",
+                  f"❌ Failed to save data: participant {participant_id} not found in any database.",
+                  participant_id=participant_id, operation="save_participant_data", step_name=step_name)
+        return False
+
     try:
-        collections["experiment_data"].insert_one(record)
-        print(f"✅ Data saved for PID {participant_id} at step {step_name}")
+        queued = _insert_record(collections, "experiment_data", _event_record(participant_id, step_name, data),
+                                buffered)
+        log.info("participant_data_saved",
+                 f"✅ Data {'queued' if queued else 'saved'} for PID {participant_id} at step {step_name}",
+                 participant_id=participant_id, step_name=step_name, buffered=queued)
         return True
     except Exception as e:
-        print(f"❌ Failed to save data: {e}")
+        log.error("participant_data_save_failed", f"❌ Failed to save data: {e}",
+                  participant_id=participant_id, step_name=step_name, error=str(e))
         return False
 
 def init_participant_session(participant_id: str, condition_order: str, language: str, invite_type: str = "participant"):
@@ -146,22 +479,24 @@ def init_participant_session(participant_id: str, condition_order: str, language
     }
 
     try:
-        collections["experiment_data"].insert_one({
-            "timestamp": time.time(),
-            "datetime": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-            "participant_id": participant_id,
-            "step": "INIT",
-            "data": init_data
-        })
+        # INIT 事件只用于导出分析，参与者状态才是后续请求读取的数据
+        _insert_record(collections, "experiment_data", _event_record(participant_id, "INIT", init_data))
         collections["participants"].update_one(
             {"participant_id": participant_id},
             {"$set": init_data},
             upsert=True
         )
-        print(f"🎉 Session initialized for PID {participant_id} in {condition_order_upper} order. Language: {language}")
+        _remember_route("participant", participant_id, "test" if invite_type == "test" else "production")
+        # upsert 可能保留了旧文档中的字段 (如 washout_start_ts)，直接失效而不是写入缓存
+        _status_cache_invalidate(participant_id)
+        log.info("session_initialized",
+                 f"🎉 Session initialized for PID {participant_id} in {condition_order_upper} order. Language: {language}",
+                 participant_id=participant_id, condition_order=condition_order_upper, language=language,
+                 invite_type=invite_type)
         return "/html/demographics.html"
     except Exception as e:
-        print(f"❌ Failed to init session status: {e}")
+        log.error("session_init_failed", f"❌ Failed to init session status: {e}",
+                  participant_id=participant_id, error=str(e))
         return "/landing?error=db_error"
 
 
@@ -169,19 +504,27 @@ def _hash_invite_token(token: str) -> str:
     return hashlib.sha256(token.encode("utf-8")).hexdigest()
 
 
-def generate_invite_token() -> str:
-    return secrets.token_urlsafe(24)
+def _db_code_for_invite_type(invite_type: str) -> str:
+    return _DB_CODES["test" if invite_type == "test" else "production"]
+
+
+def generate_invite_token(invite_type: str = "participant") -> str:
+    return f"{_db_code_for_invite_type(invite_type)}.{secrets.token_urlsafe(24)}"
+
 
+def generate_participant_id(invite_type: str = "participant") -> str:
+    return f"P{_db_code_for_invite_type(invite_type).upper()}_{secrets.token_hex(8).upper()}"
 
-def generate_participant_id() -> str:
-    return f"P_{secrets.token_hex(8).upper()}"
+
+def generate_batch_id(invite_type: str = "participant") -> str:
+    return f"batch_{_db_code_for_invite_type(invite_type)}_{secrets.token_hex(8)}"
 
 
 def create_invite_batch(batch_name: str, language: str, condition_order: str, quantity: int, invite_type: str):
     collections = _collections_for_invite_type(invite_type)
     timestamp = time.time()
     created_at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
-    batch_id = f"batch_{secrets.token_hex(8)}"
+    batch_id = generate_batch_id(invite_type)
 
     batch_doc = {
         "batch_id": batch_id,
@@ -197,8 +540,8 @@ def create_invite_batch(batch_name: str, language: str, condition_order: str, qu
     invite_docs = []
     invite_results = []
     for _ in range(quantity):
-        token = generate_invite_token()
-        participant_id = generate_participant_id()
+        token = generate_invite_token(invite_type)
+        participant_id = generate_participant_id(invite_type)
         invite_doc = {
             "batch_id": batch_id,
             "token": token,
@@ -247,10 +590,7 @@ def create_invite_batch(batch_name: str, language: str, condition_order: str, qu
 
 
 def get_invite_by_token(token: str) -> dict:
-    collections = _find_invite_collections_by_token(token)
-    if not collections:
-        return {}
-    invite = collections["invite_links"].find_one({"token_hash": _hash_invite_token(token)}, {"_id": 0})
+    _, invite = _routed_find_one("token", token, "invite_links", {"token_hash": _hash_invite_token(token)}, {"_id": 0})
     return invite if invite else {}
 
 
@@ -267,16 +607,14 @@ def update_invite_last_opened(participant_id: str):
 
 
 def redeem_invite_token(token: str) -> dict:
-    collections = _find_invite_collections_by_token(token)
-    if not collections:
+    token_hash = _hash_invite_token(token)
+    collections, invite = _routed_find_one("token", token, "invite_links", {"token_hash": token_hash}, {"_id": 0})
+    if not invite:
         return {}
 
-    token_hash = _hash_invite_token(token)
     now_ts = time.time()
     now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now_ts))
 
-    invite = collections["invite_links"].find_one({"token_hash": token_hash}, {"_id": 0})
-
     status = invite.get("status")
     if status in {"completed", "disabled"}:
         return invite
@@ -300,7 +638,10 @@ def redeem_invite_token(token: str) -> dict:
         return invite if invite else {}
 
     if status == "in_progress":
-        update_invite_last_opened(invite["participant_id"])
+        collections["invite_links"].update_one(
+            {"token_hash": token_hash},
+            {"$set": {"last_opened_at": now_str, "last_opened_ts": now_ts}}
+        )
         invite["last_opened_at"] = now_str
         invite["last_opened_ts"] = now_ts
         return invite
@@ -328,10 +669,9 @@ def mark_invite_completed(participant_id: str) -> bool:
 
 
 def get_invite_for_participant(participant_id: str) -> dict:
-    collections = _find_invite_collections_by_participant(participant_id)
-    if not collections:
-        return {}
-    invite = collections["invite_links"].find_one({"participant_id": participant_id}, {"_id": 0})
+    _, invite = _routed_find_one(
+        "participant", participant_id, "invite_links", {"participant_id": participant_id}, {"_id": 0}
+    )
     return invite if invite else {}
 
 
@@ -339,77 +679,94 @@ def list_invite_batches() -> list:
     batches = []
     for db_label, collections in (("production", prod_collections), ("test", test_collections)):
         current_batches = list(collections["invite_batches"].find({}, {"_id": 0}).sort("created_ts", -1))
+        if not current_batches:
+            continue
+        # 一次聚合拿到该数据库所有 batch 的状态计数，避免每个 batch 单独查询
+        counts_by_batch = {batch["batch_id"]: {"unused": 0, "in_progress": 0, "completed": 0, "disabled": 0}
+                           for batch in current_batches}
+        for row in collections["invite_links"].aggregate([
+            {"$match": {"batch_id": {"$in": list(counts_by_batch)}}},
+            {"$group": {"_id": {"batch_id": "$batch_id", "status": "$status"}, "count": {"$sum": 1}}}
+        ]):
+            counts_by_batch[row["_id"]["batch_id"]][row["_id"]["status"]] = row["count"]
         for batch in current_batches:
-            counts = {"unused": 0, "in_progress": 0, "completed": 0, "disabled": 0}
-            for row in collections["invite_links"].aggregate([
-                {"$match": {"batch_id": batch["batch_id"]}},
-                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-            ]):
-                counts[row["_id"]] = row["count"]
-            batch["status_counts"] = counts
+            batch["status_counts"] = counts_by_batch[batch["batch_id"]]
             batch["database_label"] = db_label
+            _remember_route("batch", batch["batch_id"], db_label)
         batches.extend(current_batches)
     batches.sort(key=lambda row: row.get("created_ts", 0), reverse=True)
     return batches
 
 
-def list_invite_links_for_batch(batch_id: str) -> list:
-    collections = _find_batch_collections(batch_id)
-    if not collections:
-        return []
-    return list(
-        collections["invite_links"].find(
-            {"batch_id": batch_id},
-            {
-                "_id": 0,
-                "batch_id": 1,
-                "token": 1,
-                "participant_id": 1,
-                "language": 1,
-                "condition_order": 1,
-                "invite_type": 1,
-                "status": 1,
-                "created_at": 1,
-                "first_opened_at": 1,
-                "last_opened_at": 1,
-                "completed_at": 1,
-            }
-        ).sort("created_ts", 1)
-    )
+_INVITE_LINK_LIST_PROJECTION = {
+    "_id": 0,
+    "batch_id": 1,
+    "token": 1,
+    "participant_id": 1,
+    "language": 1,
+    "condition_order": 1,
+    "invite_type": 1,
+    "status": 1,
+    "created_at": 1,
+    "first_opened_at": 1,
+    "last_opened_at": 1,
+    "completed_at": 1,
+}
 
-def update_participant_condition(participant_id: str):
-    """Switch condition after Washout (AB -> BA or BA -> AB)"""
-    status_data = get_participant_status(participant_id)
-    if not status_data:
-        return False
-    collections = _find_participant_collections(participant_id)
-    if not collections:
-        return False
 
+def list_invite_links_for_batch(batch_id: str) -> list:
+    collections = _resolve_route("batch", batch_id)
+    candidates = [collections] if collections is not None else [prod_collections, test_collections]
+    for candidate in candidates:
+        links = list(
+            candidate["invite_links"].find({"batch_id": batch_id}, _INVITE_LINK_LIST_PROJECTION).sort("created_ts", 1)
+        )
+        if links:
+            # 旧格式 batch_id：查到结果即说明所在数据库，记入路由表
+            _remember_route("batch", batch_id, "test" if candidate is test_collections else "production")
+            return links
+    return []
+
+def switched_condition(status_data: dict) -> str:
+    """The condition a participant moves to after Washout (AB: XAI -> NON_XAI, BA: NON_XAI -> XAI)"""
     current_condition = status_data.get("condition")
     condition_order = status_data.get("condition_order")
 
-    new_condition = "UNKNOWN"
     if condition_order == "AB" and current_condition == "XAI":
-        new_condition = "NON_XAI"
+        return "NON_XAI"
     elif condition_order == "BA" and current_condition == "NON_XAI":
-        new_condition = "XAI"
-    else:
-        new_condition = "NON_XAI" if current_condition == "XAI" else "XAI"
+        return "XAI"
+    return "NON_XAI" if current_condition == "XAI" else "XAI"
+
+def update_participant_condition(participant_id: str, status_data: dict = None):
+    """Switch condition after Washout (AB -> BA or BA -> AB).
+    Returns the new condition on success, otherwise None."""
+    if status_data is None:
+        status_data = get_participant_status(participant_id)
+    if not status_data:
+        return None
+    collections = _find_participant_collections(participant_id)
+    if not collections:
+        return None
 
+    new_condition = switched_condition(status_data)
+    updated_fields = {
+        "condition": new_condition,
+        "washout_completed": True
+    }
     try:
         collections["participants"].update_one(
             {"participant_id": participant_id},
-            {"$set": {
-                "condition": new_condition,
-                "washout_completed": True
-            }}
+            {"$set": updated_fields}
         )
-        print(f"✅ PID {participant_id} condition switched to {new_condition}")
-        return True
+        _status_cache_update(participant_id, updated_fields)
+        log.info("condition_switched", f"✅ PID {participant_id} condition switched to {new_condition}",
+                 participant_id=participant_id, condition=new_condition)
+        return new_condition
     except Exception as e:
-        print(f"❌ Failed to update participant condition: {e}")
-        return False
+        log.error("condition_switch_failed", f"❌ Failed to update participant condition: {e}",
+                  participant_id=participant_id, error=str(e))
+        return None
 
 def update_participant_step(participant_id: str, new_step_index: int):
     """Update the current step index of the user"""
@@ -421,12 +778,110 @@ def update_participant_step(participant_id: str, new_step_index: int):
             {"participant_id": participant_id},
             {"$set": {"current_step_index": new_step_index}}
         )
-        print(f"✅ PID {participant_id} advanced to step index {new_step_index}")
+        _status_cache_update(participant_id, {"current_step_index": new_step_index})
+        log.info("step_advanced", f"✅ PID {participant_id} advanced to step index {new_step_index}",
+                 participant_id=participant_id, step_index=new_step_index)
         return True
     except Exception as e:
-        print(f"❌ Failed to update participant step: {e}")
+        log.error("step_advance_failed", f"❌ Failed to update participant step: {e}",
+                  participant_id=participant_id, step_index=new_step_index, error=str(e))
         return False
 
+# --- Atomic step advancement ---
+# 推进步骤 = 一次带条件的 find_one_and_update，成功后再写步骤事件。
+# - 推进是一个更新管道：只有 current_step_index 仍等于刚完成的步骤时才修改字段，否则文档保持不变。
+#   无论是否推进都返回更新前的文档，被拒绝时它就是当前状态，不需要再读一次。
+# - 过期或乱序的提交 (重复点击、旧标签页、并发请求) 被拒绝，不写入任何事件。
+# - 事件保留默认的 ObjectId _id，幂等键 (参与者, 会话开始时间, 刚完成的步骤) 存在 step_event_key 字段上
+#   (稀疏唯一索引)，同一步骤最多一条事件。事件写入失败时按 last_step_event 撤销这次推进，参与者可以重新提交。
+def _step_event_key(participant_id: str, status: dict, completed_index: int) -> str:
+    return f"{participant_id}:{status.get('start_time')}:step:{completed_index}"
+
+
+def _guarded_step_update(completed_index: int, next_index: int, fields: dict, event_key: str) -> tuple:
+    """返回 (更新管道, 推进成功时写入的字段)"""
+    update = {"current_step_index": next_index, "last_step_event": event_key, **(fields or {})}
+    matched = {"$eq": ["$current_step_index", completed_index]}
+    pipeline = [{"$set": {
+        key: {"$cond": [matched, {"$literal": value}, f"${key}"]} for key, value in update.items()
+    }}]
+    return pipeline, update
+
+
+def _revert_step_update(collections, participant_id: str, previous: dict, update: dict, event_key: str):
+    """事件没有写入：把这次推进改过的字段恢复为推进前的值 (只在状态仍是这次推进的结果时)"""
+    restore = {key: previous[key] for key in update if key in previous}
+    remove = {key: "" for key in update if key not in previous}
+    revert = {"$set": restore, **({"$unset": remove} if remove else {})}
+    try:
+        collections["participants"].update_one({"participant_id": participant_id, "last_step_event": event_key},
+                                               revert)
+    except Exception as e:
+        log.error("step_revert_failed", f"❌ Failed to revert step advance without an event: {e}",
+                  participant_id=participant_id, error=str(e))
+    _status_cache_invalidate(participant_id)
+
+
+def advance_participant_step(participant_id: str, step_name: str, data: dict, completed_index: int,
+                             next_index: int, fields: dict = None, status: dict = None) -> tuple:
+    """
+    Advance current_step_index from completed_index to next_index (together with any extra status
+    fields, e.g. the condition switch after Washout), then record the step event.
+    status is the caller's copy of the participant status (loaded when omitted).
+    Returns (status, advanced): the updated status document and True on success; the participant's
+    current status and False if completed_index is stale or out of order (no event is written);
+    (None, False) if the participant does not exist or a write failed (nothing was advanced).
+    """
+    collections = _find_participant_collections(participant_id)
+    status = status if status is not None else get_participant_status(participant_id)
+    if not collections or not status:
+        log.error("participant_not_found",
+                  f"❌ Failed to advance step: participant {participant_id} not found in any database.",
+                  participant_id=participant_id, operation="advance_participant_step", step_name=step_name)
+        return None, False
+
+    event_key = _step_event_key(participant_id, status, completed_index)
+    pipeline, update = _guarded_step_update(completed_index, next_index, fields, event_key)
+    try:
+        previous = collections["participants"].find_one_and_update(
+            {"participant_id": participant_id}, pipeline, projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+    except Exception as e:
+        log.error("step_advance_failed", f"❌ Failed to update participant step: {e}",
+                  participant_id=participant_id, step_index=next_index, error=str(e))
+        return None, False
+    if previous is None:
+        return None, False
+
+    if previous.get("current_step_index") != completed_index:
+        _status_cache_put(participant_id, previous)
+        log.warning("step_advance_rejected",
+                    f"⚠️ PID {participant_id} submitted {step_name} for step {completed_index} "
+                    f"but is on step {previous.get('current_step_index')}. Rejected.",
+                    participant_id=participant_id, step_name=step_name, submitted_index=completed_index,
+                    step_index=previous.get("current_step_index"))
+        return previous, False
+
+    try:
+        collections["experiment_data"].insert_one(
+            {**_event_record(participant_id, step_name, data), "step_event_key": event_key}
+        )
+    except DuplicateKeyError:
+        pass  # 只有赢得推进的请求会写事件；唯一索引是最后一道保险
+    except Exception as e:
+        log.error("participant_data_save_failed", f"❌ Failed to save data, step advance reverted: {e}",
+                  participant_id=participant_id, step_name=step_name, error=str(e))
+        _revert_step_update(collections, participant_id, previous, update, event_key)
+        return None, False
+
+    status = {**previous, **update}
+    _status_cache_put(participant_id, status)
+    log.info("step_advanced",
+             f"✅ PID {participant_id} saved {step_name} and advanced to step index {next_index}",
+             participant_id=participant_id, step_name=step_name, step_index=next_index)
+    return status, True
+
 def record_washout_start(participant_id: str, start_ts: float):
     """Helper function to record washout start time for app.py"""
     collections = _find_participant_collections(participant_id)
@@ -437,37 +892,39 @@ def record_washout_start(participant_id: str, start_ts: float):
             {"participant_id": participant_id},
             {"$set": {"washout_start_ts": start_ts}}
         )
+        _status_cache_update(participant_id, {"washout_start_ts": start_ts})
         return True
     except Exception as e:
-        print(f"❌ Failed to record washout start: {e}")
+        log.error("washout_start_failed", f"❌ Failed to record washout start: {e}",
+                  participant_id=participant_id, error=str(e))
         return False
 
 def save_turn_data(participant_id: str, turn_data: dict):
     """Save individual dialogue turns into the dialogue_turns collection"""
     collections = _find_participant_collections(participant_id)
     if not collections:
-        print(f"❌ Failed to save turn data: participant {participant_id} not found in any database.")
+        log.error("participant_not_found",
+                  f"❌ Failed to save turn data: participant {participant_id} not found in any database.",
+                  participant_id=participant_id, operation="save_turn_data")
         return False
-    record = {
-        "timestamp": time.time(),
-        "datetime": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime()),
-        "participant_id": participant_id,
-        "step": "DIALOGUE_TURN",
-        "data": turn_data
-    }
     try:
-        collections["turn_data"].insert_one(record)
-        print(f"✅ Turn data saved for PID {participant_id}, Turn {turn_data.get('turn')}")
+        queued = _insert_record(collections, "turn_data", _event_record(participant_id, "DIALOGUE_TURN", turn_data))
+        log.info("turn_saved",
+                 f"✅ Turn data {'queued' if queued else 'saved'} for PID {participant_id}, Turn {turn_data.get('turn')}",
+                 participant_id=participant_id, turn=turn_data.get('turn'), buffered=queued)
         return True
     except Exception as e:
-        print(f"❌ Failed to save turn data: {e}")
+        log.error("turn_save_failed", f"❌ Failed to save turn data: {e}",
+                  participant_id=participant_id, turn=turn_data.get('turn'), error=str(e))
         return False
 
 def save_contact_email(participant_id: str, email: str):
     """Save contact information for follow-up interviews"""
     collections = _find_participant_collections(participant_id)
     if not collections:
-        print(f"❌ Failed to save contact data: participant {participant_id} not found in any database.")
+        log.error("participant_not_found",
+                  f"❌ Failed to save contact data: participant {participant_id} not found in any database.",
+                  participant_id=participant_id, operation="save_contact_email")
         return False
     try:
         collections["contacts"].insert_one({
@@ -475,17 +932,96 @@ def save_contact_email(participant_id: str, email: str):
             "participant_id": participant_id,
             "email": email
         })
-        print(f"✅ Contact data saved for PID {participant_id}")
+        log.info("contact_saved", f"✅ Contact data saved for PID {participant_id}", participant_id=participant_id)
         return True
     except Exception as e:
-        print(f"❌ Failed to save contact data: {e}")
+        log.error("contact_save_failed", f"❌ Failed to save contact data: {e}",
+                  participant_id=participant_id, error=str(e))
         return False
 
 
+# --- Async access (ASGI 模式) ---
+# 真实 MongoDB 使用 pymongo 的 AsyncMongoClient，与同步客户端共用路由、状态缓存和操作计数；
+# mongomock 没有异步接口 (或 pymongo 版本过旧)，此时 *_async 函数退回到线程池执行同步版本。
+# 异步请求没有线程级的操作作用域，往返只计入进程总数。
+try:
+    from pymongo import AsyncMongoClient
+except ImportError:  # pymongo < 4.10
+    AsyncMongoClient = None
+
+_async_collection_sets = {}  # database label -> collections (绑定在创建它的事件循环上)
+_async_client = None
+
+
+def async_driver_enabled() -> bool:
+    return AsyncMongoClient is not None and bool(MONGO_URI) and not MONGO_URI.startswith("mongomock://")
+
+
+def _async_collections_for_label(database_label: str):
+    global _async_client
+    if _async_client is None:
+        _async_client = AsyncMongoClient(MONGO_URI, server_api=ServerApi('1'), tlsCAFile=certifi.where())
+    collections = _async_collection_sets.get(database_label)
+    if collections is None:
+        db_name = TEST_DB_NAME if database_label == "test" else PRODUCTION_DB_NAME
+        collections = _async_collection_sets[database_label] = _collections_for_db(_async_client[db_name])
+    return collections
+
+
+async def close_async_client():
+    """在事件循环关闭前调用 (ASGI lifespan shutdown)"""
+    global _async_client
+    client, _async_client = _async_client, None
+    _async_collection_sets.clear()
+    if client is not None:
+        await client.close()
+
+
+async def _async_participant_collections(participant_id: str):
+    collections = _resolve_route("participant", participant_id)
+    if collections is None:
+        # 旧格式 ID 第一次出现时需要探测数据库，很少发生，直接复用同步实现
+        collections = await asyncio.to_thread(_find_participant_collections, participant_id)
+    if collections is None:
+        return None
+    return _async_collections_for_label("test" if collections is test_collections else "production")
+
+
+async def get_participant_status_async(participant_id: str) -> dict:
+    if not async_driver_enabled():
+        return await asyncio.to_thread(get_participant_status, participant_id)
+    cached = _status_cache_get(participant_id)
+    if cached is not None:
+        return cached
+    collections = await _async_participant_collections(participant_id)
+    if collections is None:
+        return {}
+    status = await collections["participants"].find_one({"participant_id": participant_id}, {"_id": 0})
+    if not status:
+        return {}
+    _status_cache_put(participant_id, status)
+    return status
+
+
+async def advance_participant_step_async(participant_id: str, step_name: str, data: dict, completed_index: int,
+                                       next_index: int, fields: dict = None, status: dict = None) -> tuple:
+    """advance_participant_step 的异步版本 (ASGI 模式)：两次写之间需要按结果撤销，直接在线程池执行同步版本"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(
+        advance_participant_step, participant_id, step_name, data, completed_index, next_index, fields, status
+    ))
+
+
 def clear_database_contents(database_label: str) -> dict:
     collections = test_collections if database_label == "test" else prod_collections
+    # 先写出缓冲中的记录，避免清空之后旧记录又被写回
+    flush_writes()
     deleted = {}
     for name, collection in collections.items():
         result = collection.delete_many({})
         deleted[name] = result.deleted_count
+    _status_cache_invalidate()
+    with _route_lock:
+        for route_map in _route_maps.values():
+            route_map.clear()
     return deleted
@@ -0,0 +1,238 @@
+# backend/event_log.py
+"""
+结构化事件日志。每条日志是一个带名字的事件 (如 turn_saved、step_redirect)，附带 participant_id / request_id
+和任意字段；调用方线程只做级别 / 采样判断并把记录放进有界队列，格式化和写 stdout 都在 QueueListener 线程完成。
+队列满时丢弃记录并计数，不阻塞请求。
+
+用法:
+    log = get_event_logger(__name__)
+    log.info("turn_saved", f"✅ Turn data saved for PID {pid}", participant_id=pid, turn=3)
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from backend.config import LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE, LOG_EVENT_LEVELS, LOG_EVENT_SAMPLING
+
+_request_id = contextvars.ContextVar("log_request_id", default=None)
+_participant_id = contextvars.ContextVar("log_participant_id", default=None)
+
+_STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def _parse_mapping(spec: str, convert) -> dict:
+    """解析 "a=1,b=2" 形式的配置；无效项忽略"""
+    mapping = {}
+    for item in spec.split(","):
+        name, sep, value = item.partition("=")
+        if not sep or not name.strip():
+            continue
+        try:
+            mapping[name.strip()] = convert(value.strip())
+        except (TypeError, ValueError):
+            print(f"⚠️ Ignoring invalid log setting '{item.strip()}'")
+    return mapping
+
+
+def _parse_level(value: str) -> int:
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(value)
+    return level
+
+
+_event_levels = _parse_mapping(LOG_EVENT_LEVELS, _parse_level)
+_event_sampling = _parse_mapping(LOG_EVENT_SAMPLING, lambda v: min(1.0, max(0.0, float(v))))
+
+_stats_lock = threading.Lock()
+_stats = {"emitted": 0, "sampled_out": 0, "dropped": 0}
+
+
+# --- 请求上下文 ---
+def bind_request(request_id: str, participant_id: str = None) -> tuple:
+    """绑定当前请求的 request_id (和已知的 participant_id)；返回给 unbind_request 的令牌"""
+    return _request_id.set(request_id), _participant_id.set(participant_id)
+
+
+def bind_participant(participant_id: str):
+    """请求处理中得知参与者后调用，之后的日志自动带上 participant_id"""
+    _participant_id.set(participant_id)
+
+
+def unbind_request(tokens: tuple):
+    request_token, participant_token = tokens
+    _request_id.reset(request_token)
+    _participant_id.reset(participant_token)
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+@contextmanager
+def log_context(participant_id: str = None, request_id: str = None):
+    """后台任务 / 流式响应中使用 (此时请求上下文已结束)：范围内的日志带上给定的关联 ID"""
+    tokens = bind_request(request_id or _request_id.get(), participant_id or _participant_id.get())
+    try:
+        yield
+    finally:
+        unbind_request(tokens)
+
+
+# --- 处理器与格式 ---
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": getattr(record, "event", None),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and key != "event" and value is not None:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """本地开发用：保留原来的单行消息，后面附上关联 ID"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        text = record.getMessage()
+        tags = [f"{key}={getattr(record, key)}" for key in ("participant_id", "request_id")
+                if getattr(record, key, None) and str(getattr(record, key)) not in text]
+        if tags:
+            text += f"  [{' '.join(tags)}]"
+        if record.exc_text:
+            text += "\n" + record.exc_text
+        return text
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """在调用方线程补上关联 ID，队列满时丢弃而不是阻塞或抛错"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # 只做必要的工作：固定消息文本 (args 可能被调用方修改) 和异常堆栈，其余格式化留给监听线程
+        if getattr(record, "request_id", None) is None:
+            record.request_id = _request_id.get()
+        if getattr(record, "participant_id", None) is None:
+            record.participant_id = _participant_id.get()
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with _stats_lock:
+                _stats["dropped"] += 1
+
+
+_listener = None
+_queue = None
+_setup_lock = threading.Lock()
+
+
+def setup_logging():
+    """为 backend.* 日志器安装队列处理器和后台写出线程 (幂等)"""
+    global _listener, _queue
+    if _listener is not None:
+        return
+    with _setup_lock:
+        if _listener is not None:
+            return
+        _queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        root = logging.getLogger("backend")
+        try:
+            root.setLevel(_parse_level(LOG_LEVEL))
+        except ValueError:
+            print(f"⚠️ Invalid LOG_LEVEL '{LOG_LEVEL}', using INFO")
+            root.setLevel(logging.INFO)
+        root.addHandler(_ContextQueueHandler(_queue))
+        root.propagate = False
+        _listener = logging.handlers.QueueListener(_queue, output, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """写出队列中剩余的日志并停止后台线程"""
+    global _listener
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_logging_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = _queue.qsize() if _queue is not None else 0
+    stats["queue_capacity"] = LOG_QUEUE_SIZE
+    stats["event_levels"] = {name: logging.getLevelName(level) for name, level in _event_levels.items()}
+    stats["event_sampling"] = dict(_event_sampling)
+    return stats
+
+
+class EventLogger:
+    """按事件名记录日志；事件级别可被 LOG_EVENT_LEVELS 覆盖，WARNING 以下的事件按 LOG_EVENT_SAMPLING 采样"""
+
+    def __init__(self, name: str):
+        setup_logging()
+        self._logger = logging.getLogger(name)
+
+    def log(self, level: int, event: str, message: str, exc_info=None, **fields):
+        level = _event_levels.get(event, level)
+        if not self._logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = _event_sampling.get(event)
+            if rate is not None and random.random() >= rate:
+                with _stats_lock:
+                    _stats["sampled_out"] += 1
+                return
+            if rate is not None:
+                fields["sample_rate"] = rate
+        with _stats_lock:
+            _stats["emitted"] += 1
+        fields["event"] = event
+        self._logger.log(level, message, exc_info=exc_info, extra=fields)
+
+    def debug(self, event: str, message: str, **fields):
+        self.log(logging.DEBUG, event, message, **fields)
+
+    def info(self, event: str, message: str, **fields):
+        self.log(logging.INFO, event, message, **fields)
+
+    def warning(self, event: str, message: str, **fields):
+        self.log(logging.WARNING, event, message, **fields)
+
+    def error(self, event: str, message: str, **fields):
+        self.log(logging.ERROR, event, message, **fields)
+
+    def exception(self, event: str, message: str, **fields):
+        self.log(logging.ERROR, event, message, exc_info=True, **fields)
+
+
+def get_event_logger(name: str) -> EventLogger:
+    return EventLogger(name)
+
+
+def new_request_id() -> str:
+    return f"{int(time.time() * 1000):x}-{random.getrandbits(32):08x}"
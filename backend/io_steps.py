@@ -0,0 +1,37 @@
+# backend/io_steps.py
+"""
+同步 / 异步共用的决策逻辑：把流程写成生成器，每次 yield 一个 I/O 请求 (元组)，由驱动函数执行后 send 回结果，
+失败时把异常 throw 回生成器；生成器 return 的值就是最终结果。
+同步路由 (WSGI) 用 run_steps，ASGI 路由用 run_steps_async，两者只在 I/O 上不同。
+"""
+
+
+def run_steps(steps, perform):
+    """perform(*request) 同步执行每个请求"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                result = perform(*request)
+            except BaseException as e:
+                # 交给生成器处理 (如回退到其他路径)；它不处理时异常原样抛出，finally 块照常执行
+                request = steps.throw(e)
+            else:
+                request = steps.send(result)
+    except StopIteration as done:
+        return done.value
+
+
+async def run_steps_async(steps, perform):
+    """run_steps 的异步版本：await perform(*request)"""
+    try:
+        request = next(steps)
+        while True:
+            try:
+                result = await perform(*request)
+            except BaseException as e:
+                request = steps.throw(e)
+            else:
+                request = steps.send(result)
+    except StopIteration as done:
+        return done.value
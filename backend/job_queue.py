@@ -0,0 +1,159 @@
+# backend/job_queue.py
+import atexit
+import queue
+import threading
+import time
+
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+
+class BackgroundJobQueue:
+    """
+    有界的进程内任务队列 + 工作线程池。
+    - 队列满时 submit 最多阻塞 put_timeout 秒 (背压)，仍然满则在调用方线程中直接执行，保证任务不丢失；
+      对可丢弃的任务 (drop_when_full=True) 则直接丢弃并计数。
+    - 可按 key (如 participant_id) 等待某一类任务全部完成。
+    - 进程退出时排空队列。
+    """
+
+    def __init__(self, name: str, workers: int = 4, max_size: int = 256, put_timeout: float = 2.0,
+                 drain_timeout: float = 30.0, drop_when_full: bool = False):
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_size)
+        self._put_timeout = put_timeout
+        self._drop_when_full = drop_when_full
+        self._drain_timeout = drain_timeout
+        self._pending = threading.Condition()
+        self._pending_total = 0
+        self._pending_by_key = {}
+        self._accepting = True
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "submitted": 0, "completed": 0, "failed": 0, "ran_inline": 0, "dropped": 0, "max_depth": 0,
+            "wait_seconds_total": 0.0, "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0, "run_seconds_max": 0.0,
+        }
+        self._workers = [
+            threading.Thread(target=self._worker_loop, name=f"{name}-worker-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.shutdown)
+
+    # --- 提交与等待 ---
+    def submit(self, func, *args, key=None, **kwargs) -> bool:
+        """提交任务；返回 True 表示已入队，False 表示因队列满或已关闭而在当前线程执行完毕 (或被丢弃)"""
+        job = (func, args, kwargs, key, time.monotonic())
+        self._mark_pending(key, +1)
+        with self._stats_lock:
+            self._stats["submitted"] += 1
+
+        if self._accepting:
+            try:
+                self._queue.put(job, timeout=self._put_timeout)
+                with self._stats_lock:
+                    self._stats["max_depth"] = max(self._stats["max_depth"], self._queue.qsize())
+                return True
+            except queue.Full:
+                if self._drop_when_full:
+                    log.warning("job_dropped", f"⚠️ {self.name} queue full ({self._queue.maxsize}); dropping job.",
+                                queue=self.name)
+                    with self._stats_lock:
+                        self._stats["dropped"] += 1
+                    self._mark_pending(key, -1)
+                    return False
+                log.warning("job_ran_inline",
+                            f"⚠️ {self.name} queue full ({self._queue.maxsize}); running job inline.", queue=self.name)
+
+        with self._stats_lock:
+            self._stats["ran_inline"] += 1
+        self._run(job)
+        return False
+
+    def wait_for_key(self, key, timeout: float = None) -> bool:
+        """等待某个 key 下所有已提交任务完成；超时返回 False"""
+        with self._pending:
+            return self._pending.wait_for(lambda: self._pending_by_key.get(key, 0) == 0, timeout)
+
+    def drain(self, timeout: float = None) -> bool:
+        """等待所有已提交任务完成；超时返回 False"""
+        with self._pending:
+            return self._pending.wait_for(lambda: self._pending_total == 0, timeout)
+
+    def shutdown(self, timeout: float = None):
+        """停止接收新任务 (之后的 submit 在调用方线程执行)，排空队列并结束工作线程"""
+        if not self._accepting:
+            return
+        self._accepting = False
+        drained = self.drain(self._drain_timeout if timeout is None else timeout)
+        if not drained:
+            log.warning("queue_shutdown_timeout",
+                        f"⚠️ {self.name} queue shutdown timed out with {self._pending_total} jobs pending.",
+                        queue=self.name, pending=self._pending_total)
+        for _ in self._workers:
+            try:
+                self._queue.put_nowait(None)
+            except queue.Full:
+                break
+
+    # --- 指标 ---
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        finished = stats["completed"] + stats["failed"]
+        queued = finished - stats["ran_inline"]
+        stats["depth"] = self._queue.qsize()
+        stats["capacity"] = self._queue.maxsize
+        stats["pending"] = self._pending_total
+        stats["workers"] = len(self._workers)
+        stats["wait_seconds_avg"] = round(stats["wait_seconds_total"] / queued, 4) if queued > 0 else 0.0
+        stats["run_seconds_avg"] = round(stats["run_seconds_total"] / finished, 4) if finished else 0.0
+        return stats
+
+    # --- 内部实现 ---
+    def _mark_pending(self, key, delta: int):
+        with self._pending:
+            self._pending_total += delta
+            if key is not None:
+                remaining = self._pending_by_key.get(key, 0) + delta
+                if remaining > 0:
+                    self._pending_by_key[key] = remaining
+                else:
+                    self._pending_by_key.pop(key, None)
+            if delta < 0:
+                self._pending.notify_all()
+
+    def _worker_loop(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                wait_seconds = time.monotonic() - job[4]
+                with self._stats_lock:
+                    self._stats["wait_seconds_total"] += wait_seconds
+                    self._stats["wait_seconds_max"] = max(self._stats["wait_seconds_max"], wait_seconds)
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        func, args, kwargs, key, _ = job
+        started = time.monotonic()
+        failed = False
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            failed = True
+            log.exception("job_failed", f"❌ {self.name} job {getattr(func, '__name__', func)} failed: {e}",
+                          queue=self.name, job=getattr(func, '__name__', str(func)), error=str(e))
+        finally:
+            run_seconds = time.monotonic() - started
+            with self._stats_lock:
+                self._stats["failed" if failed else "completed"] += 1
+                self._stats["run_seconds_total"] += run_seconds
+                self._stats["run_seconds_max"] = max(self._stats["run_seconds_max"], run_seconds)
+            self._mark_pending(key, -1)
@@ -0,0 +1,388 @@
+# backend/llm_provider.py
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from backend.config import (
+    GEMINI_API_KEY, GEMINI_MODEL_NAME, LLM_PROVIDER,
+    FAKE_LLM_TTFT_MS, FAKE_LLM_TTFT_JITTER_MS, FAKE_LLM_INTER_TOKEN_MS, FAKE_LLM_INTER_TOKEN_JITTER_MS,
+    FAKE_LLM_REPLY_TOKENS
+)
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+
+def empty_usage() -> dict:
+    return {"prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+
+class LLMResponse:
+    """一次性调用的结果: 文本、解析后的 JSON (仅 generate_json) 和 token 用量"""
+
+    def __init__(self, text: str, usage: dict = None, data=None):
+        self.text = text
+        self.usage = usage or empty_usage()
+        self.data = data
+
+
+class LLMStream:
+    """
+    流式调用的结果：迭代得到文本片段；迭代结束后 usage 为本次调用的 token 用量。
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.usage = empty_usage()
+
+    def __iter__(self):
+        for text, usage in self._chunks:
+            if usage:
+                self.usage = usage
+            if text:
+                yield text
+
+
+class AsyncLLMStream:
+    """LLMStream 的异步版本：async for 得到文本片段，迭代结束后 usage 为 token 用量"""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self.usage = empty_usage()
+
+    async def __aiter__(self):
+        async for text, usage in self._chunks:
+            if usage:
+                self.usage = usage
+            if text:
+                yield text
+
+
+class LLMProvider(ABC):
+    """
+    LLM 后端接口。messages 为 [{"role": "user" | "model", "content": str}, ...]，
+    必须以 user 开头且角色交替 (由 llm_service._build_contents 保证)。
+
+    a* 方法供 ASGI 模式使用；默认实现把同步调用放到线程池执行，后端有原生异步客户端时应覆盖。
+    """
+    name = "base"
+    model_label = "base"
+
+    @abstractmethod
+    def stream_chat(self, messages: list, system_instruction: str = None) -> LLMStream:
+        ...
+
+    @abstractmethod
+    def generate_text(self, prompt: str, temperature: float = None, max_output_tokens: int = None,
+                      thinking_budget: int = None) -> LLMResponse:
+        ...
+
+    @abstractmethod
+    def generate_json(self, prompt: str, schema: dict, temperature: float = None) -> LLMResponse:
+        """结构化输出；response.data 为按 schema 解析后的对象，解析失败时抛出异常"""
+
+    def astream_chat(self, messages: list, system_instruction: str = None) -> AsyncLLMStream:
+        async def chunks():
+            stream = await asyncio.to_thread(self.stream_chat, messages, system_instruction)
+            iterator = iter(stream)
+            while True:
+                text = await asyncio.to_thread(next, iterator, None)
+                if text is None:
+                    break
+                yield text, None
+            yield "", stream.usage
+
+        return AsyncLLMStream(chunks())
+
+    async def agenerate_text(self, prompt: str, **options) -> LLMResponse:
+        return await asyncio.to_thread(self.generate_text, prompt, **options)
+
+    async def agenerate_json(self, prompt: str, schema: dict, **options) -> LLMResponse:
+        return await asyncio.to_thread(self.generate_json, prompt, schema, **options)
+
+
+# --- Gemini (google-genai) ---
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str = GEMINI_API_KEY, model: str = GEMINI_MODEL_NAME):
+        from google import genai
+        from google.genai import types
+        self._types = types
+        self._client = genai.Client(api_key=api_key)
+        self.model = model
+        self.model_label = f"Gemini-{model}"
+
+    @staticmethod
+    def _usage(response) -> dict:
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is None:
+            return None
+        prompt_tokens = getattr(metadata, "prompt_token_count", None) or 0
+        output_tokens = getattr(metadata, "candidates_token_count", None) or 0
+        total_tokens = getattr(metadata, "total_token_count", None) or prompt_tokens + output_tokens
+        return {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens, "total_tokens": total_tokens}
+
+    def _contents(self, messages: list) -> list:
+        return [
+            self._types.Content(role=m["role"], parts=[self._types.Part(text=m["content"])])
+            for m in messages
+        ]
+
+    def _chat_config(self, system_instruction: str):
+        return self._types.GenerateContentConfig(system_instruction=system_instruction)
+
+    def _text_config(self, temperature: float, max_output_tokens: int, thinking_budget: int):
+        if temperature is None and max_output_tokens is None and thinking_budget is None:
+            return None
+        return self._types.GenerateContentConfig(
+            temperature=temperature,
+            max_output_tokens=max_output_tokens,
+            thinking_config=self._types.ThinkingConfig(thinking_budget=thinking_budget)
+            if thinking_budget is not None else None
+        )
+
+    def _json_config(self, schema: dict, temperature: float):
+        return self._types.GenerateContentConfig(
+            temperature=temperature,
+            response_mime_type="application/json",
+            response_json_schema=schema
+        )
+
+    def stream_chat(self, messages: list, system_instruction: str = None) -> LLMStream:
+        stream = self._client.models.generate_content_stream(
+            model=self.model, contents=self._contents(messages), config=self._chat_config(system_instruction)
+        )
+        return LLMStream((chunk.text, self._usage(chunk)) for chunk in stream)
+
+    def generate_text(self, prompt: str, temperature: float = None, max_output_tokens: int = None,
+                      thinking_budget: int = None) -> LLMResponse:
+        response = self._client.models.generate_content(
+            model=self.model, contents=prompt,
+            config=self._text_config(temperature, max_output_tokens, thinking_budget)
+        )
+        return LLMResponse(response.text or "", self._usage(response))
+
+    def generate_json(self, prompt: str, schema: dict, temperature: float = None) -> LLMResponse:
+        response = self._client.models.generate_content(
+            model=self.model, contents=prompt, config=self._json_config(schema, temperature)
+        )
+        return LLMResponse(response.text, self._usage(response), data=json.loads(response.text))
+
+    # --- 原生异步客户端 (client.aio) ---
+    def astream_chat(self, messages: list, system_instruction: str = None) -> AsyncLLMStream:
+        async def chunks():
+            stream = await self._client.aio.models.generate_content_stream(
+                model=self.model, contents=self._contents(messages), config=self._chat_config(system_instruction)
+            )
+            async for chunk in stream:
+                yield chunk.text, self._usage(chunk)
+
+        return AsyncLLMStream(chunks())
+
+    async def agenerate_text(self, prompt: str, temperature: float = None, max_output_tokens: int = None,
+                             thinking_budget: int = None) -> LLMResponse:
+        response = await self._client.aio.models.generate_content(
+            model=self.model, contents=prompt,
+            config=self._text_config(temperature, max_output_tokens, thinking_budget)
+        )
+        return LLMResponse(response.text or "", self._usage(response))
+
+    async def agenerate_json(self, prompt: str, schema: dict, temperature: float = None) -> LLMResponse:
+        response = await self._client.aio.models.generate_content(
+            model=self.model, contents=prompt, config=self._json_config(schema, temperature)
+        )
+        return LLMResponse(response.text, self._usage(response), data=json.loads(response.text))
+
+
+# --- 本地假模型 (离线压测) ---
+_FAKE_REPLIES = {
+    "en": [
+        "That sounds like a lot to carry, and it makes sense that you feel this way.",
+        "Thank you for sharing that with me. What part of it feels most important right now?",
+        "I hear you. It can help to take things one small step at a time.",
+        "It sounds like this really matters to you. Would you like to tell me more about it?",
+    ],
+    "zh": [
+        "听起来你承受了很多，有这样的感受是很正常的。",
+        "谢谢你愿意和我分享。现在对你来说最重要的是哪一部分？",
+        "我明白你的感受。我们可以一步一步慢慢来。",
+        "看得出来这件事对你很重要，愿意多和我说说吗？",
+    ],
+}
+_CHINESE_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+_FAKE_TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]|[^\s\u4e00-\u9fff]+\s*|\s+')
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class FakeProvider(LLMProvider):
+    """
+    确定性的本地假模型：相同输入总是得到相同的文本、token 序列和 JSON 结果
+    (随机数以输入内容的哈希为种子)。延迟按配置的 TTFT / token 间隔分布模拟，不访问网络。
+    """
+    name = "fake"
+    model_label = "Fake-LLM"
+
+    def __init__(self, ttft_ms: float = FAKE_LLM_TTFT_MS, ttft_jitter_ms: float = FAKE_LLM_TTFT_JITTER_MS,
+                 inter_token_ms: float = FAKE_LLM_INTER_TOKEN_MS,
+                 inter_token_jitter_ms: float = FAKE_LLM_INTER_TOKEN_JITTER_MS,
+                 reply_tokens: int = FAKE_LLM_REPLY_TOKENS):
+        self.ttft_ms = ttft_ms
+        self.ttft_jitter_ms = ttft_jitter_ms
+        self.inter_token_ms = inter_token_ms
+        self.inter_token_jitter_ms = inter_token_jitter_ms
+        self.reply_tokens = reply_tokens
+
+    @staticmethod
+    def _rng(*parts) -> random.Random:
+        digest = hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).digest()
+        return random.Random(int.from_bytes(digest[:8], "big"))
+
+    @staticmethod
+    def _delay(rng: random.Random, mean_ms: float, jitter_ms: float) -> float:
+        """抽取一次延迟 (秒)；同步和异步版本按相同顺序抽取，结果一致"""
+        delay_ms = max(0.0, rng.gauss(mean_ms, jitter_ms)) if jitter_ms > 0 else max(0.0, mean_ms)
+        return delay_ms / 1000.0
+
+    def _reply_text(self, rng: random.Random, language_hint: str) -> str:
+        replies = _FAKE_REPLIES["zh" if _CHINESE_PATTERN.search(language_hint) else "en"]
+        tokens = []
+        while len(tokens) < self.reply_tokens:
+            tokens.extend(_FAKE_TOKEN_PATTERN.findall(replies[rng.randrange(len(replies))] + " "))
+        return "".join(tokens[:max(1, self.reply_tokens)]).strip()
+
+    # 每次调用先生成 "计划" (每个片段之前的等待时间 + 结果)，同步版本 time.sleep，异步版本 asyncio.sleep
+    def _chat_plan(self, messages: list, system_instruction: str):
+        prompt = json.dumps([system_instruction, messages], ensure_ascii=False)
+        rng = self._rng("chat", prompt)
+        last_user = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        tokens = _FAKE_TOKEN_PATTERN.findall(self._reply_text(rng, last_user))
+        delays = [
+            self._delay(rng, self.ttft_ms, self.ttft_jitter_ms) if i == 0
+            else self._delay(rng, self.inter_token_ms, self.inter_token_jitter_ms)
+            for i in range(len(tokens))
+        ]
+        prompt_tokens = _estimate_tokens(prompt)
+        usage = {"prompt_tokens": prompt_tokens, "output_tokens": len(tokens),
+                 "total_tokens": prompt_tokens + len(tokens)}
+        return list(zip(delays, tokens)), usage
+
+    def _text_plan(self, prompt: str):
+        rng = self._rng("text", prompt)
+        ttft = self._delay(rng, self.ttft_ms, self.ttft_jitter_ms)
+        text = self._reply_text(rng, prompt)
+        output_tokens = len(_FAKE_TOKEN_PATTERN.findall(text))
+        generation = self._delay(rng, self.inter_token_ms * output_tokens, 0)
+        prompt_tokens = _estimate_tokens(prompt)
+        return ttft + generation, LLMResponse(text, {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens,
+                                                     "total_tokens": prompt_tokens + output_tokens})
+
+    def _json_plan(self, prompt: str, schema: dict):
+        rng = self._rng("json", prompt, json.dumps(schema, sort_keys=True))
+        ttft = self._delay(rng, self.ttft_ms, self.ttft_jitter_ms)
+        data = self._fake_value(schema or {}, rng, position=0)
+        text = json.dumps(data, ensure_ascii=False)
+        prompt_tokens = _estimate_tokens(prompt)
+        output_tokens = _estimate_tokens(text)
+        return ttft, LLMResponse(text, {"prompt_tokens": prompt_tokens, "output_tokens": output_tokens,
+                                        "total_tokens": prompt_tokens + output_tokens}, data=data)
+
+    def stream_chat(self, messages: list, system_instruction: str = None) -> LLMStream:
+        steps, usage = self._chat_plan(messages, system_instruction)
+
+        def chunks():
+            for delay, token in steps:
+                time.sleep(delay)
+                yield token, None
+            yield "", usage
+
+        return LLMStream(chunks())
+
+    def generate_text(self, prompt: str, temperature: float = None, max_output_tokens: int = None,
+                      thinking_budget: int = None) -> LLMResponse:
+        delay, response = self._text_plan(prompt)
+        time.sleep(delay)
+        return response
+
+    def generate_json(self, prompt: str, schema: dict, temperature: float = None) -> LLMResponse:
+        delay, response = self._json_plan(prompt, schema)
+        time.sleep(delay)
+        return response
+
+    def astream_chat(self, messages: list, system_instruction: str = None) -> AsyncLLMStream:
+        steps, usage = self._chat_plan(messages, system_instruction)
+
+        async def chunks():
+            for delay, token in steps:
+                await asyncio.sleep(delay)
+                yield token, None
+            yield "", usage
+
+        return AsyncLLMStream(chunks())
+
+    async def agenerate_text(self, prompt: str, temperature: float = None, max_output_tokens: int = None,
+                             thinking_budget: int = None) -> LLMResponse:
+        delay, response = self._text_plan(prompt)
+        await asyncio.sleep(delay)
+        return response
+
+    async def agenerate_json(self, prompt: str, schema: dict, temperature: float = None) -> LLMResponse:
+        delay, response = self._json_plan(prompt, schema)
+        await asyncio.sleep(delay)
+        return response
+
+    def _fake_value(self, schema: dict, rng: random.Random, position: int):
+        """按 JSON schema 生成一个值：enum 取其一，数组长度取 minItems，数组内的整数取元素下标"""
+        if "enum" in schema:
+            return schema["enum"][rng.randrange(len(schema["enum"]))]
+        schema_type = schema.get("type", "object")
+        if schema_type == "object":
+            return {
+                key: self._fake_value(sub_schema, rng, position)
+                for key, sub_schema in schema.get("properties", {}).items()
+            }
+        if schema_type == "array":
+            count = schema.get("minItems", 1)
+            return [self._fake_value(schema.get("items", {}), rng, i) for i in range(count)]
+        if schema_type == "integer":
+            return position
+        if schema_type == "number":
+            low, high = schema.get("minimum", 0.0), schema.get("maximum", 1.0)
+            return round(low + (high - low) * rng.uniform(0.5, 1.0), 2)
+        if schema_type == "boolean":
+            return rng.random() < 0.5
+        return self._reply_text(rng, "")[:80]
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "fake": FakeProvider}
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def create_provider(name: str = None) -> LLMProvider:
+    name = (name or LLM_PROVIDER).lower()
+    if name not in _PROVIDERS:
+        log.warning("llm_provider_unknown", f"⚠️ Unknown LLM_PROVIDER '{name}', falling back to gemini.",
+                    provider=name)
+        name = "gemini"
+    return _PROVIDERS[name]()
+
+
+def get_provider() -> LLMProvider:
+    """进程内共享的 LLM 后端 (由 LLM_PROVIDER 选择)"""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider()
+                log.info("llm_provider_ready", f"🤖 LLM provider: {_provider.name} ({_provider.model_label})",
+                         provider=_provider.name, model=_provider.model_label)
+    return _provider
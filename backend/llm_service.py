@@ -1,68 +1,194 @@
 # backend/llm_service.py
+import asyncio
+import random
 import re
-from google import genai
-from google.genai import types
-
-from backend.config import GEMINI_API_KEY, GEMINI_MODEL_NAME, SYSTEM_PROMPT, SUMMARY_INTERVAL
-
-_client = genai.Client(api_key=GEMINI_API_KEY)
+import threading
+import time
+from collections import deque
+
+from backend.config import (
+    GEMINI_MODEL_NAME, SYSTEM_PROMPT, SUMMARY_INTERVAL, SUMMARY_WORKERS, SUMMARY_QUEUE_SIZE,
+    LLM_DEBUG_PROMPT_CAPTURE, LLM_DEBUG_PROMPT_BUFFER_SIZE, CONTEXT_TOKEN_BUDGET,
+    XAI_ANALYSIS_MODE, XAI_TWO_CALL_SAMPLE_RATE
+)
+from backend.event_log import get_event_logger
+from backend.io_steps import run_steps, run_steps_async
+from backend.job_queue import BackgroundJobQueue
+from backend.llm_provider import get_provider
+from backend import sentiment_service
+from backend import llm_usage
+from backend.llm_usage import InstrumentedProvider, participant_scope, record_xai_analysis
+from backend.session_store import create_session_store
+
+log = get_event_logger(__name__)
+
+# LLM 后端由 LLM_PROVIDER 选择 (gemini / fake)；每次调用按类型计量 (见 llm_usage)
+_provider = InstrumentedProvider(get_provider())
 
 # Exposed for compatibility with app.py references
 XAI_MODEL_NAME = GEMINI_MODEL_NAME
 
-# === 全局存储 - 参与者会话数据隔离 ===
-session_data = {}
+# === 会话存储 - 参与者会话数据隔离 ===
+# 后端由 SESSION_STORE_BACKEND 选择；mongo 后端允许多个 worker 进程共享同一参与者的会话
+session_store = create_session_store()
+
+
+def _store_participant_usage(participant_id: str, call_type: str, deltas: dict):
+    try:
+        session_store.add_llm_usage(participant_id, call_type, deltas)
+    except Exception as e:
+        log.warning("llm_usage_sink_failed", f"⚠️ Could not record LLM usage for PID {participant_id}: {e}",
+                    participant_id=participant_id, call_type=call_type, error=str(e))
+
+
+def _record_participant_usage(participant_id: str, call_type: str, deltas: dict):
+    """按参与者的 LLM 用量同时累加到会话存储 (mongo 后端下 DIALOGUE_END 的 llm_usage 包含所有 worker 的调用)"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        _store_participant_usage(participant_id, call_type, deltas)
+        return
+    # ASGI 模式下调用在事件循环上结束，数据库写入放到线程池
+    loop.run_in_executor(None, _store_participant_usage, participant_id, call_type, deltas)
+
+
+llm_usage.set_participant_sink(_record_participant_usage)
+
+
+def get_participant_usage(participant_id: str) -> dict:
+    """参与者到目前为止的 LLM 用量 (会话存储中的汇总，mongo 后端下包含所有 worker 的调用)"""
+    return llm_usage.summarize_participant_usage(session_store.get_llm_usage(participant_id))
 
 
 def get_session(participant_id: str) -> dict:
-    """获取或初始化参与者的会话数据"""
-    if participant_id not in session_data:
-        session_data[participant_id] = {
-            'history': [],
-            'summary': "",
-            'full_prompt': "",
-            'turn_count': 0,
-            'sentiment_scores': []
-        }
-    return session_data[participant_id]
+    """获取参与者会话数据的快照 (修改快照不会写回，请使用下面的更新函数)"""
+    return session_store.get(participant_id)
+
+
+def append_sentiment_score(participant_id: str, score: float):
+    """追加一轮用户情绪分数 (用于 fluctuation 计算)"""
+    session_store.append_sentiment_score(participant_id, score)
+
+
+def mark_post_turn_done(participant_id: str):
+    """一轮的 post-turn 任务结束 (见 app.wait_for_post_turn_jobs)"""
+    session_store.mark_post_turn_done(participant_id)
 
 
 def clear_session(participant_id: str) -> bool:
     """清除特定参与者的会话历史"""
-    if participant_id in session_data:
-        del session_data[participant_id]
-        print(f"🧹 Session cleared for PID {participant_id}")
+    if session_store.clear(participant_id):
+        log.info("session_cleared", f"🧹 Session cleared for PID {participant_id}", participant_id=participant_id)
         return True
     return False
 
 
+def get_session_stats() -> dict:
+    return session_store.get_stats()
+
+
+# === 调试用 prompt 捕获 ===
+# 完整 prompt 不再随会话保存；需要时打开 LLM_DEBUG_PROMPT_CAPTURE，只保留最近几次
+_debug_prompts = deque(maxlen=LLM_DEBUG_PROMPT_BUFFER_SIZE)
+_debug_prompts_lock = threading.Lock()
+
+
+def _capture_debug_prompt(participant_id: str, system_inst: str, contents):
+    if not LLM_DEBUG_PROMPT_CAPTURE:
+        return
+    with _debug_prompts_lock:
+        _debug_prompts.append({
+            "participant_id": participant_id,
+            "captured_at": time.time(),
+            "prompt": f"[system]\n{system_inst}\n\n[contents]\n{contents}"
+        })
+
+
+def get_debug_prompts() -> list:
+    with _debug_prompts_lock:
+        return list(_debug_prompts)
+
+
 def contains_chinese(text: str) -> bool:
     """简单的辅助函数：检查字符串是否包含中文字符"""
     return bool(re.search(r'[\u4e00-\u9fff]', text))
 
 
-def _build_contents(conversation_history: list) -> list:
-    """Convert internal history format to Gemini contents format.
-    Gemini requires the list to start with a user turn and alternate roles."""
-    recent = conversation_history[-10:]
-    # Drop any leading model turns so the list starts with a user turn
-    start = next((i for i, m in enumerate(recent) if m["role"] == "user"), 0)
-    return [
-        types.Content(
-            role="model" if m["role"] == "ai" else "user",
-            parts=[types.Part(text=m["content"])]
-        )
-        for m in recent[start:]
-    ]
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
 
 
-def generate_summary(session: dict):
-    """生成近期对话摘要"""
-    conversation_history = session['history']
-    summary_memory = session['summary']
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符约 1 token/字，其余约 4 字符/token"""
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4 + 1
+
+
+def make_history_message(role: str, content: str) -> dict:
+    """历史消息带上 token 估算值，之后每轮构建上下文时不必重新计算"""
+    return {"role": role, "content": content, "tokens": estimate_tokens(content)}
+
+
+_context_stats = {
+    "builds": 0, "messages_total": 0, "tokens_total": 0, "tokens_max": 0, "truncated": 0, "merged": 0
+}
+_context_lock = threading.Lock()
+
+
+def _build_contents(conversation_history: list, token_budget: int = CONTEXT_TOKEN_BUDGET) -> list:
+    """Convert internal history format to provider messages ({"role": "user" | "model", "content"}).
+    Packs the most recent messages under token_budget (older turns are covered by the summary).
+    Gemini requires the list to start with a user turn and alternate roles."""
+    selected = []
+    used_tokens = 0
+    for message in reversed(conversation_history):
+        tokens = message.get("tokens")
+        if tokens is None:
+            tokens = estimate_tokens(message["content"])
+        # 最新一条消息总是保留，即使它本身超出预算
+        if selected and used_tokens + tokens > token_budget:
+            break
+        selected.append(message)
+        used_tokens += tokens
+    selected.reverse()
 
+    # Drop any leading model turns so the list starts with a user turn
+    start = next((i for i, m in enumerate(selected) if m["role"] == "user"), len(selected))
+
+    # 合并连续的同角色消息 (例如上一轮流式回复失败后留下的用户消息)
+    merged = []
+    for message in selected[start:]:
+        role = "model" if message["role"] == "ai" else "user"
+        if merged and merged[-1][0] == role:
+            merged[-1][1].append(message["content"])
+        else:
+            merged.append((role, [message["content"]]))
+
+    with _context_lock:
+        _context_stats["builds"] += 1
+        _context_stats["messages_total"] += len(selected)
+        _context_stats["tokens_total"] += used_tokens
+        _context_stats["tokens_max"] = max(_context_stats["tokens_max"], used_tokens)
+        _context_stats["merged"] += len(selected) - start - len(merged)
+        if len(selected) < len(conversation_history):
+            _context_stats["truncated"] += 1
+
+    return [{"role": role, "content": "\n".join(texts)} for role, texts in merged]
+
+
+def get_context_stats() -> dict:
+    with _context_lock:
+        stats = dict(_context_stats)
+    builds = stats["builds"]
+    stats["messages_avg"] = round(stats["messages_total"] / builds, 2) if builds else 0.0
+    stats["tokens_avg"] = round(stats["tokens_total"] / builds, 1) if builds else 0.0
+    stats["token_budget"] = CONTEXT_TOKEN_BUDGET
+    return stats
+
+
+def _summarize(recent_history: list, previous_summary: str) -> str:
+    """调用 Gemini 生成摘要文本；失败时返回空字符串"""
     recent_dialogue = "\n".join(
-        [f"{m['role'].capitalize()}: {m['content']}" for m in conversation_history[-10:]]
+        [f"{m['role'].capitalize()}: {m['content']}" for m in recent_history]
     )
 
     summary_prompt = f"""
@@ -70,7 +196,7 @@ Please summarize the following conversation into a concise summary of no more th
 Focus on the user's main emotions, topics, and intents. Keep the summary in English.
 
 Previous summary (if any):
-{summary_memory if summary_memory else "(None)"}
+{previous_summary if previous_summary else "(None)"}
 
 New conversation:
 {recent_dialogue}
@@ -78,22 +204,96 @@ New conversation:
 Output the new summary:
 """
     try:
-        response = _client.models.generate_content(
-            model=GEMINI_MODEL_NAME,
-            contents=summary_prompt
-        )
-        new_summary = response.text.strip()
-        if new_summary:
-            session['summary'] = new_summary
+        return _provider.generate_text(summary_prompt, call_type="summary").text.strip()
     except Exception as e:
-        print(f"⚠️ Failed to generate summary: {e}")
+        log.warning("summary_failed", f"⚠️ Failed to generate summary: {e}", error=str(e))
+        return ""
+
+
+# --- 后台摘要生成 ---
+# 摘要在后台线程生成；每个任务带有版本号 (请求时的 turn_count)，
+# 只有比当前摘要更新的结果才会写回，下一轮直接使用最近一次完成的摘要，不必等待。
+_summary_queue = BackgroundJobQueue(
+    "summary", workers=SUMMARY_WORKERS, max_size=SUMMARY_QUEUE_SIZE, put_timeout=0.1, drop_when_full=True
+)
+_summary_lock = threading.Lock()
+_summary_stats = {
+    "requested": 0, "applied": 0, "failed": 0, "discarded_stale": 0,
+    "latency_seconds_total": 0.0, "latency_seconds_max": 0.0, "last_latency_seconds": 0.0,
+    "staleness_turns_last": 0, "staleness_turns_max": 0, "staleness_samples": 0, "staleness_turns_total": 0,
+}
+
+
+def _apply_summary(participant_id: str, new_summary: str, version: int) -> bool:
+    if session_store.set_summary(participant_id, new_summary, version):
+        return True
+    with _summary_lock:
+        _summary_stats["discarded_stale"] += 1
+    return False
 
 
-def generate_xai_explanation(user_text: str, sentiment_data: dict) -> str:
-    """
-    使用 Gemini 生成 XAI 解释。
-    根据用户输入的语言动态切换 Prompt 语言，确保输出语言一致。
-    """
+def _run_summary_job(participant_id: str, recent_history: list, previous_summary: str, version: int,
+                     requested_at: float):
+    with participant_scope(participant_id):
+        new_summary = _summarize(recent_history, previous_summary)
+    latency = time.monotonic() - requested_at
+    with _summary_lock:
+        _summary_stats["latency_seconds_total"] += latency
+        _summary_stats["latency_seconds_max"] = max(_summary_stats["latency_seconds_max"], latency)
+        _summary_stats["last_latency_seconds"] = round(latency, 4)
+        if not new_summary:
+            _summary_stats["failed"] += 1
+            return
+    if _apply_summary(participant_id, new_summary, version):
+        with _summary_lock:
+            _summary_stats["applied"] += 1
+
+
+def request_summary(participant_id: str, session: dict):
+    """为当前对话快照排队生成摘要 (非阻塞)"""
+    with _summary_lock:
+        _summary_stats["requested"] += 1
+    _summary_queue.submit(
+        _run_summary_job,
+        participant_id, list(session['history'][-10:]), session['summary'], session['turn_count'], time.monotonic(),
+        key=participant_id
+    )
+
+
+def generate_summary(participant_id: str):
+    """同步生成近期对话摘要 (保留给需要立即得到摘要的调用方)"""
+    session = get_session(participant_id)
+    with participant_scope(participant_id):
+        new_summary = _summarize(session['history'][-10:], session['summary'])
+    if new_summary:
+        _apply_summary(participant_id, new_summary, session['turn_count'])
+
+
+def _record_summary_staleness(session: dict):
+    """每轮开始时记录当前使用的摘要落后了多少轮 (只统计已到达第一个摘要间隔的会话)"""
+    if session['turn_count'] < SUMMARY_INTERVAL:
+        return
+    turns_behind = session['turn_count'] - session.get('summary_turn', 0)
+    with _summary_lock:
+        _summary_stats["staleness_turns_last"] = turns_behind
+        _summary_stats["staleness_turns_max"] = max(_summary_stats["staleness_turns_max"], turns_behind)
+        _summary_stats["staleness_turns_total"] += turns_behind
+        _summary_stats["staleness_samples"] += 1
+
+
+def get_summary_stats() -> dict:
+    with _summary_lock:
+        stats = dict(_summary_stats)
+    finished = stats["applied"] + stats["failed"] + stats["discarded_stale"]
+    stats["latency_seconds_avg"] = round(stats["latency_seconds_total"] / finished, 4) if finished else 0.0
+    samples = stats["staleness_samples"]
+    stats["staleness_turns_avg"] = round(stats["staleness_turns_total"] / samples, 2) if samples else 0.0
+    stats["queue"] = _summary_queue.get_stats()
+    return stats
+
+
+def _xai_prompt(user_text: str, sentiment_data: dict) -> str:
+    """根据用户输入的语言动态切换 Prompt 语言，确保输出语言一致"""
     top_emotion = sentiment_data.get("top_emotion", "neutral")
 
     if contains_chinese(user_text):
@@ -123,33 +323,191 @@ def generate_xai_explanation(user_text: str, sentiment_data: dict) -> str:
 
         **Constraint**: The explanation MUST be in **English**.
         """
+    return xai_prompt
+
+
+_XAI_OPTIONS = {"temperature": 0.3, "max_output_tokens": 512, "thinking_budget": 0}
+
+
+def generate_xai_explanation(user_text: str, sentiment_data: dict) -> str:
+    """使用 Gemini 生成 XAI 解释"""
+    try:
+        response = _provider.generate_text(
+            _xai_prompt(user_text, sentiment_data), call_type="xai_explanation", **_XAI_OPTIONS
+        )
+        return response.text.strip()
+    except Exception as e:
+        log.warning("xai_failed", f"⚠️ XAI Gen Error: {e}", error=str(e))
+        return "System analysis unavailable."
+
 
+async def generate_xai_explanation_async(user_text: str, sentiment_data: dict) -> str:
+    """generate_xai_explanation 的异步版本 (ASGI 模式)"""
     try:
-        response = _client.models.generate_content(
-            model=GEMINI_MODEL_NAME,
-            contents=xai_prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.3,
-                max_output_tokens=512,
-                thinking_config=types.ThinkingConfig(thinking_budget=0)
-            )
+        response = await _provider.agenerate_text(
+            _xai_prompt(user_text, sentiment_data), call_type="xai_explanation", **_XAI_OPTIONS
         )
         return response.text.strip()
     except Exception as e:
-        print(f"⚠️ XAI Gen Error: {e}")
+        log.warning("xai_failed", f"⚠️ XAI Gen Error: {e}", error=str(e))
         return "System analysis unavailable."
 
 
-def get_llm_response_stream(participant_id: str, user_input: str):
+# --- 合并的情绪 + 解释 (一次结构化调用) ---
+# 两次调用的路径要等情绪分析返回后才能请求解释 (两个串行往返)；合并调用让模型在同一次输出里给出标签和解释。
+# 合并调用失败时回退到两次调用；各路径的端到端延迟记录在 llm_xai_analysis_duration_seconds。
+_FUSED_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "emotion": {"type": "string", "enum": sentiment_service.EKMAN_EMOTIONS},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "explanation": {"type": "string"},
+    },
+    "required": ["emotion", "confidence", "explanation"],
+}
+
+
+def _fused_prompt(user_text: str) -> str:
+    if contains_chinese(user_text):
+        return f"""
+        请分析用户输入的情感，从以下列表中选择最准确的一个标签：{sentiment_service.EKMAN_EMOTIONS}，并解释这一判断。
+
+        用户输入: "{user_text}"
+
+        判断逻辑：
+        1. **Joy**: 表达开心、喜爱、赞美（如"我爱吃苹果"、"太棒了"）。
+        2. **Sadness**: 表达失去、失败、难过（如"分手"、"挂科"、"不开心"）。
+        3. **Neutral**: 普通陈述、问候（如"你好"、"我想聊聊"）。
+        4. **Anger/Fear/Disgust/Surprise**: 对应其标准定义。
+
+        explanation 字段：
+        1. 用第三人称（如"系统检测到..."）简要解释为什么系统认为用户处于该情绪。
+        2. 说明系统在下一条回复中的目标是什么（如"系统旨在..."）。
+        3. 解释必须简洁（1-2句话），必须使用**中文**，不要翻译用户的话。
+        """
+    return f"""
+        Analyze the user's emotion, select the best label from: {sentiment_service.EKMAN_EMOTIONS}, and explain it.
+
+        User Input: "{user_text}"
+
+        Guidelines:
+        1. **Joy**: Happiness, love, liking something (e.g., "I love apples").
+        2. **Sadness**: Loss, failure, unhappiness (e.g., "break up", "failed").
+        3. **Neutral**: General statements, greetings.
+
+        The explanation field:
+        1. Explain briefly (in 1-2 sentences, third person) why the system categorizes the user's emotion as the chosen label.
+        2. State what the goal is for the next response to support them.
+        3. The explanation MUST be in **English**.
+        """
+
+
+def _xai_analysis_path() -> str:
+    if XAI_ANALYSIS_MODE == "two_call" or random.random() < XAI_TWO_CALL_SAMPLE_RATE:
+        return "two_call"
+    return "fused"
+
+
+def _fused_result(user_text: str, content: dict) -> tuple:
+    explanation = str(content.get("explanation") or "").strip()
+    if not explanation:
+        raise ValueError("fused response has no explanation")
+    sentiment = sentiment_service.remember_sentiment(
+        user_text, content.get("emotion", "neutral"), float(content.get("confidence", 0.9))
+    )
+    return sentiment, explanation
+
+
+def _known_sentiment(user_text: str) -> tuple:
+    """缓存命中或本地分类器命中时返回 (sentiment_result, None)，否则 (None, 本地预测)"""
+    cached = sentiment_service.get_cached_sentiment(user_text)
+    if cached is not None:
+        return cached, None
+    return sentiment_service.local_tier(user_text)
+
+
+def _analysis_steps(user_text: str, on_sentiment=None):
     """
-    处理聊天逻辑和 Gemini 流式响应 (使用主模型)。
+    analyze_and_explain 的决策逻辑 (同步、异步版本共用，见 io_steps)：yield 的 I/O 请求为
+    ("fused" / "sentiment" / "explain", 参数...)，最终返回 (sentiment_result, explanation)。
     """
+    known, prediction = _known_sentiment(user_text)
+    if known is not None:
+        # 情绪已知 (本地分类器命中或相同文本刚分析过)，只剩一次解释调用
+        if on_sentiment:
+            on_sentiment(known)
+        return known, (yield "explain", user_text, known)
+
+    started = time.perf_counter()
+    path = _xai_analysis_path()
+    if path == "fused":
+        try:
+            sentiment, explanation = _fused_result(user_text, (yield "fused", user_text))
+        except Exception as e:
+            log.warning("xai_fused_failed", f"⚠️ Fused sentiment + XAI call failed, using two calls: {e}",
+                        error=str(e))
+            path = "fallback"
+        else:
+            sentiment_service.record_local_agreement(prediction, sentiment)
+            record_xai_analysis("fused", time.perf_counter() - started)
+            if on_sentiment:
+                on_sentiment(sentiment)
+            return sentiment, explanation
+
+    sentiment = yield "sentiment", user_text
+    sentiment_service.record_local_agreement(prediction, sentiment)
+    if on_sentiment:
+        on_sentiment(sentiment)
+    explanation = yield "explain", user_text, sentiment
+    record_xai_analysis(path, time.perf_counter() - started)
+    return sentiment, explanation
+
+
+def _analysis_io(kind: str, user_text: str, sentiment: dict = None):
+    if kind == "fused":
+        return _provider.generate_json(
+            _fused_prompt(user_text), _FUSED_RESPONSE_SCHEMA, call_type="sentiment_xai", temperature=0.2
+        ).data
+    if kind == "sentiment":
+        return sentiment_service.analyze_sentiment(user_text, use_local_tier=False)
+    return generate_xai_explanation(user_text, sentiment)
+
+
+async def _analysis_io_async(kind: str, user_text: str, sentiment: dict = None):
+    if kind == "fused":
+        response = await _provider.agenerate_json(
+            _fused_prompt(user_text), _FUSED_RESPONSE_SCHEMA, call_type="sentiment_xai", temperature=0.2
+        )
+        return response.data
+    if kind == "sentiment":
+        return await sentiment_service.analyze_sentiment_async(user_text, use_local_tier=False)
+    return await generate_xai_explanation_async(user_text, sentiment)
+
+
+def analyze_and_explain(user_text: str, on_sentiment=None) -> tuple:
+    """
+    XAI 面板所需的 (sentiment_result, explanation)。
+    on_sentiment(sentiment_result) 在情绪结果可用时立即调用 (本地命中或两次调用的路径下早于解释)。
+    """
+    return run_steps(_analysis_steps(user_text, on_sentiment), _analysis_io)
+
+
+async def analyze_and_explain_async(user_text: str, on_sentiment=None) -> tuple:
+    """analyze_and_explain 的异步版本 (ASGI 模式)，只有 I/O 不同"""
+    return await run_steps_async(_analysis_steps(user_text, on_sentiment), _analysis_io_async)
+
+
+def _begin_turn(participant_id: str, user_input: str) -> tuple:
+    """记录用户输入并构建本轮的 (contents, system_instruction)"""
     session = get_session(participant_id)
     conversation_history = session['history']
     summary_memory = session['summary']
+    _record_summary_staleness(session)
 
     # 1. 添加用户输入
-    conversation_history.append({"role": "user", "content": user_input})
+    user_message = make_history_message("user", user_input)
+    conversation_history.append(user_message)
+    session_store.append_history(participant_id, user_message)
 
     # 2. 动态决定 System Prompt (语言跟随)
     if contains_chinese(user_input):
@@ -168,28 +526,69 @@ def get_llm_response_stream(participant_id: str, user_input: str):
     # 3. 构建 Gemini contents
     contents = _build_contents(conversation_history)
 
-    # 供调试查看
-    session['full_prompt'] = f"[system]\n{system_inst}\n\n[contents]\n{contents}"
+    # 供调试查看 (默认关闭)
+    _capture_debug_prompt(participant_id, system_inst, contents)
+    return contents, system_inst
+
+
+def _finish_turn(participant_id: str, full_ai_reply: str):
+    if full_ai_reply:
+        session = session_store.complete_turn(participant_id, make_history_message("ai", full_ai_reply.strip()))
+        if session['message_count'] % (SUMMARY_INTERVAL * 2) == 0:
+            request_summary(participant_id, session)
+    log.debug("stream_complete", "✅ Streaming Complete", participant_id=participant_id,
+              reply_chars=len(full_ai_reply))
+
+
+def get_llm_response_stream(participant_id: str, user_input: str, raise_errors: bool = False):
+    """
+    处理聊天逻辑和 Gemini 流式响应 (使用主模型)。
+    模型出错时默认把错误文本写进流里 (旧的 /chat 路由)；raise_errors=True 时重新抛出 (/chat_turn 发出 error 事件)，
+    已输出的部分回复不计入会话。
+    """
+    contents, system_inst = _begin_turn(participant_id, user_input)
 
     # 4. 流式响应
     full_ai_reply = ""
     try:
-        for chunk in _client.models.generate_content_stream(
-            model=GEMINI_MODEL_NAME,
-            contents=contents,
-            config=types.GenerateContentConfig(system_instruction=system_inst)
-        ):
-            if chunk.text:
-                full_ai_reply += chunk.text
-                yield chunk.text.encode('utf-8')
+        stream = _provider.stream_chat(
+            contents, system_instruction=system_inst, call_type="chat", participant_id=participant_id
+        )
+        for text in stream:
+            full_ai_reply += text
+            yield text.encode('utf-8')
+
+    except Exception as e:
+        if raise_errors:
+            full_ai_reply = ""
+            raise
+        yield f"⚠️ Backend LLM error: {e}".encode('utf-8')
+
+    finally:
+        _finish_turn(participant_id, full_ai_reply)
+
+
+async def get_llm_response_stream_async(participant_id: str, user_input: str, raise_errors: bool = False):
+    """
+    get_llm_response_stream 的异步版本 (ASGI 模式)：模型流在事件循环上等待，不占用线程；
+    会话读写可能访问 MongoDB (SESSION_STORE_BACKEND=mongo)，放到线程池执行。
+    """
+    contents, system_inst = await asyncio.to_thread(_begin_turn, participant_id, user_input)
+
+    full_ai_reply = ""
+    try:
+        stream = _provider.astream_chat(
+            contents, system_instruction=system_inst, call_type="chat", participant_id=participant_id
+        )
+        async for text in stream:
+            full_ai_reply += text
+            yield text.encode('utf-8')
 
     except Exception as e:
+        if raise_errors:
+            full_ai_reply = ""
+            raise
         yield f"⚠️ Backend LLM error: {e}".encode('utf-8')
 
     finally:
-        if full_ai_reply:
-            conversation_history.append({"role": "ai", "content": full_ai_reply.strip()})
-            session['turn_count'] += 1
-            if len(conversation_history) % (SUMMARY_INTERVAL * 2) == 0:
-                generate_summary(session)
-        print("✅ Streaming Complete")
+        await asyncio.to_thread(_finish_turn, participant_id, full_ai_reply)
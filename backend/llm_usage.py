@@ -0,0 +1,302 @@
+# backend/llm_usage.py
+"""
+LLM 调用计量：每次调用按类型 (chat / sentiment / sentiment_batch / sentiment_shadow / xai_explanation / sentiment_xai / summary) 记录
+总延迟、首个分块时间、分块数、输出速度和 token 用量，分别汇总到全局、每个参与者和 Prometheus 指标。
+
+参与者通过 contextvar 传递 (participant_scope)，也可以在调用时显式传入 participant_id。
+按参与者的汇总保存在本进程内 (最近 LLM_USAGE_MAX_PARTICIPANTS 个)；多 worker 部署时另外通过
+set_participant_sink 注册的回调累加到共享存储 (见 MongoSessionStore.add_llm_usage)。
+"""
+import contextvars
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from backend import metrics
+from backend.config import LLM_USAGE_MAX_PARTICIPANTS
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+_current_participant = contextvars.ContextVar("llm_participant", default=None)
+
+_LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+CALL_DURATION = metrics.registry.histogram(
+    "llm_call_duration_seconds", "LLM call latency by call type.", ("call_type",), buckets=_LLM_BUCKETS
+)
+TIME_TO_FIRST_CHUNK = metrics.registry.histogram(
+    "llm_time_to_first_chunk_seconds", "Time to the first streamed chunk by call type.", ("call_type",),
+    buckets=_LLM_BUCKETS
+)
+OUTPUT_TOKENS_PER_SECOND = metrics.registry.histogram(
+    "llm_output_tokens_per_second", "Output tokens per second of generation time by call type.", ("call_type",),
+    buckets=(5, 10, 20, 40, 80, 160, 320, 640)
+)
+CALLS_TOTAL = metrics.registry.counter("llm_calls_total", "LLM calls by call type and outcome.",
+                                       ("call_type", "outcome"))
+TOKENS_TOTAL = metrics.registry.counter("llm_tokens_total", "LLM tokens by call type and kind.",
+                                        ("call_type", "kind"))
+CHUNKS_TOTAL = metrics.registry.counter("llm_stream_chunks_total", "Streamed chunks by call type.", ("call_type",))
+XAI_ANALYSIS_DURATION = metrics.registry.histogram(
+    "llm_xai_analysis_duration_seconds",
+    "Sentiment + XAI explanation latency by path (fused, two_call, fallback = failed fused call + two_call).",
+    ("path",), buckets=_LLM_BUCKETS
+)
+
+_lock = threading.Lock()
+_global_usage = {}
+_participant_usage = OrderedDict()  # participant_id -> {call_type: totals}，按最近使用排序
+_xai_analysis = {}  # path -> [count, seconds_total]
+_participant_sink = None  # (participant_id, call_type, deltas) -> None，共享存储中的参与者汇总
+
+
+def _empty_totals() -> dict:
+    return {"calls": 0, "errors": 0, "latency_seconds": 0.0, "ttft_seconds": 0.0, "streamed_calls": 0,
+            "chunks": 0, "prompt_tokens": 0, "output_tokens": 0}
+
+
+def set_participant_sink(sink):
+    """注册按参与者累加用量的回调；每次带参与者的调用结束后执行一次，失败只记日志"""
+    global _participant_sink
+    _participant_sink = sink
+
+
+@contextmanager
+def participant_scope(participant_id: str):
+    """在此范围内发起的 LLM 调用记到 participant_id 名下"""
+    token = _current_participant.set(participant_id)
+    try:
+        yield
+    finally:
+        _current_participant.reset(token)
+
+
+def current_participant() -> str:
+    return _current_participant.get()
+
+
+def record_call(call_type: str, latency: float, usage: dict = None, ttft: float = None, chunks: int = 0,
+                ok: bool = True, participant_id: str = None):
+    usage = usage or {}
+    prompt_tokens = usage.get("prompt_tokens", 0) or 0
+    output_tokens = usage.get("output_tokens", 0) or 0
+
+    CALL_DURATION.observe(latency, call_type)
+    CALLS_TOTAL.inc(call_type, "ok" if ok else "error")
+    if prompt_tokens:
+        TOKENS_TOTAL.inc(call_type, "prompt", amount=prompt_tokens)
+    if output_tokens:
+        TOKENS_TOTAL.inc(call_type, "output", amount=output_tokens)
+    if ttft is not None:
+        TIME_TO_FIRST_CHUNK.observe(ttft, call_type)
+        CHUNKS_TOTAL.inc(call_type, amount=chunks)
+    # 输出速度只统计生成阶段 (流式调用扣除首个分块之前的等待)
+    generation_seconds = latency - (ttft or 0.0)
+    if ok and output_tokens and generation_seconds > 0:
+        OUTPUT_TOKENS_PER_SECOND.observe(output_tokens / generation_seconds, call_type)
+
+    participant_id = participant_id or _current_participant.get()
+    deltas = {"calls": 1, "errors": 0 if ok else 1, "latency_seconds": latency, "prompt_tokens": prompt_tokens,
+              "output_tokens": output_tokens}
+    if ttft is not None:
+        deltas.update(streamed_calls=1, ttft_seconds=ttft, chunks=chunks)
+    with _lock:
+        targets = [_global_usage.setdefault(call_type, _empty_totals())]
+        if participant_id:
+            per_type = _participant_usage.get(participant_id)
+            if per_type is None:
+                per_type = _participant_usage[participant_id] = {}
+                while len(_participant_usage) > LLM_USAGE_MAX_PARTICIPANTS:
+                    _participant_usage.popitem(last=False)
+            else:
+                _participant_usage.move_to_end(participant_id)
+            targets.append(per_type.setdefault(call_type, _empty_totals()))
+        for totals in targets:
+            for field, value in deltas.items():
+                totals[field] += value
+    sink = _participant_sink
+    if participant_id and sink is not None:
+        try:
+            sink(participant_id, call_type, deltas)
+        except Exception as e:
+            log.warning("llm_usage_sink_failed", f"⚠️ Could not record LLM usage for PID {participant_id}: {e}",
+                        participant_id=participant_id, call_type=call_type, error=str(e))
+
+
+def record_xai_analysis(path: str, seconds: float):
+    """一次 XAI 分析 (情绪 + 解释) 的端到端延迟；path 为 fused / two_call / fallback"""
+    XAI_ANALYSIS_DURATION.observe(seconds, path)
+    with _lock:
+        totals = _xai_analysis.setdefault(path, [0, 0.0])
+        totals[0] += 1
+        totals[1] += seconds
+
+
+def _xai_analysis_summary() -> dict:
+    with _lock:
+        paths = {path: list(totals) for path, totals in _xai_analysis.items()}
+    summary = {path: {"count": count, "seconds_avg": round(total / count, 4)} for path, (count, total) in paths.items()}
+    if "fused" in summary and "two_call" in summary:
+        # 正数表示合并调用平均比两次调用快多少秒
+        summary["fused_saving_seconds_avg"] = round(
+            summary["two_call"]["seconds_avg"] - summary["fused"]["seconds_avg"], 4
+        )
+    return summary
+
+
+def _summarize(per_type: dict) -> dict:
+    summary = {}
+    for call_type, totals in per_type.items():
+        entry = dict(totals)
+        entry["latency_seconds"] = round(entry["latency_seconds"], 4)
+        entry["latency_seconds_avg"] = round(totals["latency_seconds"] / totals["calls"], 4) if totals["calls"] else 0.0
+        entry["ttft_seconds_avg"] = (
+            round(totals["ttft_seconds"] / totals["streamed_calls"], 4) if totals["streamed_calls"] else None
+        )
+        del entry["ttft_seconds"]
+        summary[call_type] = entry
+    summary["total"] = {
+        "calls": sum(t["calls"] for t in per_type.values()),
+        "latency_seconds": round(sum(t["latency_seconds"] for t in per_type.values()), 4),
+        "prompt_tokens": sum(t["prompt_tokens"] for t in per_type.values()),
+        "output_tokens": sum(t["output_tokens"] for t in per_type.values()),
+    }
+    return summary
+
+
+def summarize_participant_usage(per_type: dict) -> dict:
+    """把共享存储中的 {call_type: totals} 整理成与 get_participant_usage 相同的格式"""
+    return _summarize({k: {**_empty_totals(), **v} for k, v in (per_type or {}).items()})
+
+
+def get_participant_totals(participant_id: str) -> dict:
+    """本进程内该参与者的 {call_type: totals} (InMemorySessionStore.get_llm_usage)"""
+    with _lock:
+        return {k: dict(v) for k, v in _participant_usage.get(participant_id, {}).items()}
+
+
+def get_participant_usage(participant_id: str) -> dict:
+    """参与者到目前为止的 LLM 用量 (按调用类型 + total)；只包含本进程内的调用"""
+    return _summarize(get_participant_totals(participant_id))
+
+
+def get_usage_stats() -> dict:
+    with _lock:
+        per_type = {k: dict(v) for k, v in _global_usage.items()}
+        tracked = len(_participant_usage)
+    stats = _summarize(per_type)
+    stats["tracked_participants"] = tracked
+    stats["xai_analysis"] = _xai_analysis_summary()
+    return stats
+
+
+class InstrumentedStream:
+    """包装 LLMStream：记录首个分块时间、分块数，流结束 (或被提前关闭) 时上报一次"""
+
+    def __init__(self, stream, call_type: str, started: float, participant_id: str = None):
+        self._stream = stream
+        self._call_type = call_type
+        self._started = started
+        # 流可能在另一个上下文中被迭代 (如 Flask 的流式响应)，创建时就确定归属
+        self._participant_id = participant_id or _current_participant.get()
+
+    @property
+    def usage(self) -> dict:
+        return self._stream.usage
+
+    def __iter__(self):
+        ttft = None
+        chunks = 0
+        ok = False
+        try:
+            for text in self._stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - self._started
+                chunks += 1
+                yield text
+            ok = True
+        finally:
+            latency = time.perf_counter() - self._started
+            record_call(self._call_type, latency, self._stream.usage, ttft=latency if ttft is None else ttft,
+                        chunks=chunks, ok=ok, participant_id=self._participant_id)
+
+
+class InstrumentedAsyncStream(InstrumentedStream):
+    """InstrumentedStream 的异步版本 (ASGI 模式)"""
+
+    async def __aiter__(self):
+        ttft = None
+        chunks = 0
+        ok = False
+        try:
+            async for text in self._stream:
+                if ttft is None:
+                    ttft = time.perf_counter() - self._started
+                chunks += 1
+                yield text
+            ok = True
+        finally:
+            latency = time.perf_counter() - self._started
+            record_call(self._call_type, latency, self._stream.usage, ttft=latency if ttft is None else ttft,
+                        chunks=chunks, ok=ok, participant_id=self._participant_id)
+
+
+class InstrumentedProvider:
+    """
+    在 LLMProvider 外包一层计量；各方法多一个 call_type 参数，其余参数原样传给底层后端。
+    """
+
+    def __init__(self, provider):
+        self._provider = provider
+        self.name = provider.name
+        self.model_label = provider.model_label
+
+    def stream_chat(self, messages: list, system_instruction: str = None, call_type: str = "chat",
+                    participant_id: str = None):
+        started = time.perf_counter()
+        try:
+            stream = self._provider.stream_chat(messages, system_instruction=system_instruction)
+        except Exception:
+            record_call(call_type, time.perf_counter() - started, ok=False, participant_id=participant_id)
+            raise
+        return InstrumentedStream(stream, call_type, started, participant_id)
+
+    def _timed(self, call_type: str, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = method(*args, **kwargs)
+        except Exception:
+            record_call(call_type, time.perf_counter() - started, ok=False)
+            raise
+        record_call(call_type, time.perf_counter() - started, response.usage)
+        return response
+
+    def generate_text(self, prompt: str, call_type: str = "text", **options):
+        return self._timed(call_type, self._provider.generate_text, prompt, **options)
+
+    def generate_json(self, prompt: str, schema: dict, call_type: str = "json", **options):
+        return self._timed(call_type, self._provider.generate_json, prompt, schema, **options)
+
+    # --- 异步版本 ---
+    def astream_chat(self, messages: list, system_instruction: str = None, call_type: str = "chat",
+                     participant_id: str = None):
+        started = time.perf_counter()
+        stream = self._provider.astream_chat(messages, system_instruction=system_instruction)
+        return InstrumentedAsyncStream(stream, call_type, started, participant_id)
+
+    async def _atimed(self, call_type: str, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await method(*args, **kwargs)
+        except Exception:
+            record_call(call_type, time.perf_counter() - started, ok=False)
+            raise
+        record_call(call_type, time.perf_counter() - started, response.usage)
+        return response
+
+    async def agenerate_text(self, prompt: str, call_type: str = "text", **options):
+        return await self._atimed(call_type, self._provider.agenerate_text, prompt, **options)
+
+    async def agenerate_json(self, prompt: str, schema: dict, call_type: str = "json", **options):
+        return await self._atimed(call_type, self._provider.agenerate_json, prompt, schema, **options)
@@ -0,0 +1,431 @@
+# backend/load_test.py
+"""
+虚拟被试压测工具：模拟 N 个参与者完整走完实验流程
+(邀请链接 → /start_experiment → 每个 EXPERIMENT_STEPS 步骤的 /save_data、
+对话阶段多轮 /chat_turn → /end_dialogue，washout 直接跳过；--legacy-chat 改为旧页面的 /analyze + /chat)。
+
+默认在进程内用 Flask test client 驱动应用，LLM 使用假模型 (LLM_PROVIDER=fake)，
+数据库使用 mongomock (MONGO_URI=mongomock://)，不消耗配额也不会写入真实数据库。
+也可以用 --base-url 压测一个已启动的服务器。
+
+用法:
+    python -m backend.load_test --participants 50 --concurrency 10 --turns 3 --output run.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    rank = max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class RouteRecorder:
+    """按路由记录每个请求的耗时和错误"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}
+        self._errors = {}
+
+    def record(self, route: str, seconds: float, ok: bool):
+        with self._lock:
+            self._latencies.setdefault(route, []).append(seconds)
+            if not ok:
+                self._errors[route] = self._errors.get(route, 0) + 1
+
+    def summary(self, wall_seconds: float) -> dict:
+        with self._lock:
+            routes = {}
+            for route, values in sorted(self._latencies.items()):
+                values = sorted(values)
+                errors = self._errors.get(route, 0)
+                routes[route] = {
+                    "count": len(values),
+                    "errors": errors,
+                    "error_rate": round(errors / len(values), 4),
+                    "throughput_rps": round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+                    "mean_ms": round(sum(values) / len(values) * 1000, 2),
+                    "p50_ms": round(percentile(values, 50) * 1000, 2),
+                    "p95_ms": round(percentile(values, 95) * 1000, 2),
+                    "p99_ms": round(percentile(values, 99) * 1000, 2),
+                    "max_ms": round(values[-1] * 1000, 2),
+                }
+            return routes
+
+
+# --- 传输层: 进程内 Flask test client 或真实 HTTP ---
+class InProcessTransport:
+    def __init__(self, app):
+        self._app = app
+
+    def session(self):
+        return _InProcessSession(self._app.test_client())
+
+
+class _InProcessSession:
+    def __init__(self, client):
+        self._client = client
+
+    def request(self, method: str, path: str, payload=None, stream: bool = False):
+        """返回 (status_code, body_bytes, location, ttfb_seconds)"""
+        started = time.perf_counter()
+        response = self._client.open(path, method=method, json=payload, buffered=not stream)
+        ttfb = None
+        if stream:
+            body = b""
+            for chunk in response.response:
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                body += chunk if isinstance(chunk, bytes) else chunk.encode("utf-8")
+            response.close()
+        else:
+            body = response.get_data()
+        return response.status_code, body, response.headers.get("Location"), ttfb
+
+
+class HttpTransport:
+    def __init__(self, base_url: str):
+        import requests
+        self._requests = requests
+        self._base_url = base_url.rstrip("/")
+
+    def session(self):
+        return _HttpSession(self._requests.Session(), self._base_url)
+
+
+class _HttpSession:
+    def __init__(self, http_session, base_url: str):
+        self._session = http_session
+        self._base_url = base_url
+
+    def request(self, method: str, path: str, payload=None, stream: bool = False):
+        started = time.perf_counter()
+        response = self._session.request(method, self._base_url + path, json=payload, stream=stream,
+                                         allow_redirects=False, timeout=120)
+        ttfb = None
+        if stream:
+            body = b""
+            for chunk in response.iter_content(chunk_size=None):
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                body += chunk
+        else:
+            body = response.content
+        return response.status_code, body, response.headers.get("Location"), ttfb
+
+
+class VirtualParticipant:
+    """一个虚拟被试：按前端页面的调用顺序走完整个实验"""
+
+    def __init__(self, http, recorder: RouteRecorder, invite: dict, steps: list, turns: int, think_seconds: float,
+                 start_experiment: bool, rng: random.Random, legacy_chat: bool = False):
+        self._http = http
+        self._recorder = recorder
+        self._invite = invite
+        self._steps = steps
+        self._turns = turns
+        self._think_seconds = think_seconds
+        self._start_experiment = start_experiment
+        self._rng = rng
+        self._legacy_chat = legacy_chat
+        self.participant_id = invite["participant_id"]
+
+    def _call(self, route: str, method: str, path: str, payload=None, expect=(200,), stream=False):
+        started = time.perf_counter()
+        try:
+            status, body, location, ttfb = self._http.request(method, path, payload, stream=stream)
+        except Exception as e:
+            self._recorder.record(route, time.perf_counter() - started, False)
+            raise RuntimeError(f"{route} failed: {e}")
+        elapsed = time.perf_counter() - started
+        ok = status in expect
+        self._recorder.record(route, elapsed, ok)
+        if stream and ttfb is not None:
+            self._recorder.record(f"{route} (ttfb)", ttfb, ok)
+        if not ok:
+            raise RuntimeError(f"{route} returned {status}: {body[:200]!r}")
+        return body, location
+
+    def _json(self, route: str, path: str, payload: dict) -> dict:
+        body, _ = self._call(route, "POST", path, payload)
+        return json.loads(body)
+
+    def _think(self):
+        if self._think_seconds > 0:
+            time.sleep(self._rng.uniform(0.5, 1.5) * self._think_seconds)
+
+    def _open_page(self, url: str):
+        route = "GET /html/<page>" if url.startswith("/html/") else "GET " + url.split("?")[0]
+        self._call(route, "GET", url)
+
+    def _dialogue(self, xai: bool):
+        for turn in range(self._turns):
+            message = self._rng.choice(_SAMPLE_MESSAGES)
+            payload = {"message": message, "participant_id": self.participant_id}
+            if not self._legacy_chat:
+                body, _ = self._call("POST /chat_turn", "POST", "/chat_turn", payload, stream=True)
+                if b'"turn_saved"' not in body:
+                    raise RuntimeError(f"POST /chat_turn ended without turn_saved: {body[-200:]!r}")
+                self._think()
+                continue
+            analyze_errors = []
+            analyze_thread = None
+            if xai:
+                # XAI 页面并发发送 /analyze 和 /chat
+                def analyze():
+                    try:
+                        self._json("POST /analyze", "/analyze", payload)
+                    except Exception as e:
+                        analyze_errors.append(e)
+                analyze_thread = threading.Thread(target=analyze)
+                analyze_thread.start()
+            self._call("POST /chat", "POST", "/chat", {**payload, "explanation_shown": xai}, stream=True)
+            if analyze_thread is not None:
+                analyze_thread.join()
+                if analyze_errors:
+                    raise analyze_errors[0]
+            self._think()
+        return self._json("POST /end_dialogue", "/end_dialogue", {"participant_id": self.participant_id})
+
+    def run(self):
+        _, location = self._call("GET /invite/<token>", "GET", f"/invite/{self._invite['token']}", expect=(302,))
+        if self._start_experiment:
+            self._json("POST /start_experiment", "/start_experiment", {
+                "participant_id": self.participant_id,
+                "condition_order": self._invite["condition_order"],
+                "language": self._invite["language"],
+            })
+        self._open_page(f"/index.html?pid={self.participant_id}")
+        result = self._json("POST /save_data", "/save_data", {
+            "participant_id": self.participant_id, "step_name": "CONSENT", "data": {"consent": True},
+            "current_step_index": -1
+        })
+
+        while result["next_step_index"] < len(self._steps):
+            index = result["next_step_index"]
+            step = self._steps[index]
+            self._open_page(result["next_url"])
+            self._think()
+            if step.startswith("DIALOGUE"):
+                result = self._dialogue(xai="XAI_Version" in result["next_url"])
+            else:
+                data = {"skip_washout": True} if step == "WASHOUT" else {"load_test": True, "step": step}
+                result = self._json("POST /save_data", "/save_data", {
+                    "participant_id": self.participant_id, "step_name": step, "data": data,
+                    "current_step_index": index
+                })
+        self._open_page(result["next_url"])
+
+
+_SAMPLE_MESSAGES = [
+    "Hi, I had a pretty long day today.",
+    "I failed my exam and I feel terrible about it.",
+    "My friend surprised me with a birthday cake!",
+    "I'm worried about my job interview tomorrow.",
+    "Honestly I'm just bored right now.",
+    "It makes me so angry when people cut in line.",
+    "我今天很开心，终于完成了项目。",
+    "最近压力有点大，晚上睡不好。",
+]
+
+
+def _admin_stats(admin) -> dict:
+    status, body, _, _ = admin.request("GET", "/admin/cache-stats")
+    return json.loads(body) if status == 200 else {}
+
+
+def _wait_for_background_jobs(admin, timeout: float):
+    """等待 post-turn 队列排空，使数据库写入计入本次压测"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = _admin_stats(admin)
+        if stats.get("post_turn_queue", {}).get("pending", 0) == 0:
+            return stats
+        time.sleep(0.1)
+    return _admin_stats(admin)
+
+
+def _create_invites(admin, participants: int, language: str) -> list:
+    invites = []
+    remaining = participants
+    batch_number = 0
+    while remaining > 0:
+        quantity = min(remaining, 500)
+        condition_order = "AB" if batch_number % 2 == 0 else "BA"
+        status, body, _, _ = admin.request("POST", "/admin/invite-batches", {
+            "batch_name": f"load-test-{int(time.time())}-{batch_number}", "language": language,
+            "condition_order": condition_order, "invite_type": "test", "quantity": quantity
+        })
+        if status != 200:
+            raise SystemExit(f"❌ Failed to create invite batch ({status}): {body[:200]!r}")
+        for link in json.loads(body)["batch"]["links"]:
+            invites.append({**link, "condition_order": condition_order, "language": language})
+        remaining -= quantity
+        batch_number += 1
+    return invites
+
+
+def run_load_test(transport, admin_password: str, steps: list, participants: int, concurrency: int, turns: int,
+                  ramp_seconds: float = 0.0, think_seconds: float = 0.0, language: str = "en",
+                  start_experiment: bool = True, seed: int = 0, legacy_chat: bool = False) -> dict:
+    admin = transport.session()
+    status, body, _, _ = admin.request("POST", "/admin/login", {"password": admin_password})
+    if status != 200:
+        raise SystemExit(f"❌ Admin login failed ({status}): {body[:200]!r}")
+
+    invites = _create_invites(admin, participants, language)
+    before = _admin_stats(admin).get("mongo_operations", {}).get("totals", {})
+
+    recorder = RouteRecorder()
+    failures = []
+    completed = []
+    lock = threading.Lock()
+
+    def run_participant(index: int, invite: dict):
+        if ramp_seconds > 0:
+            time.sleep(ramp_seconds * index / max(1, participants))
+        participant = VirtualParticipant(
+            transport.session(), recorder, invite, steps, turns, think_seconds, start_experiment,
+            random.Random(seed * 100003 + index), legacy_chat
+        )
+        started = time.perf_counter()
+        try:
+            participant.run()
+            with lock:
+                completed.append(time.perf_counter() - started)
+        except Exception as e:
+            with lock:
+                failures.append({"participant_id": participant.participant_id, "error": str(e)})
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, invite in enumerate(invites):
+            pool.submit(run_participant, index, invite)
+    wall_seconds = time.perf_counter() - started
+
+    server_stats = _wait_for_background_jobs(admin, timeout=60)
+    after = server_stats.get("mongo_operations", {}).get("totals", {})
+    reads = after.get("reads", 0) - before.get("reads", 0)
+    writes = after.get("writes", 0) - before.get("writes", 0)
+    routes = recorder.summary(wall_seconds)
+    total_requests = sum(r["count"] for name, r in routes.items() if not name.endswith("(ttfb)"))
+    total_errors = sum(r["errors"] for name, r in routes.items() if not name.endswith("(ttfb)"))
+    completed.sort()
+
+    return {
+        "config": {
+            "participants": participants, "concurrency": concurrency, "turns": turns,
+            "ramp_seconds": ramp_seconds, "think_seconds": think_seconds, "language": language,
+            "start_experiment": start_experiment, "seed": seed, "legacy_chat": legacy_chat,
+            "llm_provider": os.getenv("LLM_PROVIDER", "gemini"),
+        },
+        "wall_seconds": round(wall_seconds, 3),
+        "participants": {
+            "completed": len(completed),
+            "failed": len(failures),
+            "per_minute": round(len(completed) / wall_seconds * 60, 2) if wall_seconds else 0.0,
+            "duration_p50_s": round(percentile(completed, 50), 3),
+            "duration_p95_s": round(percentile(completed, 95), 3),
+            "failures": failures[:20],
+        },
+        "requests": {
+            "total": total_requests,
+            "errors": total_errors,
+            "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+            "throughput_rps": round(total_requests / wall_seconds, 2) if wall_seconds else 0.0,
+        },
+        "routes": routes,
+        "mongo_operations": {
+            "reads": reads,
+            "writes": writes,
+            "reads_per_participant": round(reads / participants, 2),
+            "writes_per_participant": round(writes / participants, 2),
+        },
+        "server_stats": server_stats,
+    }
+
+
+def print_report(report: dict):
+    print(f"\n📊 Load test: {report['config']['participants']} participants, "
+          f"concurrency {report['config']['concurrency']}, {report['config']['turns']} turns/dialogue")
+    participants = report["participants"]
+    requests = report["requests"]
+    print(f"   wall time {report['wall_seconds']}s | completed {participants['completed']} | "
+          f"failed {participants['failed']} | {participants['per_minute']} participants/min")
+    print(f"   requests {requests['total']} | {requests['throughput_rps']} req/s | "
+          f"error rate {requests['error_rate']:.2%}")
+    mongo = report["mongo_operations"]
+    print(f"   mongo per participant: {mongo['reads_per_participant']} reads, "
+          f"{mongo['writes_per_participant']} writes")
+    print(f"\n   {'route':<32}{'count':>7}{'err':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for route, stats in report["routes"].items():
+        print(f"   {route:<32}{stats['count']:>7}{stats['errors']:>6}{stats['p50_ms']:>10}"
+              f"{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['max_ms']:>10}")
+    for failure in participants["failures"][:5]:
+        print(f"   ❌ {failure['participant_id']}: {failure['error']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate a cohort of participants running the full experiment.")
+    parser.add_argument("--participants", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per dialogue step")
+    parser.add_argument("--ramp-seconds", type=float, default=0.0, help="spread participant start times")
+    parser.add_argument("--think-seconds", type=float, default=0.0, help="mean pause between actions")
+    parser.add_argument("--language", choices=["en", "zh-CN"], default="en")
+    parser.add_argument("--skip-start-experiment", action="store_true",
+                        help="only use the invite link to initialise participants")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--legacy-chat", action="store_true",
+                        help="use separate /analyze + /chat requests instead of /chat_turn")
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--mongo-uri", help="in-process mode only (default: mongomock://)")
+    parser.add_argument("--admin-password", help="required with --base-url")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    args = parser.parse_args(argv)
+
+    if args.base_url:
+        if not args.admin_password:
+            parser.error("--admin-password is required with --base-url")
+        transport = HttpTransport(args.base_url)
+        admin_password = args.admin_password
+        from backend.config import EXPERIMENT_STEPS
+    else:
+        # 必须在导入 backend.app 之前设置，确保不会访问真实的 Gemini / MongoDB
+        os.environ["MONGO_URI"] = args.mongo_uri or "mongomock://"
+        os.environ.setdefault("LLM_PROVIDER", "fake")
+        # 应用的逐请求日志会淹没报告；需要时可用 LOG_LEVEL=INFO 打开
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        admin_password = args.admin_password or os.environ.get("ADMIN_PASSWORD") or secrets.token_hex(8)
+        os.environ["ADMIN_PASSWORD"] = admin_password
+        from backend.app import app
+        from backend.config import EXPERIMENT_STEPS
+        transport = InProcessTransport(app)
+
+    report = run_load_test(
+        transport, admin_password, EXPERIMENT_STEPS,
+        participants=args.participants, concurrency=args.concurrency, turns=args.turns,
+        ramp_seconds=args.ramp_seconds, think_seconds=args.think_seconds, language=args.language,
+        start_experiment=not args.skip_start_experiment, seed=args.seed, legacy_chat=args.legacy_chat
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report written to {args.output}")
+    return 0 if report["participants"]["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
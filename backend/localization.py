@@ -1,4 +1,11 @@
 # backend/localization.py
+import hashlib
+import json
+from types import MappingProxyType
+
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
 
 # 实验中所有 UI 文本的本地化字典
 # 键为模块/页面名，值为文本键值对
@@ -456,44 +463,90 @@ LOCALIZATION_STRINGS = {
 }
 
 
-# (辅助函数 get_localized_string 保持不变)
+# --- 预计算的本地化 Bundle ---
+# 导入时为每个 (模块, 语言) 合并好 全局文本 + 模块文本，并提前解析好回退到英文的逻辑，
+# 结果冻结为只读映射。页面渲染时只需一次字典查找，不再每次重新构建。
+DEFAULT_LANGUAGE = "en"
+SUPPORTED_LANGUAGES = ("en", "zh-CN")
+
+
+def _build_bundle(module: str, language: str) -> MappingProxyType:
+    merged = {}
+    # 优先级从低到高：全局英文 → 模块英文 → 全局当前语言 → 模块当前语言
+    # (模块缺少某个 key 的翻译时，英文回退不会盖过全局文本中已有的翻译)
+    for lang in (DEFAULT_LANGUAGE, language):
+        for source in ("global", module):
+            merged.update(LOCALIZATION_STRINGS.get(source, {}).get(lang, {}))
+    return MappingProxyType(merged)
+
+
+LOCALIZATION_BUNDLES = {
+    (module, language): _build_bundle(module, language)
+    for module in LOCALIZATION_STRINGS
+    for language in SUPPORTED_LANGUAGES
+}
+
+# JSON 序列化结果同样只计算一次，供前端按版本号缓存
+_BUNDLE_JSON = {
+    key: json.dumps(dict(bundle), ensure_ascii=False, sort_keys=True).encode("utf-8")
+    for key, bundle in LOCALIZATION_BUNDLES.items()
+}
+LOCALIZATION_VERSION = hashlib.sha256(
+    b"".join(_BUNDLE_JSON[key] for key in sorted(_BUNDLE_JSON))
+).hexdigest()[:12]
+
+
+def _resolve_bundle_key(module: str, language: str) -> tuple:
+    if language not in SUPPORTED_LANGUAGES:
+        language = DEFAULT_LANGUAGE
+    if module not in LOCALIZATION_STRINGS:
+        module = "global"
+    return module, language
+
+
+def find_missing_localization_keys() -> list:
+    """检查每个模块中各语言相对英文缺失 (或多出) 的 key，返回问题描述列表"""
+    problems = []
+    for module, languages in LOCALIZATION_STRINGS.items():
+        reference_keys = set(languages.get(DEFAULT_LANGUAGE, {}))
+        for language in SUPPORTED_LANGUAGES:
+            if language == DEFAULT_LANGUAGE:
+                continue
+            language_keys = set(languages.get(language, {}))
+            for key in sorted(reference_keys - language_keys):
+                problems.append(f"{module}.{key} missing in '{language}' (falls back to English)")
+            for key in sorted(language_keys - reference_keys):
+                problems.append(f"{module}.{key} exists in '{language}' but not in English")
+    return problems
+
+
+def check_localization() -> bool:
+    """启动时调用：记录缺失的翻译，而不是在运行时输出 [[MISSING_KEY]]"""
+    problems = find_missing_localization_keys()
+    for problem in problems:
+        log.warning("localization_missing_key", f"⚠️ Localization: {problem}", problem=problem)
+    if not problems:
+        log.info("localization_ready",
+                 f"🌐 Localization bundles ready ({len(LOCALIZATION_BUNDLES)} bundles, version {LOCALIZATION_VERSION})",
+                 bundles=len(LOCALIZATION_BUNDLES), version=LOCALIZATION_VERSION)
+    return not problems
+
+
 def get_localized_string(module: str, key: str, language: str) -> str:
-    """从本地化字典中安全地获取指定语言的文本"""
-    # 优先获取模块内的文本
-    if module in LOCALIZATION_STRINGS and key in LOCALIZATION_STRINGS[module].get(language, {}):
-        return LOCALIZATION_STRINGS[module][language][key]
-
-    # 其次尝试获取全局文本
-    if key in LOCALIZATION_STRINGS["global"].get(language, {}):
-        return LOCALIZATION_STRINGS["global"][language][key]
-
-    # 如果找不到任何翻译，则回退到英文版本（默认）
-    default_lang = "en"
-    if module in LOCALIZATION_STRINGS and key in LOCALIZATION_STRINGS[module].get(default_lang, {}):
-        return LOCALIZATION_STRINGS[module][default_lang][key]
-    if key in LOCALIZATION_STRINGS["global"].get(default_lang, {}):
-        return LOCALIZATION_STRINGS["global"][default_lang][key]
+    """从预计算的 bundle 中安全地获取指定语言的文本 (已包含全局文本和英文回退)"""
+    bundle = LOCALIZATION_BUNDLES[_resolve_bundle_key(module, language)]
+    if key in bundle:
+        return bundle[key]
 
     # 如果连默认英文都找不到，则返回一个错误提示
     return f"[[MISSING_KEY: {module}.{key}]]"
 
 
-# (主函数 get_localization_for_page 保持不变)
-def get_localization_for_page(page_module: str, language: str) -> dict:
-    """返回给定页面和语言的所有本地化字符串"""
-
-    # 收集当前页面所需的文本
-    strings = {}
-
-    # 1. 收集全局文本 (确保所有全局文本都存在)
-    for key, value_dict in LOCALIZATION_STRINGS["global"]["en"].items():
-        # 尝试获取用户语言，失败则使用英文默认
-        strings[key] = LOCALIZATION_STRINGS["global"].get(language, {}).get(key, value_dict)
+def get_localization_for_page(page_module: str, language: str) -> MappingProxyType:
+    """返回给定页面和语言的所有本地化字符串 (只读映射，请勿修改)"""
+    return LOCALIZATION_BUNDLES[_resolve_bundle_key(page_module, language)]
 
-    # 2. 收集模块特定文本
-    page_data = LOCALIZATION_STRINGS.get(page_module, {})
-    # 尝试获取用户语言，失败则使用英文默认
-    lang_data = page_data.get(language, page_data.get("en", {}))
-    strings.update(lang_data)
 
-    return strings
\ No newline at end of file
+def get_localization_bundle_json(page_module: str, language: str) -> bytes:
+    """返回给定页面和语言的 bundle 的 JSON 字节串"""
+    return _BUNDLE_JSON[_resolve_bundle_key(page_module, language)]
@@ -0,0 +1,209 @@
+# backend/metrics.py
+"""
+轻量级进程内指标 (Counter / Gauge / Histogram)，输出 Prometheus 文本格式。
+每个指标一把锁，observe 只做一次二分查找和几次加法，开销足够低，可以在生产环境常开。
+"""
+import bisect
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: dict = None) -> str:
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    for name, value in (extra or {}).items():
+        pairs.append(f'{name}="{_escape_label_value(value)}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted(self._values.items())
+        lines = self._header()
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value: float):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [每个桶的计数 (不累计)..., +Inf 桶], sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> list:
+        with self._lock:
+            items = sorted((labels, [list(state[0]), state[1], state[2]]) for labels, state in self._values.items())
+        lines = self._header()
+        for labels, (bucket_counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, labels, {"le": _format_value(float(bound))})
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_text = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_text} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, collector):
+        """
+        collector() 在每次导出时调用，返回 [(name, type, help, [(labels_dict, value), ...]), ...]，
+        用于把已有的统计字典 (缓存命中率、队列深度等) 按需转成指标，平时不产生任何开销。
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, metric_type, documentation, samples in families:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    label_text = _format_labels(tuple(labels), tuple(labels.values())) if labels else ""
+                    lines.append(f"{name}{label_text} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1"):
+    """在单独的端口上提供 /metrics (无需管理员登录，只应绑定在内网地址上)"""
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        # 多个 gunicorn worker 时只有第一个能绑定成功
+        log.warning("metrics_server_bind_failed", f"⚠️ Metrics server not started on {host}:{port}: {e}",
+                    host=host, port=port, error=str(e))
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    log.info("metrics_server_started", f"📈 Metrics server listening on http://{host}:{port}/metrics",
+             host=host, port=port)
+    return server
@@ -0,0 +1,195 @@
+# backend/sentiment_lexicon.py
+"""
+本地第一层情绪分类器：中英文情绪词典 + 规则打分 (否定、程度副词、转折、问句、反讽)，标签为 EKMAN_EMOTIONS。
+面向问候和简短陈述；返回 (emotion, confidence)，由 sentiment_service 按阈值决定是否直接采用。
+纯 Python，无外部依赖，单次调用在微秒级。
+"""
+import re
+
+_EN_LEXICON = {
+    "joy": {
+        "happy": 1.0, "glad": 1.0, "love": 1.0, "loved": 1.0, "awesome": 1.0, "excited": 1.0, "wonderful": 1.0,
+        "amazing": 0.9, "fantastic": 1.0, "delighted": 1.0, "cheerful": 1.0, "yay": 1.0, "great": 0.8,
+        "excellent": 0.9, "proud": 0.8, "grateful": 0.8, "thrilled": 1.0, "enjoy": 0.8, "enjoyed": 0.8,
+        "lovely": 0.8, "relieved": 0.7, "fun": 0.7, "good": 0.6, "nice": 0.5,
+    },
+    "sadness": {
+        "sad": 1.0, "unhappy": 1.0, "depressed": 1.0, "lonely": 1.0, "heartbroken": 1.0, "hopeless": 1.0,
+        "miserable": 1.0, "grief": 1.0, "crying": 0.9, "cried": 0.9, "cry": 0.9, "disappointed": 0.9,
+        "breakup": 0.9, "failed": 0.8, "failure": 0.8, "upset": 0.8, "fail": 0.7, "hurt": 0.7, "miss": 0.6, "lost": 0.6,
+        "exhausted": 0.6, "tired": 0.5, "down": 0.5,
+    },
+    "anger": {
+        "angry": 1.0, "furious": 1.0, "pissed": 1.0, "rage": 1.0, "mad": 0.9, "hate": 0.9, "irritated": 0.9,
+        "annoyed": 0.8, "annoying": 0.8, "frustrated": 0.8, "unfair": 0.6,
+    },
+    "fear": {
+        "afraid": 1.0, "scared": 1.0, "terrified": 1.0, "frightened": 1.0, "panic": 1.0, "fear": 1.0,
+        "anxious": 0.9, "worried": 0.9, "nervous": 0.9, "worry": 0.8, "stressed": 0.6,
+    },
+    "disgust": {
+        "disgusting": 1.0, "disgusted": 1.0, "revolting": 1.0, "yuck": 1.0, "gross": 0.9, "nasty": 0.8,
+    },
+    "surprise": {
+        "surprised": 1.0, "shocked": 0.9, "wow": 0.9, "unexpected": 0.8, "unbelievable": 0.8, "omg": 0.8,
+        "amazed": 0.7,
+    },
+}
+
+_ZH_LEXICON = {
+    "joy": {
+        "开心": 1.0, "高兴": 1.0, "快乐": 1.0, "幸福": 1.0, "兴奋": 1.0, "太棒": 1.0, "哈哈": 0.9, "喜欢": 0.8,
+        "满意": 0.8, "感激": 0.8, "好玩": 0.7, "轻松": 0.6, "期待": 0.6, "爱": 0.6, "棒": 0.6,
+    },
+    "sadness": {
+        "不开心": 1.0, "难过": 1.0, "伤心": 1.0, "失落": 1.0, "沮丧": 1.0, "孤独": 1.0, "寂寞": 1.0, "痛苦": 1.0,
+        "绝望": 1.0, "想哭": 1.0, "挂科": 0.9, "分手": 0.9, "失望": 0.9, "郁闷": 0.9, "哭": 0.9, "失败": 0.8,
+        "心累": 0.8, "累": 0.5,
+    },
+    "anger": {
+        "生气": 1.0, "愤怒": 1.0, "气死": 1.0, "烦死": 1.0, "恼火": 1.0, "火大": 1.0, "可恶": 0.9, "讨厌": 0.8,
+        "烦": 0.7, "不公平": 0.6,
+    },
+    "fear": {
+        "害怕": 1.0, "焦虑": 1.0, "恐惧": 1.0, "担心": 0.9, "紧张": 0.9, "慌": 0.8, "不安": 0.8, "怕": 0.6,
+        "压力": 0.5,
+    },
+    "disgust": {
+        "恶心": 1.0, "厌恶": 1.0, "反感": 0.9, "受不了": 0.6,
+    },
+    "surprise": {
+        "惊讶": 1.0, "吃惊": 1.0, "震惊": 1.0, "没想到": 0.9, "哇": 0.8, "居然": 0.6, "竟然": 0.6,
+    },
+}
+
+# 整句就是问候 / 客套话时直接判为 neutral
+_EN_NEUTRAL_PHRASES = {
+    "hi", "hello", "hey", "hiya", "hi there", "hello there", "hey there", "good morning", "good afternoon",
+    "good evening", "thanks", "thank you", "ok", "okay", "sure", "yes", "no", "bye", "goodbye", "see you",
+    "nice to meet you", "how are you", "whats up", "what's up", "i want to talk", "can we talk",
+}
+_ZH_NEUTRAL_PHRASES = {
+    "你好", "您好", "嗨", "哈喽", "早上好", "下午好", "晚上好", "早", "谢谢", "好的", "好", "嗯", "嗯嗯", "再见",
+    "拜拜", "在吗", "你好呀", "我想聊聊", "我想聊聊天", "聊聊天",
+}
+
+_EN_NEGATIONS = {"not", "no", "never", "dont", "didnt", "isnt", "wasnt", "arent", "cant", "cannot", "wont",
+                 "nothing", "hardly"}
+_EN_INTENSIFIERS = {"very", "so", "really", "extremely", "super", "too", "totally", "truly", "incredibly"}
+_EN_CONTRAST = {"but", "though", "although", "however"}
+_ZH_NEGATIONS = ("不", "没", "没有", "别", "未", "并不")
+_ZH_INTENSIFIERS = ("非常", "特别", "超级", "很", "太", "好", "超", "真")
+_ZH_CONTRAST = ("但是", "可是", "不过", "但")
+# 反讽标记 ("Great, just great."、"呵呵")：正面词不再计分，置信度压到阈值以下交给模型
+_EN_SARCASM_MARKERS = ("just great", "just perfect", "just wonderful", "just what i needed", "oh great", "oh good",
+                       "oh joy", "yeah right", "thanks a lot", "thanks for nothing")
+_ZH_SARCASM_MARKERS = ("呵呵", "真行", "好极了", "谢谢你啊")
+
+_CHINESE_PATTERN = re.compile(r'[\u4e00-\u9fff]')
+_EN_TOKEN_PATTERN = re.compile(r"[a-z']+")
+_PUNCTUATION_PATTERN = re.compile(r"[\s!！.。,，?？~～…:;：；]+")
+_ZH_ENTRIES = sorted(
+    ((word, emotion, weight) for emotion, words in _ZH_LEXICON.items() for word, weight in words.items()),
+    key=lambda entry: -len(entry[0])
+)
+
+_INTENSIFIER_BOOST = 1.3
+_NEGATION_PENALTY = 0.7
+_CONTRAST_PENALTY = 0.85
+_QUESTION_PENALTY = 0.85
+_MIXED_PENALTY = 0.6
+_SARCASM_MAX_CONFIDENCE = 0.5
+_MAX_CONFIDENCE = 0.97
+# 被否定的正面词 ("not happy"、"不是很开心") 按这个比例计入 sadness；被否定的负面词不计分
+_NEGATED_JOY_WEIGHT = 0.6
+_NEGATIVE_EMOTIONS = ("sadness", "anger", "fear", "disgust")
+
+
+def _score_english(text: str, scores: dict) -> int:
+    """累加英文词的情绪分数；返回被否定的情绪词个数"""
+    raw_tokens = _EN_TOKEN_PATTERN.findall(text.lower())
+    tokens = [token.replace("'", "") for token in raw_tokens]
+    negators = [token in _EN_NEGATIONS or raw.endswith("n't") for raw, token in zip(raw_tokens, tokens)]
+    negated = 0
+    for i, token in enumerate(tokens):
+        for emotion, words in _EN_LEXICON.items():
+            weight = words.get(token)
+            if weight is None:
+                continue
+            # 前三个词内有否定词 ("not really happy"、"don't feel sad")：降低置信度，"not happy" 记为 sadness
+            if any(negators[max(0, i - 3):i]):
+                negated += 1
+                if emotion == "joy":
+                    scores["sadness"] = scores.get("sadness", 0.0) + weight * _NEGATED_JOY_WEIGHT
+                continue
+            if i > 0 and tokens[i - 1] in _EN_INTENSIFIERS:
+                weight *= _INTENSIFIER_BOOST
+            scores[emotion] = scores.get(emotion, 0.0) + weight
+    return negated
+
+
+def _score_chinese(text: str, scores: dict) -> int:
+    """最长匹配扫描中文情绪词 (如 "不开心" 优先于 "开心")；返回被否定的情绪词个数"""
+    negated = 0
+    i = 0
+    while i < len(text):
+        for word, emotion, weight in _ZH_ENTRIES:
+            if text.startswith(word, i):
+                prefix = text[max(0, i - 3):i]
+                # "不开心" 这类整词已被最长匹配取走；这里处理 "不是很难过"、"没有生气"
+                if any(negation in prefix for negation in _ZH_NEGATIONS):
+                    negated += 1
+                    if emotion == "joy":
+                        scores["sadness"] = scores.get("sadness", 0.0) + weight * _NEGATED_JOY_WEIGHT
+                else:
+                    if prefix.endswith(_ZH_INTENSIFIERS):
+                        weight *= _INTENSIFIER_BOOST
+                    scores[emotion] = scores.get(emotion, 0.0) + weight
+                i += len(word)
+                break
+        else:
+            i += 1
+    return negated
+
+
+def classify(text: str) -> tuple:
+    """返回 (emotion, confidence)；没有足够证据时为低置信度的 neutral"""
+    normalized = _PUNCTUATION_PATTERN.sub(" ", text.lower()).strip()
+    if not normalized:
+        return "neutral", 0.0
+    has_chinese = bool(_CHINESE_PATTERN.search(text))
+    if normalized in _EN_NEUTRAL_PHRASES or normalized.replace(" ", "") in _ZH_NEUTRAL_PHRASES:
+        return "neutral", 0.95
+
+    scores = {}
+    negated = _score_english(text, scores)
+    if has_chinese:
+        negated += _score_chinese(text, scores)
+    sarcastic = any(f" {marker} " in f" {normalized} " for marker in _EN_SARCASM_MARKERS) or any(
+        marker in text for marker in _ZH_SARCASM_MARKERS)
+    if sarcastic:
+        scores.pop("joy", None)
+
+    if not scores:
+        # 没有情绪词：很短的句子大概率是中性陈述，但仍交给模型判断
+        short = len(normalized) <= 8 if has_chinese else len(normalized.split()) <= 3
+        confidence = 0.6 if short and not (negated or sarcastic) else 0.3
+        return "neutral", confidence
+
+    emotion = max(scores, key=scores.get)
+    top = scores[emotion]
+    share = top / sum(scores.values())
+    confidence = share * (0.55 + 0.45 * min(1.0, top / 1.5))
+    if negated:
+        confidence *= _NEGATION_PENALTY
+    # 正负面词同时出现 ("great... another failure")：很可能是反讽或复杂情绪
+    if emotion == "joy" and any(scores.get(negative) for negative in _NEGATIVE_EMOTIONS):
+        confidence *= _MIXED_PENALTY
+    lowered = text.lower()
+    if any(f" {word} " in f" {lowered} " for word in _EN_CONTRAST) or any(word in text for word in _ZH_CONTRAST):
+        confidence *= _CONTRAST_PENALTY
+    if "?" in text or "？" in text or text.rstrip().endswith(("吗", "吧", "呢")):
+        confidence *= _QUESTION_PENALTY
+    if sarcastic:
+        confidence = min(confidence, _SARCASM_MAX_CONFIDENCE)
+    return emotion, round(min(confidence, _MAX_CONFIDENCE), 4)
@@ -1,16 +1,28 @@
 # backend/sentiment_service.py
+import asyncio
+import copy
+import hashlib
 import json
-import logging
+import random
 import re
-from google import genai
-from google.genai import types
+import threading
+import time
+from collections import OrderedDict
 
-from backend.config import GEMINI_API_KEY, GEMINI_MODEL_NAME
+from backend import sentiment_lexicon
+from backend.config import (
+    SENTIMENT_CACHE_TTL_SECONDS, SENTIMENT_CACHE_MAX_ENTRIES, SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS,
+    SENTIMENT_LOCAL_TIER, SENTIMENT_LOCAL_THRESHOLD, SENTIMENT_LOCAL_MAX_CHARS, SENTIMENT_LOCAL_SHADOW_RATE
+)
+from backend.event_log import get_event_logger
+from backend.io_steps import run_steps, run_steps_async
+from backend.job_queue import BackgroundJobQueue
+from backend.llm_provider import get_provider
+from backend.llm_usage import InstrumentedProvider
 
-_client = genai.Client(api_key=GEMINI_API_KEY)
+_provider = InstrumentedProvider(get_provider())
 
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+log = get_event_logger(__name__)
 
 EKMAN_EMOTIONS = ["anger", "disgust", "fear", "joy", "neutral", "sadness", "surprise"]
 EMOTION_POLARITY = {"joy": 1.0, "neutral": 0.0, "surprise": 0.1, "sadness": -1.0, "fear": -1.0, "anger": -1.0,
@@ -18,7 +30,8 @@ EMOTION_POLARITY = {"joy": 1.0, "neutral": 0.0, "surprise": 0.1, "sadness": -1.0
 
 
 def init_sentiment_model():
-    logger.info(f"🚀 Sentiment Engine using Gemini ({GEMINI_MODEL_NAME}). Ready.")
+    log.info("sentiment_engine_ready", f"🚀 Sentiment Engine using {_provider.model_label}. Ready.",
+             model=_provider.model_label)
 
 
 def contains_chinese(text: str) -> bool:
@@ -32,10 +45,240 @@ def calculate_weighted_score(emotion_label: str, confidence: float) -> float:
     return weight * confidence
 
 
-def analyze_sentiment(text: str) -> dict:
+# --- 情绪分析结果缓存 + single-flight ---
+# XAI 页面会同时请求 /analyze 和 /chat，两者都会对同一句话做情绪分析。
+# 结果按文本内容哈希缓存 (LRU + TTL)；并发的相同请求等待正在进行的那一次调用，而不是重复请求 Gemini。
+class _InFlightCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_sentiment_cache = OrderedDict()  # key -> (expires_at, result)
+_inflight_calls = {}  # key -> _InFlightCall
+_sentiment_cache_lock = threading.Lock()
+_sentiment_cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "expirations": 0}
+
+
+def _sentiment_cache_key(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _cache_lookup(key: str):
+    """调用方需持有 _sentiment_cache_lock"""
+    entry = _sentiment_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, result = entry
+    if expires_at <= time.monotonic():
+        del _sentiment_cache[key]
+        _sentiment_cache_stats["expirations"] += 1
+        return None
+    _sentiment_cache.move_to_end(key)
+    return result
+
+
+def _cache_store(key: str, result: dict):
+    if SENTIMENT_CACHE_TTL_SECONDS <= 0 or SENTIMENT_CACHE_MAX_ENTRIES <= 0:
+        return
+    with _sentiment_cache_lock:
+        _sentiment_cache[key] = (time.monotonic() + SENTIMENT_CACHE_TTL_SECONDS, result)
+        _sentiment_cache.move_to_end(key)
+        while len(_sentiment_cache) > SENTIMENT_CACHE_MAX_ENTRIES:
+            _sentiment_cache.popitem(last=False)
+            _sentiment_cache_stats["evictions"] += 1
+
+
+def get_cached_sentiment(text: str):
+    """只查缓存，不调用模型；未命中返回 None"""
+    if not text:
+        return None
+    with _sentiment_cache_lock:
+        cached = _cache_lookup(_sentiment_cache_key(text))
+        if cached is None:
+            return None
+        _sentiment_cache_stats["hits"] += 1
+    return copy.deepcopy(cached)
+
+
+def remember_sentiment(text: str, emotion, confidence) -> dict:
+    """其他调用 (如合并的情绪 + 解释调用) 得到的分类结果：按相同格式构造并写入缓存，post-turn 分析直接复用"""
+    result = _build_sentiment_result(emotion, confidence)
+    _cache_store(_sentiment_cache_key(text), result)
+    return copy.deepcopy(result)
+
+
+def get_sentiment_cache_stats() -> dict:
+    with _sentiment_cache_lock:
+        stats = dict(_sentiment_cache_stats)
+        stats["size"] = len(_sentiment_cache)
+        stats["in_flight"] = len(_inflight_calls)
+    lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    stats["coalesce_rate"] = round(stats["coalesced"] / lookups, 4) if lookups else 0.0
+    stats["max_entries"] = SENTIMENT_CACHE_MAX_ENTRIES
+    stats["ttl_seconds"] = SENTIMENT_CACHE_TTL_SECONDS
+    return stats
+
+
+def _claim(key: str) -> tuple:
+    """返回 (cached, call, is_leader)：命中缓存时 cached 非空；否则 is_leader 表示由本次调用负责请求模型"""
+    with _sentiment_cache_lock:
+        cached = _cache_lookup(key)
+        if cached is not None:
+            _sentiment_cache_stats["hits"] += 1
+            return copy.deepcopy(cached), None, False
+        call = _inflight_calls.get(key)
+        is_leader = call is None
+        if is_leader:
+            _sentiment_cache_stats["misses"] += 1
+            call = _InFlightCall()
+            _inflight_calls[key] = call
+        else:
+            _sentiment_cache_stats["coalesced"] += 1
+    return None, call, is_leader
+
+
+def _settle(key: str, call: _InFlightCall, result: dict):
+    """leader 完成 (result 为 None 表示异常退出)：写缓存并唤醒等待者"""
+    call.result = result
+    # 失败时的兜底结果 (没有 model_used) 不写入缓存，下次重新尝试
+    if result and result.get("model_used"):
+        _cache_store(key, result)
+    with _sentiment_cache_lock:
+        _inflight_calls.pop(key, None)
+    call.done.set()
+
+
+# --- 第一层: 本地词典分类 ---
+# 置信度达到 SENTIMENT_LOCAL_THRESHOLD 时直接返回 (命中)，否则交给 Gemini (第二层)。
+# 一致率按本地置信度分桶统计: 阈值以下的桶来自本来就要请求 Gemini 的文本 (无额外开销)，
+# 阈值以上的桶来自命中后按 SENTIMENT_LOCAL_SHADOW_RATE 抽样的后台 Gemini 调用。
+LOCAL_MODEL_LABEL = "Local-Lexicon"
+
+_tier_lock = threading.Lock()
+_tier_stats = {"attempts": 0, "hits": 0, "shadow_submitted": 0, "shadow_compared": 0, "shadow_agreed": 0}
+_agreement_by_confidence = {}  # "0.8" -> [compared, agreed]
+_shadow_queue = BackgroundJobQueue("sentiment_shadow", workers=1, max_size=32, put_timeout=0, drop_when_full=True)
+
+
+def local_tier(text: str, record_stats: bool = True) -> tuple:
+    """
+    返回 (result, prediction)：命中时 result 为可直接使用的情绪结果 (同时写入缓存，post-turn 分析直接复用)；
+    未命中时 result 为 None，prediction 为本地的 (emotion, confidence)，得到 Gemini 结果后传给 record_local_agreement。
+    record_stats=False 时不计入命中率、不抽样对照，prediction 也总是 None。
+    """
+    if not SENTIMENT_LOCAL_TIER or not text or len(text) > SENTIMENT_LOCAL_MAX_CHARS:
+        return None, None
+    emotion, confidence = sentiment_lexicon.classify(text)
+    hit = confidence >= SENTIMENT_LOCAL_THRESHOLD
+    if record_stats:
+        with _tier_lock:
+            _tier_stats["attempts"] += 1
+            _tier_stats["hits"] += 1 if hit else 0
+    if not hit:
+        return None, (emotion, confidence) if record_stats else None
+    if record_stats and random.random() < SENTIMENT_LOCAL_SHADOW_RATE and _shadow_queue.submit(
+            _shadow_compare, text, emotion, confidence):
+        with _tier_lock:
+            _tier_stats["shadow_submitted"] += 1
+    result = _build_sentiment_result(emotion, confidence, model_used=LOCAL_MODEL_LABEL)
+    _cache_store(_sentiment_cache_key(text), result)
+    return copy.deepcopy(result), None
+
+
+def record_local_agreement(prediction: tuple, result: dict, shadow: bool = False):
+    """比较本地预测与 Gemini 结果 (Gemini 失败的兜底结果不计入)"""
+    if prediction is None or not result or not result.get("model_used"):
+        return
+    emotion, confidence = prediction
+    bucket = f"{min(int(confidence * 10), 9) / 10:.1f}"
+    agreed = emotion == result.get("top_emotion")
+    with _tier_lock:
+        counts = _agreement_by_confidence.setdefault(bucket, [0, 0])
+        counts[0] += 1
+        counts[1] += 1 if agreed else 0
+        if shadow:
+            _tier_stats["shadow_compared"] += 1
+            _tier_stats["shadow_agreed"] += 1 if agreed else 0
+
+
+def _shadow_compare(text: str, emotion: str, confidence: float):
+    result = _classify_sentiment(text, call_type="sentiment_shadow")
+    record_local_agreement((emotion, confidence), result, shadow=True)
+
+
+def get_tier_stats() -> dict:
+    with _tier_lock:
+        stats = dict(_tier_stats)
+        buckets = {bucket: list(counts) for bucket, counts in _agreement_by_confidence.items()}
+    stats["hit_rate"] = round(stats["hits"] / stats["attempts"], 4) if stats["attempts"] else 0.0
+    stats["shadow_agreement_rate"] = (
+        round(stats["shadow_agreed"] / stats["shadow_compared"], 4) if stats["shadow_compared"] else None
+    )
+    stats["agreement_by_confidence"] = {
+        bucket: {"compared": compared, "agreed": agreed, "rate": round(agreed / compared, 4)}
+        for bucket, (compared, agreed) in sorted(buckets.items())
+    }
+    stats["enabled"] = SENTIMENT_LOCAL_TIER
+    stats["threshold"] = SENTIMENT_LOCAL_THRESHOLD
+    stats["shadow_rate"] = SENTIMENT_LOCAL_SHADOW_RATE
+    stats["shadow_queue"] = _shadow_queue.get_stats()
+    return stats
+
+
+def _sentiment_steps(text: str, use_local_tier: bool):
+    """analyze_sentiment 的流程 (同步、异步版本共用，见 io_steps)；I/O 请求见 _sentiment_io"""
     if not text:
         return {"top_emotion": "neutral", "top_score": 0.0, "raw_scores": {}}
 
+    prediction = None
+    if use_local_tier:
+        local, prediction = local_tier(text)
+        if local is not None:
+            return local
+
+    key = _sentiment_cache_key(text)
+    cached, call, is_leader = _claim(key)
+    if cached is not None:
+        return cached
+
+    if not is_leader:
+        if (yield "wait", call) and call.result is not None:
+            return copy.deepcopy(call.result)
+        # 正在进行的调用超时或异常退出时，自行调用一次
+        return (yield from _classification_steps(text))
+
+    result = None
+    try:
+        result = yield from _classification_steps(text)
+        record_local_agreement(prediction, result)
+        return copy.deepcopy(result)
+    finally:
+        _settle(key, call, result)
+
+
+def analyze_sentiment(text: str, use_local_tier: bool = True) -> dict:
+    """情绪分析入口：先用本地分类器，再查缓存，再合并并发的相同请求，最后才调用 Gemini"""
+    return run_steps(_sentiment_steps(text, use_local_tier), _sentiment_io)
+
+
+async def analyze_sentiment_async(text: str, use_local_tier: bool = True) -> dict:
+    """analyze_sentiment 的异步版本 (ASGI 模式)，与同步版本共享本地分类器、缓存和 single-flight"""
+    return await run_steps_async(_sentiment_steps(text, use_local_tier), _sentiment_io_async)
+
+
+_SENTIMENT_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "emotion": {"type": "string", "enum": EKMAN_EMOTIONS},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+    },
+    "required": ["emotion", "confidence"],
+}
+
+
+def _sentiment_prompt(text: str) -> str:
     if contains_chinese(text):
         prompt = f"""
         请分析用户输入的情感，并从以下列表中选择最准确的一个标签：{EKMAN_EMOTIONS}。
@@ -71,38 +314,208 @@ def analyze_sentiment(text: str) -> dict:
             "confidence": 0.95
         }}
         """
+    return prompt
 
+
+def _classification_steps(text: str, call_type: str = "sentiment"):
     try:
-        response = _client.models.generate_content(
-            model=GEMINI_MODEL_NAME,
-            contents=prompt,
-            config=types.GenerateContentConfig(
-                temperature=0.1,
-                response_mime_type="application/json"
-            )
-        )
-        content = json.loads(response.text)
-        emotion = content.get("emotion", "neutral").lower()
-        confidence = content.get("confidence", 0.9)
-
-        if emotion not in EKMAN_EMOTIONS:
-            if "happy" in emotion or "love" in emotion:
-                emotion = "joy"
-            elif "sad" in emotion:
-                emotion = "sadness"
-            else:
-                emotion = "neutral"
-
-        raw_scores = {e: (confidence if e == emotion else 0.01) for e in EKMAN_EMOTIONS}
-
-        return {
-            "top_emotion": emotion,
-            "top_score": confidence,
-            "ekman_scores": raw_scores,
-            "raw_scores": raw_scores,
-            "model_used": f"Gemini-{GEMINI_MODEL_NAME}"
-        }
+        content = yield "classify", _sentiment_prompt(text), call_type
+        return _build_sentiment_result(content.get("emotion", "neutral"), content.get("confidence", 0.9))
 
     except Exception as e:
-        logger.error(f"Analysis Failed: {e}")
-        return {"top_emotion": "neutral", "top_score": 0.0, "ekman_scores": {}, "raw_scores": {}}
+        log.error("sentiment_failed", f"Analysis Failed: {e}", call_type=call_type, error=str(e))
+        return _fallback_sentiment()
+
+
+def _sentiment_io(kind: str, *args):
+    if kind == "wait":
+        return args[0].done.wait(SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS)
+    prompt, call_type = args
+    return _provider.generate_json(prompt, _SENTIMENT_RESPONSE_SCHEMA, call_type=call_type, temperature=0.1).data
+
+
+async def _sentiment_io_async(kind: str, *args):
+    if kind == "wait":
+        # leader 可能是另一个线程 (WSGI 路由或后台队列)，在线程池里等待它的 Event
+        return await asyncio.to_thread(args[0].done.wait, SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS)
+    prompt, call_type = args
+    response = await _provider.agenerate_json(prompt, _SENTIMENT_RESPONSE_SCHEMA, call_type=call_type, temperature=0.1)
+    return response.data
+
+
+def _classify_sentiment(text: str, call_type: str = "sentiment") -> dict:
+    return run_steps(_classification_steps(text, call_type), _sentiment_io)
+
+
+def _normalize_emotion(emotion) -> str:
+    emotion = str(emotion or "neutral").lower()
+    if emotion not in EKMAN_EMOTIONS:
+        if "happy" in emotion or "love" in emotion:
+            emotion = "joy"
+        elif "sad" in emotion:
+            emotion = "sadness"
+        else:
+            emotion = "neutral"
+    return emotion
+
+
+def _build_sentiment_result(emotion, confidence, model_used: str = None) -> dict:
+    emotion = _normalize_emotion(emotion)
+    raw_scores = {e: (confidence if e == emotion else 0.01) for e in EKMAN_EMOTIONS}
+
+    return {
+        "top_emotion": emotion,
+        "top_score": confidence,
+        "ekman_scores": raw_scores,
+        "raw_scores": raw_scores,
+        "model_used": model_used or _provider.model_label
+    }
+
+
+def _fallback_sentiment() -> dict:
+    return {"top_emotion": "neutral", "top_score": 0.0, "ekman_scores": {}, "raw_scores": {}}
+
+
+# --- 批量情绪分析 ---
+# 一次结构化输出调用对 N 条文本分类，返回 N 个结果；单条解析失败时该条回退为 neutral。
+def _batch_response_schema(count: int) -> dict:
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "minItems": count,
+                "maxItems": count,
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "index": {"type": "integer"},
+                        "emotion": {"type": "string", "enum": EKMAN_EMOTIONS},
+                        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+                    },
+                    "required": ["index", "emotion", "confidence"],
+                },
+            }
+        },
+        "required": ["results"],
+    }
+
+
+def _classify_sentiment_batch(texts: list) -> list:
+    numbered = "\n".join(f"[{i}] {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts))
+    prompt = f"""
+    Classify the emotion of each of the following {len(texts)} messages independently.
+    Select the best label for each from: {EKMAN_EMOTIONS}.
+    Messages may be in English or Chinese; judge each in its own language.
+
+    Guidelines:
+    1. **Joy**: Happiness, love, liking something (e.g., "I love apples", "我爱吃苹果").
+    2. **Sadness**: Loss, failure, unhappiness (e.g., "break up", "挂科").
+    3. **Neutral**: General statements, greetings (e.g., "你好").
+    4. **Anger/Fear/Disgust/Surprise**: Their standard definitions.
+
+    Messages:
+    {numbered}
+
+    Return one result per message, using the message's [index].
+    """
+
+    try:
+        response = _provider.generate_json(
+            prompt, _batch_response_schema(len(texts)), call_type="sentiment_batch", temperature=0.1
+        )
+        items = response.data.get("results", [])
+    except Exception as e:
+        log.error("sentiment_batch_failed", f"Batch Analysis Failed: {e}", batch_size=len(texts), error=str(e))
+        return [_fallback_sentiment() for _ in texts]
+
+    results = [None] * len(texts)
+    for item in items if isinstance(items, list) else []:
+        try:
+            index = int(item["index"])
+            if 0 <= index < len(texts) and results[index] is None:
+                results[index] = _build_sentiment_result(item["emotion"], float(item["confidence"]))
+        except (KeyError, TypeError, ValueError) as e:
+            log.warning("sentiment_batch_item_malformed", f"Batch Analysis: skipping malformed item {item!r}: {e}",
+                        error=str(e))
+    missing = sum(1 for result in results if result is None)
+    if missing:
+        log.warning("sentiment_batch_incomplete", f"Batch Analysis: {missing}/{len(texts)} items fell back to neutral",
+                    missing=missing, batch_size=len(texts))
+    return [result if result is not None else _fallback_sentiment() for result in results]
+
+
+def analyze_sentiment_batch(texts: list, record_stats: list = None) -> list:
+    """
+    对多条文本做情绪分析，结果顺序与输入一致。
+    缓存命中 (包括本轮早先的本地分类结果)、本地分类器命中和正在进行中的调用会被复用，其余文本合并为一次 Gemini 调用。
+    record_stats[i] 为 False 的文本 (如 AI 回复) 不计入本地分类器的统计，见 local_tier。
+    """
+    results = [None] * len(texts)
+    predictions = [None] * len(texts)
+    for index, text in enumerate(texts):
+        # 已经分类过的文本 (如 XAI 面板分析过的用户输入) 不再经过本地分类器，避免重复计数和重复抽样
+        results[index] = get_cached_sentiment(text)
+        if results[index] is None:
+            tracked = record_stats is None or record_stats[index]
+            results[index], predictions[index] = local_tier(text, record_stats=tracked)
+    pending = {}  # key -> (text, [indexes])
+    waiting = {}  # key -> (_InFlightCall, text, [indexes])
+    leading = {}  # key -> _InFlightCall
+
+    with _sentiment_cache_lock:
+        for index, text in enumerate(texts):
+            if results[index] is not None:
+                continue
+            if not text:
+                results[index] = {"top_emotion": "neutral", "top_score": 0.0, "raw_scores": {}}
+                continue
+            key = _sentiment_cache_key(text)
+            if key in pending:
+                pending[key][1].append(index)
+                continue
+            if key in waiting:
+                waiting[key][2].append(index)
+                continue
+            cached = _cache_lookup(key)
+            if cached is not None:
+                _sentiment_cache_stats["hits"] += 1
+                results[index] = copy.deepcopy(cached)
+                continue
+            call = _inflight_calls.get(key)
+            if call is not None:
+                _sentiment_cache_stats["coalesced"] += 1
+                waiting[key] = (call, text, [index])
+                continue
+            _sentiment_cache_stats["misses"] += 1
+            leading[key] = _InFlightCall()
+            _inflight_calls[key] = leading[key]
+            pending[key] = (text, [index])
+
+    try:
+        if pending:
+            keys = list(pending)
+            classified = _classify_sentiment_batch([pending[key][0] for key in keys])
+            for key, result in zip(keys, classified):
+                leading[key].result = result
+                if result.get("model_used"):
+                    _cache_store(key, result)
+                for index in pending[key][1]:
+                    results[index] = copy.deepcopy(result)
+                    record_local_agreement(predictions[index], result)
+    finally:
+        with _sentiment_cache_lock:
+            for key in leading:
+                _inflight_calls.pop(key, None)
+        for call in leading.values():
+            call.done.set()
+
+    for call, text, indexes in waiting.values():
+        if call.done.wait(SENTIMENT_SINGLE_FLIGHT_TIMEOUT_SECONDS) and call.result is not None:
+            result = call.result
+        else:
+            result = _classify_sentiment(text)
+        for index in indexes:
+            results[index] = copy.deepcopy(result)
+
+    return results
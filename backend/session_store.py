@@ -0,0 +1,347 @@
+# backend/session_store.py
+import copy
+import sys
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from backend import llm_usage
+from backend.config import (
+    SESSION_STORE_BACKEND, SESSION_IDLE_TTL_SECONDS, SESSION_MAX_RESIDENT, SESSION_HISTORY_MAX_MESSAGES,
+    SUMMARY_INTERVAL
+)
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+# 历史只保留 _build_contents 和摘要生成实际需要的部分 (至少一个摘要间隔的消息)
+HISTORY_LIMIT = max(SESSION_HISTORY_MAX_MESSAGES, SUMMARY_INTERVAL * 2)
+
+
+def new_session() -> dict:
+    """参与者会话数据的初始结构"""
+    return {
+        'history': [],  # 只保留最近 HISTORY_LIMIT 条
+        'message_count': 0,  # 累计消息条数 (history 被截断后仍然准确)
+        'summary': "",
+        'summary_turn': 0,  # 当前摘要覆盖到的轮次 (版本号)
+        'turn_count': 0,
+        'post_turns_done': 0,  # 已完成的 post-turn 任务数 (end_dialogue 据此等待最后一轮的情绪分数)
+        'sentiment_scores': []
+    }
+
+
+def approx_session_bytes(session: dict) -> int:
+    """粗略估计一个会话占用的内存字节数"""
+    size = sys.getsizeof(session)
+    for message in session.get('history', []):
+        size += sys.getsizeof(message) + sum(sys.getsizeof(v) for v in message.values())
+    size += sys.getsizeof(session.get('summary', ""))
+    size += sys.getsizeof(session.get('sentiment_scores', [])) + 24 * len(session.get('sentiment_scores', []))
+    return size
+
+
+class SessionStore(ABC):
+    """
+    LLM 会话存储接口。
+    get() 返回的是快照 (修改它不会写回存储)；所有修改都通过下面的原子操作完成，
+    这样多个 worker 进程服务同一参与者时看到的是同一份历史和情绪分数。
+    shared 表示会话是否在多个 worker 进程间共享 (此时进程内的状态不能代表整个参与者)。
+    """
+
+    shared = False
+
+    @abstractmethod
+    def get(self, participant_id: str) -> dict:
+        ...
+
+    @abstractmethod
+    def append_history(self, participant_id: str, message: dict):
+        """追加一条历史消息"""
+
+    @abstractmethod
+    def complete_turn(self, participant_id: str, message: dict) -> dict:
+        """追加 AI 回复并将 turn_count 加一，返回更新后的快照"""
+
+    @abstractmethod
+    def append_sentiment_score(self, participant_id: str, score: float):
+        ...
+
+    @abstractmethod
+    def mark_post_turn_done(self, participant_id: str):
+        """post_turns_done 加一 (无论该轮 post-turn 任务成功与否)"""
+
+    @abstractmethod
+    def set_summary(self, participant_id: str, summary: str, version: int) -> bool:
+        """仅当 version 比当前摘要版本更新时写入；返回是否写入"""
+
+    @abstractmethod
+    def add_llm_usage(self, participant_id: str, call_type: str, deltas: dict):
+        """累加一次 LLM 调用的用量 (llm_usage 的参与者汇总回调)；不随 clear() 清除"""
+
+    @abstractmethod
+    def get_llm_usage(self, participant_id: str) -> dict:
+        """{call_type: totals}，见 llm_usage.summarize_participant_usage"""
+
+    @abstractmethod
+    def set_fields(self, participant_id: str, fields: dict):
+        ...
+
+    @abstractmethod
+    def clear(self, participant_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    def get_stats(self) -> dict:
+        ...
+
+
+def _append_history(session: dict, message: dict):
+    session['history'].append(dict(message))
+    del session['history'][:-HISTORY_LIMIT]
+    session['message_count'] += 1
+
+
+class InMemorySessionStore(SessionStore):
+    """
+    单进程内存实现 (默认)。只适用于单个 worker 进程。
+    会话按最近访问顺序保存：超过 SESSION_IDLE_TTL_SECONDS 未访问的会话被淘汰，
+    常驻会话数超过 SESSION_MAX_RESIDENT 时淘汰最久未访问的会话。
+    淘汰只丢弃历史消息；情绪分数、轮次计数和摘要保留到 clear() (end_dialogue 据此计算 fluctuation)。
+    """
+
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL_SECONDS, max_resident: int = SESSION_MAX_RESIDENT):
+        self._sessions = OrderedDict()  # participant_id -> (last_access, session)
+        self._trimmed = {}  # participant_id -> 被淘汰会话去掉 history 后的部分
+        self._lock = threading.Lock()
+        self._idle_ttl = idle_ttl
+        self._max_resident = max_resident
+        self._stats = {"evicted_idle": 0, "evicted_lru": 0}
+
+    def _evict(self, now: float):
+        """调用方需持有 self._lock。最久未访问的会话在最前面。"""
+        while self._sessions:
+            oldest_id, (last_access, _) = next(iter(self._sessions.items()))
+            if self._idle_ttl > 0 and now - last_access > self._idle_ttl:
+                self._stats["evicted_idle"] += 1
+            elif len(self._sessions) > self._max_resident > 0:
+                self._stats["evicted_lru"] += 1
+            else:
+                break
+            _, session = self._sessions.pop(oldest_id)
+            session['history'] = []
+            self._trimmed[oldest_id] = session
+
+    def _session(self, participant_id: str) -> dict:
+        """调用方需持有 self._lock"""
+        now = time.monotonic()
+        self._evict(now)  # 按访问顺序排列，过期会话总在最前面
+        entry = self._sessions.get(participant_id)
+        if entry is not None:
+            session = entry[1]
+        else:
+            session = self._trimmed.pop(participant_id, None) or new_session()
+        self._sessions[participant_id] = (now, session)
+        self._sessions.move_to_end(participant_id)
+        if len(self._sessions) > self._max_resident > 0:
+            self._evict(now)
+        return session
+
+    def get(self, participant_id: str) -> dict:
+        with self._lock:
+            return copy.deepcopy(self._session(participant_id))
+
+    def append_history(self, participant_id: str, message: dict):
+        with self._lock:
+            _append_history(self._session(participant_id), message)
+
+    def complete_turn(self, participant_id: str, message: dict) -> dict:
+        with self._lock:
+            session = self._session(participant_id)
+            _append_history(session, message)
+            session['turn_count'] += 1
+            return copy.deepcopy(session)
+
+    def append_sentiment_score(self, participant_id: str, score: float):
+        with self._lock:
+            self._session(participant_id)['sentiment_scores'].append(score)
+
+    def mark_post_turn_done(self, participant_id: str):
+        with self._lock:
+            self._session(participant_id)['post_turns_done'] += 1
+
+    def set_summary(self, participant_id: str, summary: str, version: int) -> bool:
+        with self._lock:
+            entry = self._sessions.get(participant_id)
+            session = entry[1] if entry is not None else self._trimmed.get(participant_id)
+            if session is None or version <= session['summary_turn']:
+                return False
+            session['summary'] = summary
+            session['summary_turn'] = version
+            return True
+
+    def add_llm_usage(self, participant_id: str, call_type: str, deltas: dict):
+        """单进程时 llm_usage 已经在进程内按参与者汇总，这里不重复记录"""
+
+    def get_llm_usage(self, participant_id: str) -> dict:
+        return llm_usage.get_participant_totals(participant_id)
+
+    def set_fields(self, participant_id: str, fields: dict):
+        with self._lock:
+            self._session(participant_id).update(fields)
+
+    def clear(self, participant_id: str) -> bool:
+        with self._lock:
+            trimmed = self._trimmed.pop(participant_id, None) is not None
+            return self._sessions.pop(participant_id, None) is not None or trimmed
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            self._evict(time.monotonic())
+            sessions = [session for _, session in self._sessions.values()]
+            trimmed = list(self._trimmed.values())
+            stats = dict(self._stats)
+        stats.update({
+            "backend": "memory",
+            "resident_sessions": len(sessions),
+            "trimmed_sessions": len(trimmed),
+            "approx_bytes": sum(approx_session_bytes(session) for session in sessions + trimmed),
+            "max_resident": self._max_resident,
+            "idle_ttl_seconds": self._idle_ttl,
+            "history_limit": HISTORY_LIMIT,
+        })
+        return stats
+
+
+class MongoSessionStore(SessionStore):
+    """
+    MongoDB 实现：会话保存在参与者所在数据库的 llm_sessions 集合中，
+    追加使用 $push / $inc，摘要版本使用条件更新，多进程并发写入也是原子的。
+    history 通过 $slice 截断；空闲会话由 updated_at 上的 TTL 索引清理，进程内不常驻任何会话。
+    按参与者的 LLM 用量用 $inc 累加在 llm_usage 集合中 (会话在步骤之间会被清除，用量需要跨对话阶段保留)。
+    """
+
+    shared = True
+
+    def __init__(self):
+        # 延迟导入，避免内存后端也强制建立数据库连接
+        from backend import data_manager
+        self._data_manager = data_manager
+
+    def _collection(self, participant_id: str):
+        return self._data_manager.get_llm_session_collection(participant_id)
+
+    def _upsert(self, participant_id: str, update: dict, pushed_fields=()):
+        # $setOnInsert 不能与 $push / $inc 作用于同一字段，因此排除这次要修改的字段
+        touched = set(pushed_fields) | set(update.get("$set", {}))
+        defaults = {k: v for k, v in new_session().items() if k not in touched}
+        update = dict(update)
+        update["$setOnInsert"] = {"participant_id": participant_id, **defaults}
+        update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+        return update
+
+    def _push_history(self, message: dict) -> dict:
+        return {"$push": {"history": {"$each": [dict(message)], "$slice": -HISTORY_LIMIT}},
+                "$inc": {"message_count": 1}}
+
+    def get(self, participant_id: str) -> dict:
+        document = self._collection(participant_id).find_one(
+            {"participant_id": participant_id}, {"_id": 0, "participant_id": 0, "updated_at": 0}
+        )
+        session = new_session()
+        if document:
+            session.update(document)
+        return session
+
+    def append_history(self, participant_id: str, message: dict):
+        self._collection(participant_id).update_one(
+            {"participant_id": participant_id},
+            self._upsert(participant_id, self._push_history(message), pushed_fields=("history", "message_count")),
+            upsert=True
+        )
+
+    def complete_turn(self, participant_id: str, message: dict) -> dict:
+        from pymongo import ReturnDocument
+        document = self._collection(participant_id).find_one_and_update(
+            {"participant_id": participant_id},
+            self._upsert(
+                participant_id,
+                {"$push": self._push_history(message)["$push"], "$inc": {"message_count": 1, "turn_count": 1}},
+                pushed_fields=("history", "message_count", "turn_count")
+            ),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+            projection={"_id": 0, "participant_id": 0, "updated_at": 0}
+        )
+        session = new_session()
+        session.update(document or {})
+        return session
+
+    def append_sentiment_score(self, participant_id: str, score: float):
+        self._collection(participant_id).update_one(
+            {"participant_id": participant_id},
+            self._upsert(participant_id, {"$push": {"sentiment_scores": score}}, pushed_fields=("sentiment_scores",)),
+            upsert=True
+        )
+
+    def mark_post_turn_done(self, participant_id: str):
+        self._collection(participant_id).update_one(
+            {"participant_id": participant_id},
+            self._upsert(participant_id, {"$inc": {"post_turns_done": 1}}, pushed_fields=("post_turns_done",)),
+            upsert=True
+        )
+
+    def add_llm_usage(self, participant_id: str, call_type: str, deltas: dict):
+        """把一次 LLM 调用的用量累加到 usage.<call_type>.<字段> (llm_usage 的参与者汇总回调)"""
+        increments = {f"usage.{call_type}.{field}": value for field, value in deltas.items() if value}
+        if increments:
+            self._data_manager.get_llm_usage_collection(participant_id).update_one(
+                {"participant_id": participant_id}, {"$inc": increments}, upsert=True
+            )
+
+    def get_llm_usage(self, participant_id: str) -> dict:
+        """{call_type: totals}，包含所有 worker 进程的调用"""
+        document = self._data_manager.get_llm_usage_collection(participant_id).find_one(
+            {"participant_id": participant_id}, {"_id": 0, "usage": 1}
+        )
+        return (document or {}).get("usage", {})
+
+    def set_summary(self, participant_id: str, summary: str, version: int) -> bool:
+        result = self._collection(participant_id).update_one(
+            {"participant_id": participant_id, "summary_turn": {"$lt": version}},
+            {"$set": {"summary": summary, "summary_turn": version, "updated_at": datetime.now(timezone.utc)}}
+        )
+        return result.modified_count > 0
+
+    def set_fields(self, participant_id: str, fields: dict):
+        self._collection(participant_id).update_one(
+            {"participant_id": participant_id},
+            self._upsert(participant_id, {"$set": dict(fields)}),
+            upsert=True
+        )
+
+    def clear(self, participant_id: str) -> bool:
+        result = self._collection(participant_id).delete_one({"participant_id": participant_id})
+        return result.deleted_count > 0
+
+    def get_stats(self) -> dict:
+        return {
+            "backend": "mongo",
+            "resident_sessions": 0,
+            "approx_bytes": 0,
+            "idle_ttl_seconds": SESSION_IDLE_TTL_SECONDS,
+            "history_limit": HISTORY_LIMIT,
+        }
+
+
+def create_session_store(backend: str = None) -> SessionStore:
+    backend = (backend or SESSION_STORE_BACKEND).lower()
+    if backend == "mongo":
+        return MongoSessionStore()
+    if backend != "memory":
+        log.warning("session_store_unknown_backend",
+                    f"⚠️ Unknown SESSION_STORE_BACKEND '{backend}', falling back to in-memory sessions.",
+                    backend=backend)
+    return InMemorySessionStore()
@@ -0,0 +1,193 @@
+# backend/write_buffer.py
+import atexit
+import threading
+import time
+
+from backend import metrics
+from backend.event_log import get_event_logger
+
+log = get_event_logger(__name__)
+
+FLUSH_BATCH_SIZE = metrics.registry.histogram(
+    "mongo_write_buffer_batch_size", "Records per insert_many issued by the write buffer.", ("collection",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)
+)
+FLUSH_DURATION = metrics.registry.histogram(
+    "mongo_write_buffer_flush_seconds", "Latency of one buffered insert_many by collection.", ("collection",)
+)
+
+_DUPLICATE_KEY = 11000
+
+
+class WriteBuffer:
+    """
+    只追加集合 (experiment_events / dialogue_turns) 的组提交写缓冲。
+    - add() 只把记录放进内存，由后台线程在攒够 max_records 条或最早一条等待超过 max_delay 秒时
+      按集合用无序 insert_many 一次写入；未写入的记录超过 max_pending 条时在调用方线程直接 flush (背压)。
+    - 写入失败的记录重新排队，最多尝试 max_attempts 次。insert_many 会在客户端给文档补上 _id，
+      所以重试是幂等的：已写入的记录再次写入只会得到重复键错误，按成功处理。
+    - 进程退出时写出剩余记录。需要写后立即可读的写入 (如步骤推进) 不要经过这里。
+    """
+
+    def __init__(self, name: str, max_records: int = 50, max_delay: float = 1.0, max_pending: int = 5000,
+                 max_attempts: int = 3):
+        self.name = name
+        self._max_records = max(1, max_records)
+        self._max_delay = max_delay
+        self._max_pending = max(self._max_records, max_pending)
+        self._max_attempts = max(1, max_attempts)
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()  # 后台线程和同步 flush 不并发写同一批记录
+        self._pending = {}  # collection label -> [collection, [(doc, attempts), ...]]
+        self._unflushed = 0
+        self._oldest = None  # 最早一条未写入记录的 monotonic 时间
+        self._running = True
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "added": 0, "written": 0, "failed": 0, "retried": 0, "flushes": 0, "inline_flushes": 0,
+            "batch_size_max": 0, "flush_seconds_total": 0.0, "flush_seconds_max": 0.0,
+        }
+        self._thread = threading.Thread(target=self._flush_loop, name=f"{name}-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.shutdown)
+
+    def add(self, label: str, collection, doc: dict):
+        """缓冲一条记录；label 标识目标集合 (如 "production.turn_data")，用于分组和统计"""
+        with self._cond:
+            self._enqueue(label, collection, doc, 0)
+            over_limit = self._unflushed >= self._max_pending
+            # 第一条记录开始计时，攒够 max_records 条立即写
+            if self._unflushed == 1 or self._unflushed >= self._max_records:
+                self._cond.notify()
+        with self._stats_lock:
+            self._stats["added"] += 1
+        if over_limit or not self._running:
+            # 后台线程跟不上 (或已经关闭)：由调用方线程写出
+            with self._stats_lock:
+                self._stats["inline_flushes"] += 1
+            self.flush()
+
+    def flush(self):
+        """同步写出当前所有未写入的记录"""
+        with self._flush_lock:
+            with self._cond:
+                batches = self._take()
+            self._write(batches)
+
+    def shutdown(self):
+        """停止后台线程并写出剩余记录 (失败的记录在这里还会按 max_attempts 重试)"""
+        if not self._running:
+            return
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout=10)
+        for _ in range(self._max_attempts):
+            self.flush()
+            if not self._unflushed:
+                break
+        if self._unflushed:
+            log.error("write_buffer_shutdown_unflushed",
+                      f"❌ {self.name}: {self._unflushed} records could not be written before shutdown.",
+                      buffer=self.name, unflushed=self._unflushed)
+
+    def get_stats(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        with self._cond:
+            stats["unflushed"] = self._unflushed
+            stats["oldest_unflushed_seconds"] = round(time.monotonic() - self._oldest, 3) if self._oldest else 0.0
+        stats["batch_size_avg"] = round(stats["written"] / stats["flushes"], 2) if stats["flushes"] else 0.0
+        stats["flush_seconds_avg"] = (
+            round(stats["flush_seconds_total"] / stats["flushes"], 4) if stats["flushes"] else 0.0
+        )
+        stats["max_records"] = self._max_records
+        stats["max_delay_seconds"] = self._max_delay
+        return stats
+
+    # --- 内部实现 (调用时需持有 self._cond) ---
+    def _enqueue(self, label: str, collection, doc: dict, attempts: int):
+        self._pending.setdefault(label, [collection, []])[1].append((doc, attempts))
+        self._unflushed += 1
+        if self._oldest is None:
+            self._oldest = time.monotonic()
+
+    def _take(self) -> dict:
+        batches, self._pending = self._pending, {}
+        self._unflushed = 0
+        self._oldest = None
+        return batches
+
+    def _seconds_until_due(self):
+        """距离下一次应当 flush 还有多少秒；0 表示现在就该写，None 表示没有待写记录"""
+        if self._unflushed >= self._max_records:
+            return 0.0
+        if self._oldest is None:
+            return None
+        return max(0.0, self._max_delay - (time.monotonic() - self._oldest))
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    remaining = self._seconds_until_due()
+                    if remaining == 0.0:
+                        break
+                    self._cond.wait(remaining)
+                if not self._running:
+                    return  # 剩余记录由 shutdown() 写出
+            self.flush()
+
+    # --- 写入 ---
+    def _write(self, batches: dict):
+        for label, (collection, records) in batches.items():
+            failed = self._insert(label, collection, records)
+            if not failed:
+                continue
+            retry = [(doc, attempts + 1) for doc, attempts in failed if attempts + 1 < self._max_attempts]
+            with self._stats_lock:
+                self._stats["retried"] += len(retry)
+                self._stats["failed"] += len(failed) - len(retry)
+            if len(retry) < len(failed):
+                log.error("write_buffer_records_dropped",
+                          f"❌ {self.name}: giving up on {len(failed) - len(retry)} records for {label} "
+                          f"after {self._max_attempts} attempts.",
+                          buffer=self.name, collection=label, dropped=len(failed) - len(retry))
+            if retry:
+                with self._cond:
+                    # 重新排队，随下一批一起写入
+                    for doc, attempts in retry:
+                        self._enqueue(label, collection, doc, attempts)
+
+    def _insert(self, label: str, collection, records: list) -> list:
+        """无序 insert_many 一批记录；返回需要重试的 (doc, attempts) 列表"""
+        docs = [doc for doc, _ in records]
+        started = time.perf_counter()
+        try:
+            collection.insert_many(docs, ordered=False)
+            failed = []
+        except Exception as e:
+            # BulkWriteError (pymongo / mongomock) 带有逐条的 writeErrors；其余异常 (网络等) 整批重试
+            write_errors = (getattr(e, "details", None) or {}).get("writeErrors")
+            if write_errors is None:
+                failed = list(records)
+            else:
+                failed = [records[error["index"]] for error in write_errors if error.get("code") != _DUPLICATE_KEY]
+            log.warning("write_buffer_flush_failed",
+                        f"⚠️ {self.name}: insert_many of {len(docs)} records into {label} failed "
+                        f"({len(failed)} to retry): {e}",
+                        buffer=self.name, collection=label, records=len(docs), failed=len(failed), error=str(e))
+        seconds = time.perf_counter() - started
+        written = len(docs) - len(failed)
+        FLUSH_BATCH_SIZE.observe(len(docs), label)
+        FLUSH_DURATION.observe(seconds, label)
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["written"] += written
+            self._stats["batch_size_max"] = max(self._stats["batch_size_max"], len(docs))
+            self._stats["flush_seconds_total"] += seconds
+            self._stats["flush_seconds_max"] = max(self._stats["flush_seconds_max"], seconds)
+        log.debug("write_buffer_flushed", f"💾 {self.name}: wrote {written}/{len(docs)} records to {label}",
+                  buffer=self.name, collection=label, records=len(docs), written=written,
+                  seconds=round(seconds, 4))
+        return failed
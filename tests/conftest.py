@@ -0,0 +1,39 @@
+# tests/conftest.py
+"""
+测试在内存中的 mongomock 和本地假模型 (LLM_PROVIDER=fake) 上运行，不访问网络。
+backend.config 在导入时读取环境变量，所以这里必须在导入 backend 之前设置。
+"""
+import os
+import sys
+
+os.environ["MONGO_URI"] = "mongomock://"
+os.environ["LLM_PROVIDER"] = "fake"
+os.environ["SESSION_STORE_BACKEND"] = "memory"
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("ADMIN_PASSWORD", "test-admin")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# 假模型几乎不等待，测试只关心调用次数和顺序
+for name in ("FAKE_LLM_TTFT_MS", "FAKE_LLM_TTFT_JITTER_MS", "FAKE_LLM_INTER_TOKEN_MS",
+             "FAKE_LLM_INTER_TOKEN_JITTER_MS"):
+    os.environ[name] = "0"
+# 本地分类器命中时的抽样对照会在后台多发一次模型调用，关掉以免打乱调用计数
+os.environ["SENTIMENT_LOCAL_SHADOW_RATE"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uuid
+
+import pytest
+
+
+@pytest.fixture
+def fake_provider():
+    """llm_service 和 sentiment_service 共用的 FakeProvider 实例 (在 InstrumentedProvider 之下)"""
+    from backend.llm_provider import get_provider
+    return get_provider()
+
+
+@pytest.fixture
+def unique_text():
+    """本地分类器不会命中、缓存中也没有的文本"""
+    return f"The delivery for order {uuid.uuid4().hex} is scheduled for Tuesday."
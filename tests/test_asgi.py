@@ -0,0 +1,131 @@
+# tests/test_asgi.py
+import asyncio
+import json
+
+import pytest
+
+from backend import app as app_module, data_manager, llm_service
+from backend.asgi import app
+
+
+class AsgiClient:
+    """直接调用 ASGI 应用的最小客户端 (保存 cookie)"""
+
+    def __init__(self):
+        self.cookies = {}
+
+    def request(self, method: str, path: str, body: dict = None, query: str = "", headers: dict = None) -> dict:
+        return asyncio.run(self._request(method, path, body, query, headers or {}))
+
+    async def _request(self, method, path, body, query, headers):
+        raw = json.dumps(body).encode("utf-8") if body is not None else b""
+        scope_headers = [(b"content-type", b"application/json"), (b"host", b"test")]
+        scope_headers += [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+        if self.cookies:
+            cookie = "; ".join(f"{name}={value}" for name, value in self.cookies.items())
+            scope_headers.append((b"cookie", cookie.encode("latin-1")))
+        scope = {"type": "http", "method": method, "path": path, "query_string": query.encode("latin-1"),
+                 "headers": scope_headers, "http_version": "1.1", "scheme": "http", "server": ("test", 80),
+                 "client": ("127.0.0.1", 1234), "root_path": ""}
+        body_sent = False
+
+        async def receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": raw, "more_body": False}
+            await asyncio.Event().wait()
+
+        response = {"status": None, "headers": {}, "body": b"", "chunks": []}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message["headers"]:
+                    name, value = name.decode("latin-1"), value.decode("latin-1")
+                    response["headers"][name] = value
+                    if name == "set-cookie":
+                        cookie_name, _, rest = value.partition("=")
+                        self.cookies[cookie_name] = rest.split(";")[0]
+            else:
+                response["body"] += message.get("body", b"")
+                response["chunks"].append(message.get("body", b""))
+
+        await app(scope, receive, send)
+        return response
+
+
+@pytest.fixture
+def client():
+    return AsgiClient()
+
+
+@pytest.fixture
+def participant_id(client):
+    """管理后台路由经 WSGI 桥接执行，创建一个 XAI 条件下的参与者"""
+    assert client.request("POST", "/admin/login", {"password": "test-admin"})["status"] == 200
+    response = client.request("POST", "/admin/invite-batches", {
+        "batch_name": "asgi", "language": "en", "condition_order": "AB", "invite_type": "test", "quantity": 1
+    })
+    link = json.loads(response["body"])["batch"]["links"][0]
+    assert client.request("GET", f"/invite/{link['token']}")["status"] == 302
+    return link["participant_id"]
+
+
+def _events(response: dict) -> list:
+    return [json.loads(line) for line in response["body"].decode("utf-8").splitlines()]
+
+
+def test_wsgi_routes_are_bridged(client, participant_id):
+    page = client.request("GET", "/index.html", query=f"pid={participant_id}")
+
+    assert page["status"] == 200
+    assert page["headers"]["content-type"].startswith("text/html")
+    assert b"<html" in page["body"].lower()
+
+
+def test_async_route_sets_request_id_and_no_wildcard_cors(client, participant_id):
+    response = client.request("POST", "/analyze", {"message": "I am so happy today", "participant_id": participant_id},
+                              headers={"X-Request-ID": "req-123"})
+
+    assert response["status"] == 200
+    assert response["headers"]["x-request-id"] == "req-123"
+    assert "access-control-allow-origin" not in response["headers"]
+    assert json.loads(response["body"])["success"] is True
+
+
+def test_async_routes_validate_input(client, participant_id):
+    assert client.request("POST", "/chat", {"message": "", "participant_id": participant_id})["status"] == 400
+    assert client.request("POST", "/chat_turn", {"participant_id": participant_id})["status"] == 400
+    assert client.request("POST", "/analyze", {"participant_id": participant_id})["status"] == 400
+
+    missing = data_manager.generate_participant_id("test")
+    for path in ("/chat", "/chat_turn", "/analyze"):
+        response = client.request("POST", path, {"message": "hello", "participant_id": missing})
+        assert response["status"] == 404
+        assert "error" in json.loads(response["body"])
+
+
+def test_chat_streams_and_queues_post_turn_work(client, participant_id):
+    response = client.request("POST", "/chat", {"message": "hello there friend", "participant_id": participant_id})
+
+    assert response["status"] == 200
+    assert response["headers"]["content-type"].startswith("text/plain")
+    assert response["body"]
+    assert len(response["chunks"]) > 1
+    assert app_module.post_turn_queue.wait_for_key(participant_id, timeout=5)
+    data_manager.flush_writes()
+    session = llm_service.get_session(participant_id)
+    assert session["turn_count"] == session["post_turns_done"] == 1
+
+
+def test_chat_turn_streams_ndjson_events(client, participant_id):
+    response = client.request("POST", "/chat_turn", {"message": "I am sad today", "participant_id": participant_id})
+
+    assert response["status"] == 200
+    assert response["headers"]["content-type"] == "application/x-ndjson"
+    types = [event["type"] for event in _events(response)]
+    assert types.index("sentiment") < types.index("explanation")
+    assert "token" in types
+    assert types[-1] == "turn_saved"
+    assert app_module.post_turn_queue.wait_for_key(participant_id, timeout=5)
@@ -0,0 +1,45 @@
+# tests/test_benchmark_data_manager.py
+import json
+import random
+
+from backend import data_manager
+from backend.benchmark_data_manager import DEFAULT_BASELINE_PATH, compare_to_baseline, run_benchmarks, seed_data
+
+
+def _baseline(round_trips: int = 1, median_ms: float = 1.0) -> dict:
+    return {"results": {"save_turn_data": {"round_trips": round_trips, "median_ms": median_ms}}}
+
+
+def _results(round_trips: int = 1, median_ms: float = 1.0) -> dict:
+    return {"save_turn_data": {"round_trips": round_trips, "median_ms": median_ms}}
+
+
+def test_any_extra_round_trip_is_a_regression():
+    regressions = compare_to_baseline(_results(round_trips=2), _baseline(), time_threshold=1.0, min_delta_ms=0.5)
+
+    assert regressions == ["save_turn_data: round trips 1 -> 2"]
+
+
+def test_slowdown_must_pass_both_thresholds():
+    # 相对阈值内、或绝对差值小于 min_delta_ms 的变慢都视为噪声
+    assert compare_to_baseline(_results(median_ms=1.9), _baseline(), 1.0, 0.5) == []
+    assert compare_to_baseline(_results(median_ms=0.25), _baseline(median_ms=0.1), 1.0, 0.5) == []
+    assert len(compare_to_baseline(_results(median_ms=2.5), _baseline(), 1.0, 0.5)) == 1
+
+
+def test_benchmarks_missing_from_either_side_are_ignored():
+    assert compare_to_baseline({}, _baseline(), 1.0, 0.5) == []
+    assert compare_to_baseline(_results(round_trips=9), {}, 1.0, 0.5) == []
+
+
+def test_round_trips_do_not_exceed_the_stored_baseline():
+    rng = random.Random(0)
+    seeded = seed_data(data_manager, participants=5, batches=2, links_per_batch=5, rng=rng)
+
+    results = run_benchmarks(data_manager, seeded, create_sizes=[10], iterations=5, rng=rng)
+    with open(DEFAULT_BASELINE_PATH, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    assert results["get_participant_status[cached]"]["round_trips"] == 0
+    # 只比较往返次数 (与机器无关)；耗时阈值设为无穷大
+    assert compare_to_baseline(results, baseline, time_threshold=float("inf"), min_delta_ms=0) == []
@@ -0,0 +1,178 @@
+# tests/test_chat_routes.py
+import json
+import threading
+
+import pytest
+
+from backend import app as app_module, data_manager, llm_service, sentiment_service
+from backend.app import app
+from backend.config import EXPERIMENT_STEPS
+
+
+@pytest.fixture
+def client():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def _invite(client, condition_order: str) -> str:
+    """通过测试邀请链接创建一个刚开始实验的参与者 (AB 先 XAI，BA 先 NON_XAI)"""
+    assert client.post("/admin/login", json={"password": "test-admin"}).status_code == 200
+    response = client.post("/admin/invite-batches", json={
+        "batch_name": "chat-routes", "language": "en", "condition_order": condition_order, "invite_type": "test",
+        "quantity": 1
+    })
+    link = response.get_json()["batch"]["links"][0]
+    assert client.get(f"/invite/{link['token']}").status_code == 302
+    return link["participant_id"]
+
+
+@pytest.fixture
+def participant_id(client):
+    return _invite(client, "AB")
+
+
+@pytest.fixture
+def non_xai_participant_id(client):
+    return _invite(client, "BA")
+
+
+@pytest.fixture
+def failing_chat(monkeypatch, fake_provider):
+    """聊天流在输出任何内容之前失败"""
+    def stream_chat(messages, system_instruction=None, **options):
+        raise RuntimeError("quota exceeded")
+        yield
+
+    monkeypatch.setattr(fake_provider, "stream_chat", stream_chat)
+
+
+@pytest.fixture
+def blocked_sentiment(monkeypatch):
+    """post-turn 的情绪分析在 release.set() 之前一直阻塞"""
+    release = threading.Event()
+    original = sentiment_service.analyze_sentiment_batch
+
+    def analyze_sentiment_batch(texts, record_stats=None):
+        assert release.wait(timeout=5)
+        return original(texts, record_stats=record_stats)
+
+    monkeypatch.setattr(sentiment_service, "analyze_sentiment_batch", analyze_sentiment_batch)
+    yield release
+    release.set()
+
+
+def _finish_post_turn_jobs(participant_id: str):
+    assert app_module.post_turn_queue.wait_for_key(participant_id, timeout=5)
+    data_manager.flush_writes()
+
+
+def test_legacy_chat_failure_queues_no_post_turn_job(client, participant_id, failing_chat):
+    submitted = app_module.post_turn_queue.get_stats()["submitted"]
+
+    response = client.post("/chat", json={"message": "hello there friend", "participant_id": participant_id})
+
+    assert "Backend LLM error" in response.get_data(as_text=True)
+    _finish_post_turn_jobs(participant_id)
+    session = llm_service.get_session(participant_id)
+    assert session["turn_count"] == session["post_turns_done"] == 0
+    assert app_module.post_turn_queue.get_stats()["submitted"] == submitted
+
+
+def test_legacy_chat_queues_one_post_turn_job_per_completed_turn(client, participant_id):
+    for message in ("hello there friend", "how is your day going"):
+        response = client.post("/chat", json={"message": message, "participant_id": participant_id})
+        assert response.status_code == 200 and response.get_data(as_text=True)
+
+    _finish_post_turn_jobs(participant_id)
+    session = llm_service.get_session(participant_id)
+    assert session["turn_count"] == session["post_turns_done"] == 2
+    turns = data_manager.test_collections["turn_data"].find({"participant_id": participant_id})
+    assert sorted(turn["data"]["turn"] for turn in turns) == [1, 2]
+
+
+def test_chat_stream_does_not_wait_for_post_turn_work(client, participant_id, blocked_sentiment):
+    response = client.post("/chat", json={"message": "hello there friend", "participant_id": participant_id})
+
+    # 流已经结束，情绪分析和写库还在后台排队
+    assert response.get_data(as_text=True)
+    assert not app_module.post_turn_queue.wait_for_key(participant_id, timeout=0.05)
+    assert llm_service.get_session(participant_id)["post_turns_done"] == 0
+
+    blocked_sentiment.set()
+    _finish_post_turn_jobs(participant_id)
+    turn = data_manager.test_collections["turn_data"].find_one({"participant_id": participant_id})
+    assert turn["data"]["turn"] == 1
+    assert turn["data"]["user_sentiment_label"]
+    assert llm_service.get_session(participant_id)["sentiment_scores"]
+
+
+def test_end_dialogue_waits_for_the_last_turn(client, participant_id, blocked_sentiment):
+    data_manager.update_participant_step(participant_id, EXPERIMENT_STEPS.index("DIALOGUE_1"))
+    client.post("/chat", json={"message": "hello there friend", "participant_id": participant_id})
+    threading.Timer(0.1, blocked_sentiment.set).start()
+
+    response = client.post("/end_dialogue", json={"participant_id": participant_id})
+
+    assert response.status_code == 200
+    assert llm_service.get_session(participant_id)["post_turns_done"] == 1
+    data_manager.flush_writes()
+    assert data_manager.test_collections["turn_data"].find_one({"participant_id": participant_id}) is not None
+
+
+def test_failed_post_turn_job_still_counts_as_done(monkeypatch, client, participant_id):
+    def analyze_sentiment_batch(texts, record_stats=None):
+        raise RuntimeError("sentiment backend down")
+
+    monkeypatch.setattr(sentiment_service, "analyze_sentiment_batch", analyze_sentiment_batch)
+
+    client.post("/chat", json={"message": "hello there friend", "participant_id": participant_id})
+
+    _finish_post_turn_jobs(participant_id)
+    session = llm_service.get_session(participant_id)
+    assert session["turn_count"] == session["post_turns_done"] == 1
+    assert data_manager.test_collections["turn_data"].find_one({"participant_id": participant_id}) is None
+
+
+def _turn_events(response) -> list:
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_xai_turn_event_order(client, participant_id):
+    events = _turn_events(client.post("/chat_turn", json={"message": "I am sad today",
+                                                          "participant_id": participant_id}))
+    types = [event["type"] for event in events]
+
+    assert types.count("sentiment") == types.count("explanation") == 1
+    assert types.index("sentiment") < types.index("explanation")
+    assert "token" in types
+    assert types[-1] == "turn_saved" and types.count("turn_saved") == 1
+    assert events[-1]["turn"] == 1
+    assert "".join(event["text"] for event in events if event["type"] == "token")
+    _finish_post_turn_jobs(participant_id)
+    assert llm_service.get_session(participant_id)["post_turns_done"] == 1
+
+
+def test_non_xai_turn_only_streams_tokens(client, non_xai_participant_id):
+    events = _turn_events(client.post("/chat_turn", json={"message": "I am sad today",
+                                                          "participant_id": non_xai_participant_id}))
+    types = [event["type"] for event in events]
+
+    assert set(types[:-1]) == {"token"}
+    assert types[-1] == "turn_saved"
+    _finish_post_turn_jobs(non_xai_participant_id)
+
+
+def test_failed_turn_reports_error_and_is_not_saved(client, non_xai_participant_id, failing_chat):
+    submitted = app_module.post_turn_queue.get_stats()["submitted"]
+
+    events = _turn_events(client.post("/chat_turn", json={"message": "hello there friend",
+                                                          "participant_id": non_xai_participant_id}))
+
+    assert [event["type"] for event in events] == ["error"]
+    assert events[0]["stage"] == "chat"
+    assert app_module.post_turn_queue.get_stats()["submitted"] == submitted
+    assert llm_service.get_session(non_xai_participant_id)["turn_count"] == 0
@@ -0,0 +1,61 @@
+# tests/test_context_window.py
+from backend import llm_service
+from backend.llm_service import _build_contents, estimate_tokens, make_history_message
+
+
+def _message(role: str, tokens: int, content: str = None) -> dict:
+    return {"role": role, "content": content or f"{role} {tokens}", "tokens": tokens}
+
+
+def test_estimate_counts_cjk_per_character():
+    assert estimate_tokens("") == 1
+    assert estimate_tokens("abcd" * 10) == 11
+    assert estimate_tokens("你好世界") == 5
+    assert make_history_message("user", "abcd")["tokens"] == estimate_tokens("abcd")
+
+
+def test_packs_most_recent_messages_under_budget():
+    history = [_message("user", 40), _message("ai", 40), _message("user", 30), _message("ai", 30),
+               _message("user", 20)]
+
+    contents = _build_contents(history, token_budget=80)
+
+    assert [m["content"] for m in contents] == ["user 30", "ai 30", "user 20"]
+    assert [m["role"] for m in contents] == ["user", "model", "user"]
+
+
+def test_latest_message_is_kept_even_over_budget():
+    contents = _build_contents([_message("user", 10), _message("ai", 10), _message("user", 500)], token_budget=100)
+
+    assert contents == [{"role": "user", "content": "user 500"}]
+
+
+def test_context_starts_with_a_user_turn():
+    history = [_message("user", 50), _message("ai", 20), _message("user", 20)]
+
+    contents = _build_contents(history, token_budget=45)
+
+    assert [m["role"] for m in contents] == ["user"]
+
+
+def test_consecutive_user_messages_are_merged():
+    history = [_message("user", 5, "first try"), _message("user", 5, "second try")]
+
+    assert _build_contents(history, token_budget=100) == [{"role": "user", "content": "first try\nsecond try"}]
+
+
+def test_messages_without_cached_estimate_are_estimated():
+    history = [{"role": "user", "content": "x" * 400}, {"role": "ai", "content": "ok"},
+               {"role": "user", "content": "hello"}]
+
+    contents = _build_contents(history, token_budget=50)
+
+    assert [m["content"] for m in contents] == ["hello"]
+
+
+def test_truncation_is_counted():
+    truncated = llm_service.get_context_stats()["truncated"]
+
+    _build_contents([_message("user", 60), _message("ai", 60), _message("user", 60)], token_budget=100)
+
+    assert llm_service.get_context_stats()["truncated"] == truncated + 1
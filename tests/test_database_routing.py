@@ -0,0 +1,67 @@
+# tests/test_database_routing.py
+import secrets
+
+import pytest
+
+from backend import data_manager
+
+
+def _scoped(action):
+    data_manager.begin_operation_scope()
+    try:
+        result = action()
+    finally:
+        counts = data_manager.end_operation_scope()
+    return result, counts["reads"]
+
+
+@pytest.mark.parametrize("invite_type, database", [("test", "test"), ("participant", "production")])
+def test_new_ids_encode_their_database(invite_type, database):
+    participant_id = data_manager.generate_participant_id(invite_type)
+    token = data_manager.generate_invite_token(invite_type)
+    batch_id = data_manager.generate_batch_id(invite_type)
+
+    assert data_manager._encoded_database_label("participant", participant_id) == database
+    assert data_manager._encoded_database_label("token", token) == database
+    assert data_manager._encoded_database_label("batch", batch_id) == database
+
+
+@pytest.mark.parametrize("invite_type, collections", [
+    ("test", data_manager.test_collections), ("participant", data_manager.prod_collections)
+])
+def test_encoded_participant_is_read_from_one_database(invite_type, collections):
+    participant_id = data_manager.generate_participant_id(invite_type)
+    data_manager.init_participant_session(participant_id, "AB", "en", invite_type)
+    data_manager._status_cache_invalidate(participant_id)
+    probes = data_manager.get_routing_stats()["probes"]
+
+    status, reads = _scoped(lambda: data_manager.get_participant_status(participant_id))
+
+    assert status["participant_id"] == participant_id
+    assert reads == 1
+    assert data_manager.get_routing_stats()["probes"] == probes
+    assert collections["participants"].find_one({"participant_id": participant_id}) is not None
+
+
+def test_legacy_id_is_probed_once_then_remembered():
+    participant_id = f"LEGACY_{secrets.token_hex(4)}"
+    data_manager.test_collections["participants"].insert_one(
+        {"participant_id": participant_id, "condition": "XAI", "current_step_index": -1}
+    )
+    probes = data_manager.get_routing_stats()["probes"]
+
+    # 旧格式的 ID：先查生产库 (没有)，再查测试库
+    status, reads = _scoped(lambda: data_manager.get_participant_status(participant_id))
+    assert status["condition"] == "XAI"
+    assert reads == 2
+    assert data_manager.get_routing_stats()["probes"] == probes + 1
+
+    data_manager._status_cache_invalidate(participant_id)
+    _, reads = _scoped(lambda: data_manager.get_participant_status(participant_id))
+    assert reads == 1
+    assert data_manager.get_routing_stats()["probes"] == probes + 1
+
+
+def test_unknown_participant_is_not_found():
+    assert data_manager.get_participant_status(data_manager.generate_participant_id("test")) == {}
+    assert data_manager.get_participant_status("NOT_A_PARTICIPANT") == {}
@@ -0,0 +1,104 @@
+# tests/test_event_log.py
+import json
+import logging
+import queue
+
+import pytest
+
+from backend import event_log
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def captured():
+    """挂在 backend.* 子日志器上，拿到进入队列之前的记录"""
+    logger = logging.getLogger("backend.tests.event_log")
+    handler = _ListHandler()
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG)
+    yield event_log.get_event_logger(logger.name), handler.records
+    logger.removeHandler(handler)
+
+
+def _prepared(record: logging.LogRecord) -> logging.LogRecord:
+    return event_log._ContextQueueHandler(queue.Queue()).prepare(record)
+
+
+def test_json_line_carries_event_fields_and_context(captured):
+    log, records = captured
+
+    with event_log.log_context("PT_1", "req-1"):
+        log.info("turn_saved", "✅ Turn %s saved", turn=3)
+    entry = json.loads(event_log.JsonFormatter().format(_prepared(records[-1])))
+
+    assert entry["event"] == "turn_saved"
+    assert entry["turn"] == 3
+    assert entry["participant_id"] == "PT_1" and entry["request_id"] == "req-1"
+    assert entry["level"] == "INFO" and entry["logger"] == "backend.tests.event_log"
+
+
+def test_context_is_restored_after_the_scope():
+    tokens = event_log.bind_request("outer")
+    try:
+        with event_log.log_context("PT_1", "inner"):
+            assert event_log.current_request_id() == "inner"
+        assert event_log.current_request_id() == "outer"
+    finally:
+        event_log.unbind_request(tokens)
+    assert event_log.current_request_id() is None
+
+
+def test_prepare_freezes_the_message_and_traceback(captured):
+    log, records = captured
+    fields = {"items": ["a"]}
+
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        log.exception("route_failed", "Error with %s", **fields)
+    record = _prepared(records[-1])
+
+    assert record.args is None and record.exc_info is None
+    assert "ValueError: boom" in record.exc_text
+    assert "ValueError: boom" in event_log.TextFormatter().format(record)
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = event_log._ContextQueueHandler(queue.Queue(maxsize=1))
+    dropped = event_log.get_logging_stats()["dropped"]
+    record = logging.LogRecord("backend.tests", logging.INFO, "", 0, "message", None, None)
+
+    handler.enqueue(record)
+    handler.enqueue(record)
+
+    assert event_log.get_logging_stats()["dropped"] == dropped + 1
+
+
+def test_event_level_override_and_sampling(monkeypatch, captured):
+    log, records = captured
+    logging.getLogger("backend.tests.event_log").setLevel(logging.INFO)
+    monkeypatch.setattr(event_log, "_event_levels", {"demoted": logging.DEBUG})
+    monkeypatch.setattr(event_log, "_event_sampling", {"noisy": 0.0, "sampled": 1.0})
+    sampled_out = event_log.get_logging_stats()["sampled_out"]
+
+    log.warning("demoted", "below the logger level after the override")
+    log.info("noisy", "dropped by sampling")
+    log.info("sampled", "kept")
+    log.warning("noisy", "warnings are never sampled")
+
+    assert [record.getMessage() for record in records] == ["kept", "warnings are never sampled"]
+    assert records[0].sample_rate == 1.0
+    assert not hasattr(records[1], "sample_rate")
+    assert event_log.get_logging_stats()["sampled_out"] == sampled_out + 1
+
+
+def test_invalid_settings_are_ignored():
+    assert event_log._parse_mapping("a=warning, b=nope,=1,c", event_log._parse_level) == {"a": logging.WARNING}
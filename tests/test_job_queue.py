@@ -0,0 +1,93 @@
+# tests/test_job_queue.py
+import threading
+import time
+
+from backend import llm_service
+from backend.job_queue import BackgroundJobQueue
+
+
+def test_wait_for_key_only_waits_for_that_key():
+    queue = BackgroundJobQueue("test_keys", workers=2, max_size=8)
+    release = threading.Event()
+    done = []
+    try:
+        queue.submit(release.wait, key="slow")
+        queue.submit(done.append, "fast", key="fast")
+
+        assert queue.wait_for_key("fast", timeout=2)
+        assert done == ["fast"]
+        assert not queue.wait_for_key("slow", timeout=0.05)
+        release.set()
+        assert queue.wait_for_key("slow", timeout=2)
+    finally:
+        release.set()
+        queue.shutdown(timeout=2)
+
+
+def test_full_queue_runs_job_inline():
+    queue = BackgroundJobQueue("test_inline", workers=1, max_size=1, put_timeout=0)
+    release = threading.Event()
+    ran_in = []
+    try:
+        queue.submit(release.wait)  # 占住唯一的工作线程
+        time.sleep(0.05)
+        queue.submit(release.wait)  # 占满队列
+        assert queue.submit(lambda: ran_in.append(threading.current_thread())) is False
+        assert ran_in == [threading.current_thread()]
+        assert queue.get_stats()["ran_inline"] == 1
+    finally:
+        release.set()
+        queue.shutdown(timeout=2)
+
+
+def test_full_queue_drops_droppable_job():
+    queue = BackgroundJobQueue("test_drop", workers=1, max_size=1, put_timeout=0, drop_when_full=True)
+    release = threading.Event()
+    ran = []
+    try:
+        queue.submit(release.wait)
+        time.sleep(0.05)
+        queue.submit(release.wait)
+        assert queue.submit(ran.append, 1, key="dropped") is False
+        assert ran == []
+        assert queue.get_stats()["dropped"] == 1
+        assert queue.wait_for_key("dropped", timeout=0)
+    finally:
+        release.set()
+        queue.shutdown(timeout=2)
+
+
+def test_summary_is_generated_off_the_request_thread(monkeypatch, fake_provider):
+    participant_id = "PT_SUMMARY_BACKGROUND"
+    release = threading.Event()
+    original = fake_provider.generate_text
+
+    def slow_generate_text(prompt, **options):
+        release.wait(2)
+        return original(prompt, **options)
+
+    monkeypatch.setattr(fake_provider, "generate_text", slow_generate_text)
+    llm_service.clear_session(participant_id)
+    llm_service.session_store.append_history(participant_id, {"role": "user", "content": "hello"})
+    session = llm_service.session_store.complete_turn(participant_id, {"role": "ai", "content": "hi there"})
+
+    started = time.monotonic()
+    llm_service.request_summary(participant_id, session)
+    assert time.monotonic() - started < 0.5
+    assert llm_service.get_session(participant_id)["summary"] == ""
+
+    release.set()
+    assert llm_service._summary_queue.wait_for_key(participant_id, timeout=5)
+    summarized = llm_service.get_session(participant_id)
+    assert summarized["summary"]
+    assert summarized["summary_turn"] == session["turn_count"]
+
+
+def test_stale_summary_does_not_overwrite_newer_one():
+    participant_id = "PT_SUMMARY_STALE"
+    llm_service.clear_session(participant_id)
+    llm_service.session_store.complete_turn(participant_id, {"role": "ai", "content": "hi"})
+
+    assert llm_service._apply_summary(participant_id, "summary at turn 10", 10)
+    assert not llm_service._apply_summary(participant_id, "summary at turn 5", 5)
+    assert llm_service.get_session(participant_id)["summary"] == "summary at turn 10"
@@ -0,0 +1,82 @@
+# tests/test_llm_provider.py
+import asyncio
+
+import pytest
+
+from backend import llm_provider
+from backend.llm_provider import FakeProvider, LLMProvider
+
+_MESSAGES = [{"role": "user", "content": "I failed my exam today"}]
+_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "emotion": {"type": "string", "enum": ["joy", "sadness", "neutral"]},
+        "confidence": {"type": "number", "minimum": 0, "maximum": 1},
+        "items": {"type": "array", "minItems": 3, "items": {"type": "object", "properties": {
+            "index": {"type": "integer"}
+        }}},
+    },
+}
+
+
+def _stream(provider: LLMProvider, messages: list) -> tuple:
+    stream = provider.stream_chat(messages, "Be kind.")
+    return list(stream), stream.usage
+
+
+def test_same_input_gives_the_same_reply():
+    first, second = FakeProvider(ttft_ms=0, inter_token_ms=0), FakeProvider(ttft_ms=0, inter_token_ms=0)
+
+    assert _stream(first, _MESSAGES) == _stream(second, _MESSAGES)
+    assert first.generate_text("hello").text == second.generate_text("hello").text
+    assert first.generate_json("hello", _SCHEMA).data == second.generate_json("hello", _SCHEMA).data
+    assert _stream(first, _MESSAGES) != _stream(first, [{"role": "user", "content": "something else"}])
+
+
+def test_async_methods_match_the_sync_ones():
+    provider = FakeProvider(ttft_ms=0, inter_token_ms=0)
+
+    async def collect():
+        stream = provider.astream_chat(_MESSAGES, "Be kind.")
+        chunks = [chunk async for chunk in stream]
+        text = await provider.agenerate_text("hello")
+        data = await provider.agenerate_json("hello", _SCHEMA)
+        return (chunks, stream.usage), text.text, data.data
+
+    assert asyncio.run(collect()) == (_stream(provider, _MESSAGES), provider.generate_text("hello").text,
+                                      provider.generate_json("hello", _SCHEMA).data)
+
+
+def test_reply_follows_the_language_and_token_settings():
+    provider = FakeProvider(ttft_ms=0, inter_token_ms=0, reply_tokens=12)
+
+    chunks, usage = _stream(provider, [{"role": "user", "content": "我今天很难过"}])
+
+    assert len(chunks) == usage["output_tokens"] == 12
+    assert llm_provider._CHINESE_PATTERN.search("".join(chunks))
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["output_tokens"]
+
+
+def test_json_follows_the_schema():
+    data = FakeProvider(ttft_ms=0).generate_json("hello", _SCHEMA).data
+
+    assert data["emotion"] in ("joy", "sadness", "neutral")
+    assert 0.5 <= data["confidence"] <= 1
+    # 数组内的整数取元素下标 (批量情绪分析靠它对应输入)
+    assert [item["index"] for item in data["items"]] == [0, 1, 2]
+
+
+def test_interface_cannot_be_instantiated_partially():
+    class ChatOnly(LLMProvider):
+        def stream_chat(self, messages, system_instruction=None):
+            return iter(())
+
+    with pytest.raises(TypeError):
+        ChatOnly()
+
+
+def test_unknown_provider_falls_back_to_gemini(monkeypatch):
+    monkeypatch.setitem(llm_provider._PROVIDERS, "gemini", FakeProvider)
+
+    assert isinstance(llm_provider.create_provider("no-such-backend"), FakeProvider)
+    assert llm_provider.create_provider("FAKE").name == "fake"
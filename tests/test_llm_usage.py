@@ -0,0 +1,95 @@
+# tests/test_llm_usage.py
+import uuid
+
+import pytest
+
+from backend import llm_usage
+from backend.llm_provider import FakeProvider
+from backend.llm_usage import InstrumentedProvider
+
+
+@pytest.fixture
+def participant_id():
+    return f"PT_{uuid.uuid4().hex[:16].upper()}"
+
+
+@pytest.fixture
+def provider():
+    return InstrumentedProvider(FakeProvider(ttft_ms=0, inter_token_ms=0, reply_tokens=6))
+
+
+def test_calls_are_summed_per_participant_and_call_type(participant_id):
+    with llm_usage.participant_scope(participant_id):
+        llm_usage.record_call("chat", 0.5, {"prompt_tokens": 10, "output_tokens": 4}, ttft=0.1, chunks=4)
+        llm_usage.record_call("chat", 1.5, {"prompt_tokens": 20, "output_tokens": 6}, ttft=0.3, chunks=6)
+        llm_usage.record_call("sentiment", 0.2, ok=False)
+
+    usage = llm_usage.get_participant_usage(participant_id)
+
+    assert usage["chat"]["calls"] == 2 and usage["chat"]["chunks"] == 10
+    assert usage["chat"]["latency_seconds_avg"] == 1.0
+    assert usage["chat"]["ttft_seconds_avg"] == 0.2
+    assert usage["sentiment"]["errors"] == 1 and usage["sentiment"]["ttft_seconds_avg"] is None
+    assert usage["total"] == {"calls": 3, "latency_seconds": 2.2, "prompt_tokens": 30, "output_tokens": 10}
+
+
+def test_calls_outside_a_scope_are_only_counted_globally(participant_id):
+    calls = llm_usage.get_usage_stats().get("summary", {}).get("calls", 0)
+
+    llm_usage.record_call("summary", 0.1, {"output_tokens": 3})
+
+    assert llm_usage.get_usage_stats()["summary"]["calls"] == calls + 1
+    assert llm_usage.get_participant_totals(participant_id) == {}
+
+
+def test_stream_is_attributed_when_it_is_created(provider, participant_id):
+    with llm_usage.participant_scope(participant_id):
+        stream = provider.stream_chat([{"role": "user", "content": "hello"}])
+    # Flask 的流式响应在请求上下文之外迭代
+    chunks = list(stream)
+
+    usage = llm_usage.get_participant_usage(participant_id)["chat"]
+    assert usage["calls"] == usage["streamed_calls"] == 1
+    assert usage["chunks"] == len(chunks) == 6
+    assert usage["output_tokens"] == stream.usage["output_tokens"]
+
+
+def test_failed_call_is_recorded_as_an_error(monkeypatch, provider, participant_id):
+    def generate_json(prompt, schema, temperature=None):
+        raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(provider._provider, "generate_json", generate_json)
+
+    with llm_usage.participant_scope(participant_id), pytest.raises(RuntimeError):
+        provider.generate_json("hello", {}, call_type="sentiment")
+
+    assert llm_usage.get_participant_usage(participant_id)["sentiment"]["errors"] == 1
+
+
+def test_sink_receives_deltas_and_its_failures_are_swallowed(monkeypatch, participant_id):
+    received = []
+    monkeypatch.setattr(llm_usage, "_participant_sink", lambda *args: received.append(args))
+
+    llm_usage.record_call("chat", 0.5, {"prompt_tokens": 10, "output_tokens": 4}, participant_id=participant_id)
+
+    assert received == [(participant_id, "chat", {"calls": 1, "errors": 0, "latency_seconds": 0.5,
+                                                  "prompt_tokens": 10, "output_tokens": 4})]
+
+    def failing_sink(*args):
+        raise ConnectionError("mongo unavailable")
+
+    monkeypatch.setattr(llm_usage, "_participant_sink", failing_sink)
+    llm_usage.record_call("chat", 0.5, participant_id=participant_id)
+    assert llm_usage.get_participant_usage(participant_id)["chat"]["calls"] == 2
+
+
+def test_only_recent_participants_are_kept(monkeypatch):
+    monkeypatch.setattr(llm_usage, "LLM_USAGE_MAX_PARTICIPANTS", 2)
+    first, second, third = (f"PT_{uuid.uuid4().hex[:16].upper()}" for _ in range(3))
+
+    for participant_id in (first, second, first, third):
+        llm_usage.record_call("chat", 0.1, participant_id=participant_id)
+
+    assert llm_usage.get_participant_totals(second) == {}
+    assert llm_usage.get_participant_totals(first)["chat"]["calls"] == 2
+    assert llm_usage.get_participant_totals(third)["chat"]["calls"] == 1
@@ -0,0 +1,42 @@
+# tests/test_load_test.py
+import pytest
+
+from backend.app import app
+from backend.config import EXPERIMENT_STEPS
+from backend.load_test import InProcessTransport, RouteRecorder, percentile, run_load_test
+
+
+def test_percentile_uses_nearest_rank():
+    values = [0.1, 0.2, 0.3, 0.4]
+
+    assert percentile(values, 50) == 0.2
+    assert percentile(values, 95) == 0.4
+    assert percentile([], 50) == 0.0
+
+
+def test_recorder_summarises_latency_and_errors():
+    recorder = RouteRecorder()
+    for seconds, ok in ((0.01, True), (0.03, False)):
+        recorder.record("POST /chat_turn", seconds, ok)
+
+    route = recorder.summary(wall_seconds=2.0)["POST /chat_turn"]
+
+    assert route["count"] == 2 and route["errors"] == 1 and route["error_rate"] == 0.5
+    assert route["throughput_rps"] == 1.0
+    assert route["p50_ms"] == 10.0 and route["max_ms"] == 30.0
+
+
+@pytest.mark.parametrize("legacy_chat", [False, True])
+def test_virtual_cohort_completes_the_experiment(legacy_chat):
+    report = run_load_test(InProcessTransport(app), "test-admin", EXPERIMENT_STEPS, participants=2, concurrency=2,
+                           turns=1, legacy_chat=legacy_chat)
+
+    assert report["participants"]["completed"] == 2, report["participants"]["failures"]
+    assert report["requests"]["errors"] == 0
+    assert report["routes"]["POST /end_dialogue"]["count"] == 4
+    chat_route = "POST /chat" if legacy_chat else "POST /chat_turn"
+    assert report["routes"][chat_route]["count"] == 4
+    assert f"{chat_route} (ttfb)" in report["routes"]
+    # 旧页面只在 XAI 对话中另外请求 /analyze (每个参与者一段)
+    assert report["routes"].get("POST /analyze", {}).get("count", 0) == (2 if legacy_chat else 0)
+    assert report["mongo_operations"]["writes"] > 0
@@ -0,0 +1,75 @@
+# tests/test_localization.py
+import json
+
+import pytest
+
+from backend import localization
+from backend.app import app
+
+
+@pytest.fixture
+def strings(monkeypatch):
+    """每一层都有一个只在该层出现的 key，外加一个所有层都有的 key"""
+    monkeypatch.setattr(localization, "LOCALIZATION_STRINGS", {
+        "global": {
+            "en": {"shared": "global en", "global_only": "global en", "translated_globally": "global en"},
+            "zh-CN": {"shared": "global zh", "translated_globally": "global zh"},
+        },
+        "page": {
+            "en": {"shared": "page en", "page_only": "page en", "translated_globally": "page en"},
+            "zh-CN": {"shared": "page zh"},
+        },
+    })
+
+
+def test_bundle_fallback_order(strings):
+    bundle = localization._build_bundle("page", "zh-CN")
+
+    assert bundle["shared"] == "page zh"
+    # 模块没有翻译时，全局翻译优先于模块英文
+    assert bundle["translated_globally"] == "global zh"
+    assert bundle["page_only"] == "page en"
+    assert bundle["global_only"] == "global en"
+
+
+def test_english_bundle_prefers_module_text(strings):
+    bundle = localization._build_bundle("page", "en")
+
+    assert bundle["shared"] == bundle["translated_globally"] == "page en"
+
+
+def test_bundles_are_read_only():
+    bundle = localization.get_localization_for_page("consent", "en")
+
+    with pytest.raises(TypeError):
+        bundle["title"] = "changed"
+
+
+def test_unknown_language_and_module_fall_back():
+    assert localization.get_localization_for_page("consent", "fr") is \
+        localization.get_localization_for_page("consent", localization.DEFAULT_LANGUAGE)
+    assert localization.get_localization_for_page("no_such_page", "en") is \
+        localization.get_localization_for_page("global", "en")
+    assert localization.get_localized_string("consent", "no_such_key", "en") == \
+        "[[MISSING_KEY: consent.no_such_key]]"
+
+
+def test_bundle_json_matches_the_bundle():
+    for (module, language), bundle in localization.LOCALIZATION_BUNDLES.items():
+        assert json.loads(localization.get_localization_bundle_json(module, language)) == dict(bundle)
+
+
+def test_versioned_bundle_request_is_cacheable():
+    version = localization.LOCALIZATION_VERSION
+    with app.test_client() as client:
+        versioned = client.get(f"/localization/consent.json?lang=zh-CN&v={version}")
+        unversioned = client.get("/localization/consent.json?lang=zh-CN")
+        revalidated = client.get("/localization/consent.json?lang=zh-CN",
+                                 headers={"If-None-Match": unversioned.headers["ETag"]})
+        unknown = client.get("/localization/consent.json?lang=fr")
+
+    assert versioned.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+    assert unversioned.headers["Cache-Control"] == "no-cache"
+    assert versioned.headers["X-Localization-Version"] == version
+    assert revalidated.status_code == 304
+    assert unknown.status_code == 404
@@ -0,0 +1,75 @@
+# tests/test_metrics.py
+import re
+from collections import Counter
+
+from backend import metrics
+from backend.app import app
+
+
+def _families(text: str, kind: str) -> Counter:
+    return Counter(line.split()[2] for line in text.splitlines() if line.startswith(f"# {kind} "))
+
+
+def test_admin_metrics_endpoint_has_one_help_and_type_per_family():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        assert client.get("/metrics").status_code == 401
+        assert client.post("/admin/login", json={"password": "test-admin"}).status_code == 200
+        response = client.get("/metrics")
+
+    text = response.get_data(as_text=True)
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    helps, types = _families(text, "HELP"), _families(text, "TYPE")
+    assert helps and set(helps) == set(types)
+    assert [name for name, count in (helps + types).items() if count != 2] == []
+    assert "# collector" not in text
+    # 每个样本都属于某个已声明的指标族
+    declared = set(types)
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name = re.match(r"[a-zA-Z_:][a-zA-Z0-9_:]*", line).group(0)
+            assert name in declared or re.sub(r"_(bucket|sum|count)$", "", name) in declared, line
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = metrics.MetricsRegistry()
+    histogram = registry.histogram("test_duration_seconds", "Test durations.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, "chat")
+
+    lines = registry.render().splitlines()
+
+    assert lines[:2] == ["# HELP test_duration_seconds Test durations.", "# TYPE test_duration_seconds histogram"]
+    assert lines[2:] == [
+        'test_duration_seconds_bucket{route="chat",le="0.1"} 2',
+        'test_duration_seconds_bucket{route="chat",le="1"} 3',
+        'test_duration_seconds_bucket{route="chat",le="+Inf"} 4',
+        'test_duration_seconds_sum{route="chat"} 5.65',
+        'test_duration_seconds_count{route="chat"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    registry = metrics.MetricsRegistry()
+    registry.counter("test_requests_total", "Test requests.", ("path",)).inc('/a"b\\c\nd')
+    registry.register_collector(lambda: [("test_collected", "gauge", "Collected.", [({"name": 'x"y'}, 1)])])
+
+    text = registry.render()
+
+    assert 'test_requests_total{path="/a\\"b\\\\c\\nd"} 1' in text
+    assert 'test_collected{name="x\\"y"} 1' in text
+
+
+def test_failing_collector_does_not_break_the_export():
+    registry = metrics.MetricsRegistry()
+    registry.counter("test_ok_total", "Still exported.").inc()
+
+    def broken():
+        raise RuntimeError("stats unavailable")
+
+    registry.register_collector(broken)
+    text = registry.render()
+
+    assert "test_ok_total 1" in text
+    assert "# collector broken failed: stats unavailable" in text
@@ -0,0 +1,125 @@
+# tests/test_page_rendering.py
+import gzip
+import os
+
+import pytest
+
+from backend import app as app_module, data_manager
+from backend.app import app
+
+
+@pytest.fixture
+def client():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+def _participant(language: str = "en") -> str:
+    participant_id = data_manager.generate_participant_id("test")
+    data_manager.init_participant_session(participant_id, "AB", language, "test")
+    return participant_id
+
+
+def test_same_page_for_two_participants_is_rendered_once(client):
+    first = client.get(f"/index.html?pid={_participant()}")
+    hits = app_module.get_render_cache_stats()["hits"]
+    second = client.get(f"/index.html?pid={_participant()}")
+
+    assert first.status_code == second.status_code == 200
+    assert first.get_data() == second.get_data()
+    assert first.headers["ETag"] == second.headers["ETag"]
+    assert app_module.get_render_cache_stats()["hits"] == hits + 1
+
+
+def test_language_is_part_of_the_cache_key(client):
+    english = client.get(f"/index.html?pid={_participant('en')}")
+    chinese = client.get(f"/index.html?pid={_participant('zh-CN')}")
+
+    assert english.get_data() != chinese.get_data()
+    assert english.headers["ETag"] != chinese.headers["ETag"]
+
+
+def test_matching_etag_returns_304(client):
+    participant_id = _participant()
+    first = client.get(f"/index.html?pid={participant_id}")
+    not_modified = app_module.get_render_cache_stats()["not_modified"]
+
+    second = client.get(f"/index.html?pid={participant_id}", headers={"If-None-Match": first.headers["ETag"]})
+
+    assert first.headers["Cache-Control"] == "private, no-cache"
+    assert second.status_code == 304
+    assert second.get_data() == b""
+    assert app_module.get_render_cache_stats()["not_modified"] == not_modified + 1
+
+
+def test_gzip_representation_has_its_own_etag(client):
+    participant_id = _participant()
+
+    plain = client.get(f"/index.html?pid={participant_id}")
+    compressed = client.get(f"/index.html?pid={participant_id}", headers={"Accept-Encoding": "gzip"})
+
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in compressed.headers["Vary"]
+    assert gzip.decompress(compressed.get_data()) == plain.get_data()
+    assert compressed.headers["ETag"] != plain.headers["ETag"]
+    # 纯文本的 ETag 不能让 gzip 表示返回 304
+    revalidated = client.get(f"/index.html?pid={participant_id}",
+                             headers={"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert revalidated.status_code == 200
+
+
+def test_each_request_reads_the_participant_status_once(monkeypatch, client):
+    # 关闭状态缓存，每次 get_participant_status 都会访问数据库
+    monkeypatch.setattr(data_manager, "STATUS_CACHE_ENABLED", False)
+    participant_id = _participant()
+    duplicates = app_module.request_read_stats["duplicate_participant_fetches"]
+
+    assert client.get(f"/index.html?pid={participant_id}").status_code == 200
+    assert client.post("/save_data", json={
+        "participant_id": participant_id, "step_name": "CONSENT", "data": {"agreed": True}, "current_step_index": -1
+    }).status_code == 200
+    assert client.get(f"/html/demographics.html?pid={participant_id}").status_code == 200
+
+    assert app_module.request_read_stats["duplicate_participant_fetches"] == duplicates
+
+
+@pytest.fixture
+def template_dir(monkeypatch, tmp_path):
+    """把模板目录换成临时目录 (html/ 下一个页面)"""
+    (tmp_path / "html").mkdir()
+    monkeypatch.setattr(app, "static_folder", str(tmp_path))
+    return tmp_path / "html"
+
+
+def test_template_is_compiled_once(template_dir):
+    (template_dir / "page.html").write_text("<p>{{ strings.title }}</p>", encoding="utf-8")
+
+    first = app_module.get_compiled_template("page.html")
+    (template_dir / "page.html").write_text("<p>changed</p>", encoding="utf-8")
+
+    assert app_module.get_compiled_template("page.html") is first
+
+
+def test_auto_reload_recompiles_changed_template(monkeypatch, template_dir):
+    monkeypatch.setattr(app_module, "TEMPLATE_AUTO_RELOAD", True)
+    path = template_dir / "page.html"
+    path.write_text("<p>old</p>", encoding="utf-8")
+    first = app_module.get_compiled_template("page.html")
+    assert app_module.get_compiled_template("page.html") is first
+
+    path.write_text("<p>new</p>", encoding="utf-8")
+    os.utime(path, (path.stat().st_atime, path.stat().st_mtime + 10))
+
+    reloaded = app_module.get_compiled_template("page.html")
+    assert reloaded is not first
+    assert reloaded.render() == "<p>new</p>"
+    # 旧模板的渲染结果不再命中
+    key = app_module._render_cache_key("page.html", "consent", "en", {})
+    app_module._store_rendered_page(key, first, "<p>old</p>")
+    assert app_module._get_rendered_page(key, reloaded) is None
+
+
+def test_missing_template_raises(template_dir):
+    with pytest.raises(FileNotFoundError):
+        app_module.get_compiled_template("missing.html")
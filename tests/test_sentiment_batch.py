@@ -0,0 +1,71 @@
+# tests/test_sentiment_batch.py
+from backend import sentiment_service
+from backend.llm_provider import LLMResponse
+
+
+def _recording(monkeypatch, provider, data=None, error=None):
+    """记录 generate_json 的调用；可指定返回的 data 或抛出的异常"""
+    calls = []
+    original = provider.generate_json
+
+    def generate_json(prompt, schema, **options):
+        calls.append(prompt)
+        if error is not None:
+            raise error
+        if data is not None:
+            return LLMResponse("", data=data)
+        return original(prompt, schema, **options)
+
+    monkeypatch.setattr(provider, "generate_json", generate_json)
+    return calls
+
+
+def test_batch_is_one_call_in_input_order(monkeypatch, fake_provider, unique_text):
+    calls = _recording(monkeypatch, fake_provider)
+    texts = [unique_text, unique_text.replace("Tuesday", "Friday"), unique_text]
+
+    results = sentiment_service.analyze_sentiment_batch(texts)
+
+    assert len(calls) == 1
+    # 同一批里重复的文本只分类一次
+    assert calls[0].count(texts[1]) == 1 and calls[0].count(texts[0]) == 1
+    assert results[0] == results[2]
+    assert all(result["model_used"] for result in results)
+    assert results[1] == sentiment_service.analyze_sentiment(texts[1])
+    assert len(calls) == 1
+
+
+def test_empty_text_needs_no_call(monkeypatch, fake_provider):
+    calls = _recording(monkeypatch, fake_provider)
+
+    assert sentiment_service.analyze_sentiment_batch([""]) == [
+        {"top_emotion": "neutral", "top_score": 0.0, "raw_scores": {}}
+    ]
+    assert calls == []
+
+
+def test_malformed_items_fall_back_to_neutral(monkeypatch, fake_provider, unique_text):
+    texts = [unique_text, unique_text.replace("Tuesday", "Friday"), unique_text.replace("Tuesday", "Monday")]
+    _recording(monkeypatch, fake_provider, data={"results": [
+        {"index": 1, "emotion": "sadness", "confidence": 0.8},
+        {"index": 0, "emotion": "joy"},
+        {"index": 7, "emotion": "anger", "confidence": 0.9},
+    ]})
+
+    results = sentiment_service.analyze_sentiment_batch(texts)
+
+    assert results[1]["top_emotion"] == "sadness"
+    assert results[0] == results[2] == sentiment_service._fallback_sentiment()
+    # 回退结果不写入缓存
+    assert sentiment_service.get_cached_sentiment(texts[0]) is None
+    assert sentiment_service.get_cached_sentiment(texts[1])["top_emotion"] == "sadness"
+
+
+def test_failed_batch_call_falls_back_for_every_text(monkeypatch, fake_provider, unique_text):
+    texts = [unique_text, unique_text.replace("Tuesday", "Friday")]
+    _recording(monkeypatch, fake_provider, error=RuntimeError("quota exceeded"))
+
+    results = sentiment_service.analyze_sentiment_batch(texts)
+
+    assert results == [sentiment_service._fallback_sentiment()] * 2
+    assert all(sentiment_service.get_cached_sentiment(text) is None for text in texts)
@@ -0,0 +1,85 @@
+# tests/test_sentiment_cache.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import sentiment_service
+
+
+def _counting(monkeypatch, provider, delay: float = 0.0):
+    """把 generate_json 换成记录每次调用 prompt 的 (可选) 慢版本"""
+    calls = []
+    original = provider.generate_json
+    lock = threading.Lock()
+
+    def generate_json(prompt, schema, **options):
+        with lock:
+            calls.append(prompt)
+        time.sleep(delay)
+        return original(prompt, schema, **options)
+
+    monkeypatch.setattr(provider, "generate_json", generate_json)
+    return calls
+
+
+def test_concurrent_identical_requests_make_one_provider_call(monkeypatch, fake_provider, unique_text):
+    calls = _counting(monkeypatch, fake_provider, delay=0.2)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: sentiment_service.analyze_sentiment(unique_text), range(8)))
+
+    assert len(calls) == 1
+    assert results[0]["model_used"]
+    assert all(result == results[0] for result in results)
+
+
+def test_repeated_request_is_served_from_cache(monkeypatch, fake_provider, unique_text):
+    calls = _counting(monkeypatch, fake_provider)
+
+    first = sentiment_service.analyze_sentiment(unique_text)
+    second = sentiment_service.analyze_sentiment(unique_text)
+
+    assert len(calls) == 1
+    assert first == second
+
+
+def test_batch_waits_for_in_flight_call_instead_of_reclassifying(monkeypatch, fake_provider, unique_text):
+    calls = _counting(monkeypatch, fake_provider, delay=0.2)
+    other_text = unique_text.replace("Tuesday", "Friday")
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        single = pool.submit(sentiment_service.analyze_sentiment, unique_text)
+        time.sleep(0.05)  # 让单条请求先成为 leader
+        batch = sentiment_service.analyze_sentiment_batch([unique_text, other_text])
+
+    assert batch[0] == single.result()
+    assert len(calls) == 2
+    # 批量调用只包含尚未分类的文本
+    assert unique_text not in calls[1] and other_text in calls[1]
+
+
+def test_async_request_joins_a_sync_leader(monkeypatch, fake_provider, unique_text):
+    calls = _counting(monkeypatch, fake_provider, delay=0.2)
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        leader = pool.submit(sentiment_service.analyze_sentiment, unique_text)
+        time.sleep(0.05)
+        follower = asyncio.run(sentiment_service.analyze_sentiment_async(unique_text))
+
+    assert len(calls) == 1
+    assert follower == leader.result()
+
+
+def test_failed_async_call_falls_back_and_is_not_cached(monkeypatch, fake_provider, unique_text):
+    async def failing_agenerate_json(prompt, schema, **options):
+        raise ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(fake_provider, "agenerate_json", failing_agenerate_json)
+        result = asyncio.run(sentiment_service.analyze_sentiment_async(unique_text))
+
+    assert result["top_emotion"] == "neutral" and "model_used" not in result
+    assert sentiment_service.get_cached_sentiment(unique_text) is None
+    # 失败的调用已结束 single-flight，下一次请求重新调用模型
+    assert sentiment_service.analyze_sentiment(unique_text)["model_used"]
@@ -0,0 +1,84 @@
+# tests/test_sentiment_lexicon.py
+import pytest
+
+from backend import app as app_module, data_manager, sentiment_lexicon, sentiment_service
+from backend.config import SENTIMENT_LOCAL_MAX_CHARS, SENTIMENT_LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize("text, emotion", [
+    ("hello", "neutral"),
+    ("你好", "neutral"),
+    ("I am so happy today!", "joy"),
+    ("I feel sad", "sadness"),
+    ("我不开心", "sadness"),
+    ("I'm terrified", "fear"),
+])
+def test_clear_statements_pass_the_threshold(text, emotion):
+    label, confidence = sentiment_lexicon.classify(text)
+
+    assert label == emotion
+    assert confidence >= SENTIMENT_LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize("text", ["I am not happy", "I'm not really happy", "我不是很开心"])
+def test_negated_joy_is_low_confidence_sadness(text):
+    label, confidence = sentiment_lexicon.classify(text)
+
+    assert label == "sadness"
+    assert confidence < SENTIMENT_LOCAL_THRESHOLD
+
+
+@pytest.mark.parametrize("text", [
+    "Great, just great. Another failure.",
+    "Oh great, another meeting.",
+    "Yeah right, that went well.",
+    "呵呵，太棒了",
+])
+def test_sarcasm_is_never_joy_and_goes_to_the_model(text):
+    label, confidence = sentiment_lexicon.classify(text)
+
+    assert label != "joy"
+    assert confidence < SENTIMENT_LOCAL_THRESHOLD
+
+
+def test_mixed_polarity_goes_to_the_model():
+    _, confidence = sentiment_lexicon.classify("I love this course but I failed the exam")
+
+    assert confidence < SENTIMENT_LOCAL_THRESHOLD
+
+
+def test_local_tier_hits_at_the_threshold(monkeypatch):
+    monkeypatch.setattr(sentiment_lexicon, "classify", lambda text: ("joy", SENTIMENT_LOCAL_THRESHOLD))
+
+    result, prediction = sentiment_service.local_tier("threshold hit text", record_stats=False)
+
+    assert result["top_emotion"] == "joy"
+    assert result["model_used"] == sentiment_service.LOCAL_MODEL_LABEL
+    assert prediction is None
+
+
+def test_local_tier_misses_just_below_the_threshold(monkeypatch):
+    confidence = SENTIMENT_LOCAL_THRESHOLD - 0.01
+    monkeypatch.setattr(sentiment_lexicon, "classify", lambda text: ("joy", confidence))
+
+    result, prediction = sentiment_service.local_tier("threshold miss text")
+
+    assert result is None
+    assert prediction == ("joy", confidence)
+
+
+def test_local_tier_skips_long_text(monkeypatch):
+    monkeypatch.setattr(sentiment_lexicon, "classify", lambda text: pytest.fail("long text must not be classified"))
+
+    assert sentiment_service.local_tier("happy " * SENTIMENT_LOCAL_MAX_CHARS) == (None, None)
+
+
+def test_turn_record_keeps_sentiment_provenance(monkeypatch, unique_text):
+    saved = []
+    monkeypatch.setattr(data_manager, "save_turn_data", lambda participant_id, turn_data: saved.append(turn_data))
+
+    app_module._analyze_and_save_turn("PT_PROVENANCE", "hello", unique_text, "XAI", 1, 1,
+                                      app_module.calculate_text_metrics("hello"), True)
+
+    assert saved[0]["user_sentiment_model"] == sentiment_service.LOCAL_MODEL_LABEL
+    assert saved[0]["agent_sentiment_model"] not in (None, sentiment_service.LOCAL_MODEL_LABEL)
@@ -0,0 +1,170 @@
+# tests/test_session_store.py
+import threading
+import time
+import uuid
+
+import pytest
+
+from backend import app as app_module, llm_service, llm_usage, session_store as store_module
+from backend.session_store import HISTORY_LIMIT, InMemorySessionStore, MongoSessionStore
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def store(request):
+    return InMemorySessionStore() if request.param == "memory" else MongoSessionStore()
+
+
+@pytest.fixture
+def participant_id():
+    return f"PT_{uuid.uuid4().hex[:16].upper()}"
+
+
+def test_new_participant_gets_empty_session(store, participant_id):
+    assert store.get(participant_id) == store_module.new_session()
+
+
+def test_complete_turn_appends_reply_and_counts_turn(store, participant_id):
+    store.append_history(participant_id, {"role": "user", "content": "hello"})
+
+    session = store.complete_turn(participant_id, {"role": "ai", "content": "hi"})
+
+    assert session["turn_count"] == 1
+    assert session["message_count"] == 2
+    assert [m["role"] for m in session["history"]] == ["user", "ai"]
+    assert store.get(participant_id) == session
+
+
+def test_history_is_trimmed_but_message_count_is_exact(store, participant_id):
+    for i in range(HISTORY_LIMIT + 5):
+        store.append_history(participant_id, {"role": "user", "content": str(i)})
+
+    session = store.get(participant_id)
+
+    assert len(session["history"]) == HISTORY_LIMIT
+    assert session["history"][-1]["content"] == str(HISTORY_LIMIT + 4)
+    assert session["message_count"] == HISTORY_LIMIT + 5
+
+
+def test_snapshot_is_not_written_back(store, participant_id):
+    store.append_sentiment_score(participant_id, 0.5)
+
+    snapshot = store.get(participant_id)
+    snapshot["sentiment_scores"].append(1.0)
+
+    assert store.get(participant_id)["sentiment_scores"] == [0.5]
+
+
+def test_summary_only_moves_forward(store, participant_id):
+    store.complete_turn(participant_id, {"role": "ai", "content": "hi"})
+
+    assert store.set_summary(participant_id, "turn 5", 5)
+    assert not store.set_summary(participant_id, "turn 3", 3)
+    assert store.get(participant_id)["summary"] == "turn 5"
+
+
+def test_post_turn_counter_tracks_completed_jobs(store, participant_id):
+    store.complete_turn(participant_id, {"role": "ai", "content": "hi"})
+    store.mark_post_turn_done(participant_id)
+
+    session = store.get(participant_id)
+
+    assert session["post_turns_done"] == session["turn_count"] == 1
+
+
+def test_clear_removes_session(store, participant_id):
+    store.append_history(participant_id, {"role": "user", "content": "hello"})
+
+    assert store.clear(participant_id)
+    assert not store.clear(participant_id)
+    assert store.get(participant_id)["history"] == []
+
+
+def test_mongo_llm_usage_survives_session_clear(participant_id):
+    store = MongoSessionStore()
+    store.add_llm_usage(participant_id, "chat", {"calls": 1, "latency_seconds": 0.5, "output_tokens": 10})
+    store.add_llm_usage(participant_id, "chat", {"calls": 1, "latency_seconds": 0.25, "output_tokens": 5})
+    store.clear(participant_id)
+
+    usage = store.get_llm_usage(participant_id)
+
+    assert usage["chat"] == {"calls": 2, "latency_seconds": 0.75, "output_tokens": 15}
+
+
+@pytest.mark.parametrize("store_class", [InMemorySessionStore, MongoSessionStore])
+def test_participant_usage_comes_from_the_session_store(monkeypatch, participant_id, store_class):
+    monkeypatch.setattr(llm_service, "session_store", store_class())
+    llm_usage.record_call("chat", 0.5, {"prompt_tokens": 20, "output_tokens": 10}, participant_id=participant_id)
+
+    usage = llm_service.get_participant_usage(participant_id)
+
+    assert usage["chat"]["calls"] == 1 and usage["chat"]["output_tokens"] == 10
+    assert usage["total"]["prompt_tokens"] == 20
+
+
+def test_memory_store_evicts_least_recently_used():
+    store = InMemorySessionStore(idle_ttl=0, max_resident=2)
+    for participant_id in ("PT_A", "PT_B", "PT_C"):
+        store.append_history(participant_id, {"role": "user", "content": "hello"})
+
+    stats = store.get_stats()
+
+    assert stats["resident_sessions"] == 2
+    assert stats["evicted_lru"] == 1
+    assert store.get("PT_A")["history"] == []
+
+
+def test_reading_a_session_refreshes_its_lru_position():
+    store = InMemorySessionStore(idle_ttl=0, max_resident=2)
+    store.append_history("PT_A", {"role": "user", "content": "hello"})
+    store.append_history("PT_B", {"role": "user", "content": "hello"})
+    store.get("PT_A")
+    store.append_history("PT_C", {"role": "user", "content": "hello"})  # 淘汰 PT_B
+
+    assert len(store.get("PT_A")["history"]) == 1
+    assert store.get_stats()["evicted_lru"] == 1
+    assert store.get("PT_B")["history"] == []
+
+
+def test_idle_sessions_are_trimmed_after_ttl():
+    store = InMemorySessionStore(idle_ttl=0.05, max_resident=0)
+    store.append_history("PT_A", {"role": "user", "content": "hello"})
+    store.append_sentiment_score("PT_A", 0.5)
+    time.sleep(0.1)
+
+    stats = store.get_stats()
+
+    assert stats["evicted_idle"] == 1
+    assert stats["resident_sessions"] == 0 and stats["trimmed_sessions"] == 1
+    session = store.get("PT_A")
+    assert session["history"] == [] and session["sentiment_scores"] == [0.5]
+
+
+def test_eviction_keeps_sentiment_scores_and_turn_count_until_clear():
+    store = InMemorySessionStore(idle_ttl=0, max_resident=1)
+    store.append_history("PT_A", {"role": "user", "content": "hello"})
+    store.complete_turn("PT_A", {"role": "ai", "content": "hi"})
+    store.append_sentiment_score("PT_A", 0.5)
+    store.append_history("PT_B", {"role": "user", "content": "hello"})  # 淘汰 PT_A
+
+    session = store.get("PT_A")
+
+    assert session["history"] == []
+    assert session["sentiment_scores"] == [0.5]
+    assert session["turn_count"] == 1
+    assert store.clear("PT_A") and store.clear("PT_B")
+    assert store.get("PT_A")["sentiment_scores"] == []
+
+
+def test_end_dialogue_waits_for_post_turn_job_in_another_worker(monkeypatch, participant_id):
+    store = MongoSessionStore()
+    monkeypatch.setattr(llm_service, "session_store", store)
+    monkeypatch.setattr(app_module, "POST_TURN_WAIT_TIMEOUT_SECONDS", 2)
+    monkeypatch.setattr(app_module, "POST_TURN_POLL_INTERVAL_SECONDS", 0.01)
+    store.complete_turn(participant_id, {"role": "ai", "content": "hi"})
+    # 本进程的队列里没有任务；最后一轮由另一个 worker 在 0.3 秒后处理完
+    threading.Timer(0.3, store.mark_post_turn_done, (participant_id,)).start()
+
+    started = time.monotonic()
+    app_module.wait_for_post_turn_jobs(participant_id)
+
+    assert 0.3 <= time.monotonic() - started < 2
@@ -0,0 +1,91 @@
+# tests/test_status_cache.py
+import time
+
+import pytest
+
+from backend import data_manager
+
+
+@pytest.fixture
+def participant_id():
+    participant_id = data_manager.generate_participant_id("test")
+    data_manager.init_participant_session(participant_id, "AB", "en", "test")
+    return participant_id
+
+
+def _reads(action) -> int:
+    data_manager.begin_operation_scope()
+    try:
+        action()
+    finally:
+        counts = data_manager.end_operation_scope()
+    return counts["reads"]
+
+
+def test_second_read_is_served_from_the_cache(participant_id):
+    assert _reads(lambda: data_manager.get_participant_status(participant_id)) == 1
+    assert _reads(lambda: data_manager.get_participant_status(participant_id)) == 0
+
+
+def test_cached_status_is_a_copy(participant_id):
+    data_manager.get_participant_status(participant_id)["current_step_index"] = 99
+
+    assert data_manager.get_participant_status(participant_id)["current_step_index"] == -1
+
+
+def test_step_update_writes_through(participant_id):
+    data_manager.get_participant_status(participant_id)
+
+    assert data_manager.update_participant_step(participant_id, 3)
+
+    status = {}
+    assert _reads(lambda: status.update(data_manager.get_participant_status(participant_id))) == 0
+    assert status["current_step_index"] == 3
+
+
+def test_condition_switch_writes_through(participant_id):
+    status = data_manager.get_participant_status(participant_id)
+
+    new_condition = data_manager.update_participant_condition(participant_id, status)
+
+    cached = data_manager.get_participant_status(participant_id)
+    assert new_condition == cached["condition"] == "NON_XAI"
+    assert cached["washout_completed"] is True
+
+
+def test_reinitialising_a_participant_invalidates_the_entry(participant_id):
+    data_manager.update_participant_step(participant_id, 3)
+    data_manager.get_participant_status(participant_id)
+
+    data_manager.init_participant_session(participant_id, "BA", "en", "test")
+
+    status = data_manager.get_participant_status(participant_id)
+    assert status["current_step_index"] == -1
+    assert status["condition"] == "NON_XAI"
+
+
+def test_clearing_the_database_empties_the_cache(participant_id):
+    data_manager.get_participant_status(participant_id)
+
+    data_manager.clear_database_contents("test")
+
+    assert data_manager.get_status_cache_stats()["size"] == 0
+    assert data_manager.get_participant_status(participant_id) == {}
+
+
+def test_expired_entry_is_read_again(monkeypatch, participant_id):
+    monkeypatch.setattr(data_manager, "STATUS_CACHE_TTL_SECONDS", 0.05)
+    data_manager.get_participant_status(participant_id)
+    expirations = data_manager.get_status_cache_stats()["expirations"]
+    time.sleep(0.1)
+
+    assert _reads(lambda: data_manager.get_participant_status(participant_id)) == 1
+    assert data_manager.get_status_cache_stats()["expirations"] == expirations + 1
+
+
+def test_cache_can_be_switched_off(monkeypatch, participant_id):
+    monkeypatch.setattr(data_manager, "STATUS_CACHE_ENABLED", False)
+
+    assert _reads(lambda: data_manager.get_participant_status(participant_id)) == 1
+    assert _reads(lambda: data_manager.get_participant_status(participant_id)) == 1
+    assert data_manager.get_status_cache_stats()["enabled"] is False
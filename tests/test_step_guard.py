@@ -0,0 +1,140 @@
+# tests/test_step_guard.py
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from bson import ObjectId
+
+from backend import data_manager
+from backend.app import app
+from backend.config import EXPERIMENT_STEPS
+
+
+@pytest.fixture
+def client():
+    app.config["TESTING"] = True
+    with app.test_client() as client:
+        yield client
+
+
+@pytest.fixture
+def participant_id(client):
+    """通过测试邀请链接创建一个刚开始实验的参与者"""
+    assert client.post("/admin/login", json={"password": "test-admin"}).status_code == 200
+    response = client.post("/admin/invite-batches", json={
+        "batch_name": "step-guard", "language": "en", "condition_order": "AB", "invite_type": "test", "quantity": 1
+    })
+    link = response.get_json()["batch"]["links"][0]
+    assert client.get(f"/invite/{link['token']}").status_code == 302
+    return link["participant_id"]
+
+
+def _step_events(participant_id: str, step_name: str) -> int:
+    data_manager.flush_writes()
+    return data_manager.test_collections["experiment_data"].count_documents(
+        {"participant_id": participant_id, "step": step_name}
+    )
+
+
+def _submit_consent(client, participant_id: str):
+    return client.post("/save_data", json={
+        "participant_id": participant_id, "step_name": "CONSENT", "data": {"agreed": True}, "current_step_index": -1
+    })
+
+
+def test_duplicate_save_data_is_rejected_and_recorded_once(client, participant_id):
+    first = _submit_consent(client, participant_id)
+    second = _submit_consent(client, participant_id)
+
+    assert first.status_code == 200
+    assert second.status_code == 409
+    body = second.get_json()
+    assert body["success"] is False
+    assert body["next_step_index"] == first.get_json()["next_step_index"] == 0
+    assert body["next_url"] == first.get_json()["next_url"]
+    assert _step_events(participant_id, "CONSENT") == 1
+
+
+def test_concurrent_submissions_advance_once(participant_id):
+    def submit(_):
+        with app.test_client() as client:
+            return _submit_consent(client, participant_id).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(submit, range(8)))
+
+    assert sorted(statuses) == [200] + [409] * 7
+    assert _step_events(participant_id, "CONSENT") == 1
+    assert data_manager.get_participant_status(participant_id)["current_step_index"] == 0
+
+
+def test_async_advance_is_guarded_the_same_way(participant_id):
+    async def advance_concurrently():
+        return await asyncio.gather(*(
+            data_manager.advance_participant_step_async(participant_id, "CONSENT", {"agreed": True}, -1, 0)
+            for _ in range(4)
+        ))
+
+    results = asyncio.run(advance_concurrently())
+
+    assert sorted(advanced for _, advanced in results) == [False, False, False, True]
+    assert all(status["current_step_index"] == 0 for status, _ in results)
+    assert _step_events(participant_id, "CONSENT") == 1
+
+
+def test_out_of_order_submission_leaves_no_event(client, participant_id):
+    step_name = EXPERIMENT_STEPS[2]
+
+    response = client.post("/save_data", json={
+        "participant_id": participant_id, "step_name": step_name, "data": {}, "current_step_index": 2
+    })
+
+    assert response.status_code == 409
+    assert response.get_json()["next_step_index"] == -1
+    assert _step_events(participant_id, step_name) == 0
+
+
+def test_step_event_keeps_object_id_and_records_idempotency_key(client, participant_id):
+    assert _submit_consent(client, participant_id).status_code == 200
+
+    event = data_manager.test_collections["experiment_data"].find_one(
+        {"participant_id": participant_id, "step": "CONSENT"}
+    )
+
+    assert isinstance(event["_id"], ObjectId)
+    assert event["step_event_key"].startswith(f"{participant_id}:")
+
+
+def test_failed_event_write_reverts_the_advance(monkeypatch, client, participant_id):
+    collection = data_manager.test_collections["experiment_data"]
+
+    def failing_insert_one(document, *args, **kwargs):
+        raise ConnectionError("connection reset")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(collection, "insert_one", failing_insert_one)
+        assert _submit_consent(client, participant_id).status_code == 500
+
+    assert data_manager.get_participant_status(participant_id)["current_step_index"] == -1
+    assert _step_events(participant_id, "CONSENT") == 0
+    # 参与者可以重新提交
+    assert _submit_consent(client, participant_id).status_code == 200
+    assert _step_events(participant_id, "CONSENT") == 1
+
+
+def test_repeated_end_dialogue_does_not_advance_again(client, participant_id):
+    dialogue_index = EXPERIMENT_STEPS.index("DIALOGUE_1")
+    status = data_manager.get_participant_status(participant_id)
+    # 直接把参与者放到第一个对话步骤
+    updated, advanced = data_manager.advance_participant_step(
+        participant_id, "TEST_SETUP", {}, status["current_step_index"], dialogue_index, status=status
+    )
+    assert advanced
+
+    first = client.post("/end_dialogue", json={"participant_id": participant_id})
+    second = client.post("/end_dialogue", json={"participant_id": participant_id})
+
+    assert first.status_code == 200
+    assert second.status_code == 409
+    assert data_manager.get_participant_status(participant_id)["current_step_index"] == dialogue_index + 1
+    assert _step_events(participant_id, "DIALOGUE_END_1") == 1
@@ -0,0 +1,108 @@
+# tests/test_write_buffer.py
+import time
+
+import mongomock
+import pytest
+
+from backend.write_buffer import WriteBuffer
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.events
+
+
+@pytest.fixture
+def make_buffer():
+    buffers = []
+
+    def make(**options):
+        buffer = WriteBuffer(f"test_buffer_{len(buffers)}", **options)
+        buffers.append(buffer)
+        return buffer
+
+    yield make
+    for buffer in buffers:
+        buffer.shutdown()
+
+
+def _wait_for(predicate, timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_flushes_when_batch_is_full(collection, make_buffer):
+    buffer = make_buffer(max_records=5, max_delay=60)
+
+    for seq in range(4):
+        buffer.add("events", collection, {"seq": seq})
+    time.sleep(0.1)
+    assert collection.count_documents({}) == 0
+
+    buffer.add("events", collection, {"seq": 4})
+    assert _wait_for(lambda: collection.count_documents({}) == 5)
+    stats = buffer.get_stats()
+    assert stats["flushes"] == 1 and stats["batch_size_max"] == 5
+
+
+def test_flushes_partial_batch_after_max_delay(collection, make_buffer):
+    buffer = make_buffer(max_records=100, max_delay=0.2)
+
+    started = time.monotonic()
+    buffer.add("events", collection, {"seq": 0})
+    assert collection.count_documents({}) == 0
+
+    assert _wait_for(lambda: collection.count_documents({}) == 1)
+    assert time.monotonic() - started >= 0.2
+    assert buffer.get_stats()["unflushed"] == 0
+
+
+def test_preserves_insertion_order_per_collection(make_buffer):
+    db = mongomock.MongoClient().db
+    buffer = make_buffer(max_records=7, max_delay=0.05)
+
+    for seq in range(30):
+        buffer.add("events", db.events, {"seq": seq})
+        buffer.add("turns", db.turns, {"seq": seq})
+    buffer.flush()
+
+    assert [doc["seq"] for doc in db.events.find()] == list(range(30))
+    assert [doc["seq"] for doc in db.turns.find()] == list(range(30))
+
+
+def test_failed_batch_is_retried_without_duplicates(collection, make_buffer, monkeypatch):
+    buffer = make_buffer(max_records=100, max_delay=60)
+    original = collection.insert_many
+    attempts = []
+
+    def flaky_insert_many(docs, ordered=True):
+        attempts.append(len(docs))
+        if len(attempts) == 1:
+            original(docs[:2], ordered=ordered)  # 写入一部分后断开
+            raise ConnectionError("connection reset")
+        return original(docs, ordered=ordered)
+
+    monkeypatch.setattr(collection, "insert_many", flaky_insert_many)
+    for seq in range(5):
+        buffer.add("events", collection, {"seq": seq})
+    buffer.flush()  # 第一次失败，记录重新排队
+    buffer.flush()  # 重试：已写入的两条得到重复键错误，按成功处理
+
+    assert attempts == [5, 5]
+    assert sorted(doc["seq"] for doc in collection.find()) == list(range(5))
+    stats = buffer.get_stats()
+    assert stats["retried"] == 5 and stats["failed"] == 0 and stats["unflushed"] == 0
+
+
+def test_shutdown_writes_remaining_records(collection):
+    buffer = WriteBuffer("test_buffer_shutdown", max_records=100, max_delay=60)
+    for seq in range(3):
+        buffer.add("events", collection, {"seq": seq})
+
+    buffer.shutdown()
+
+    assert collection.count_documents({}) == 3
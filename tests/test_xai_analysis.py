@@ -0,0 +1,122 @@
+# tests/test_xai_analysis.py
+import asyncio
+
+import pytest
+
+from backend import llm_service, llm_usage, sentiment_service
+from backend.llm_provider import LLMResponse
+
+
+@pytest.fixture
+def provider_calls(monkeypatch, fake_provider):
+    """记录调用顺序 ("fused" / "sentiment" / "text")；fused_data 不为 None 时合并调用返回该内容"""
+    calls = []
+    state = {"fused_error": None, "fused_data": None}
+
+    def kind(schema):
+        if schema is llm_service._FUSED_RESPONSE_SCHEMA:
+            return "fused"
+        return "sentiment" if schema is sentiment_service._SENTIMENT_RESPONSE_SCHEMA else "json"
+
+    def fused_override(schema):
+        if kind(schema) != "fused":
+            return None
+        if state["fused_error"] is not None:
+            raise state["fused_error"]
+        if state["fused_data"] is not None:
+            return LLMResponse("", data=state["fused_data"])
+        return None
+
+    generate_json, agenerate_json = fake_provider.generate_json, fake_provider.agenerate_json
+    generate_text, agenerate_text = fake_provider.generate_text, fake_provider.agenerate_text
+
+    def counted_generate_json(prompt, schema, **options):
+        calls.append(kind(schema))
+        return fused_override(schema) or generate_json(prompt, schema, **options)
+
+    async def counted_agenerate_json(prompt, schema, **options):
+        calls.append(kind(schema))
+        return fused_override(schema) or await agenerate_json(prompt, schema, **options)
+
+    def counted_generate_text(prompt, **options):
+        calls.append("text")
+        return generate_text(prompt, **options)
+
+    async def counted_agenerate_text(prompt, **options):
+        calls.append("text")
+        return await agenerate_text(prompt, **options)
+
+    monkeypatch.setattr(fake_provider, "generate_json", counted_generate_json)
+    monkeypatch.setattr(fake_provider, "agenerate_json", counted_agenerate_json)
+    monkeypatch.setattr(fake_provider, "generate_text", counted_generate_text)
+    monkeypatch.setattr(fake_provider, "agenerate_text", counted_agenerate_text)
+    monkeypatch.setattr(llm_service, "_xai_analysis_path", lambda: "fused")
+    return calls, state
+
+
+def _fallback_count() -> int:
+    return llm_usage.get_usage_stats()["xai_analysis"].get("fallback", {}).get("count", 0)
+
+
+def test_fused_call_returns_sentiment_and_explanation(provider_calls, unique_text):
+    calls, _ = provider_calls
+
+    sentiment, explanation = llm_service.analyze_and_explain(unique_text)
+
+    assert calls == ["fused"]
+    assert sentiment["top_emotion"] in sentiment_service.EKMAN_EMOTIONS
+    assert explanation
+    # 合并调用的情绪结果进入缓存，post-turn 分析直接复用
+    assert sentiment_service.get_cached_sentiment(unique_text) == sentiment
+
+
+@pytest.mark.parametrize("failure", ["parse_error", "missing_explanation"])
+def test_fused_failure_falls_back_to_two_calls(provider_calls, unique_text, failure):
+    calls, state = provider_calls
+    if failure == "parse_error":
+        state["fused_error"] = ValueError("Expecting value: line 1 column 1 (char 0)")
+    else:
+        state["fused_data"] = {"emotion": "joy", "confidence": 0.9, "explanation": ""}
+    fallbacks = _fallback_count()
+    seen = []
+
+    sentiment, explanation = llm_service.analyze_and_explain(unique_text, on_sentiment=seen.append)
+
+    assert calls == ["fused", "sentiment", "text"]
+    assert sentiment["model_used"]
+    assert explanation
+    assert seen == [sentiment]
+    assert _fallback_count() == fallbacks + 1
+
+
+def test_async_fused_failure_falls_back_to_two_calls(provider_calls, unique_text):
+    calls, state = provider_calls
+    state["fused_error"] = ValueError("Expecting value: line 1 column 1 (char 0)")
+
+    sentiment, explanation = asyncio.run(llm_service.analyze_and_explain_async(unique_text))
+
+    assert calls == ["fused", "sentiment", "text"]
+    assert sentiment["model_used"]
+    assert explanation
+
+
+def test_known_sentiment_skips_to_the_explanation(provider_calls):
+    calls, _ = provider_calls
+    seen = []
+
+    sentiment, explanation = asyncio.run(llm_service.analyze_and_explain_async("I am so happy today!", seen.append))
+
+    assert calls == ["text"]
+    assert sentiment["model_used"] == sentiment_service.LOCAL_MODEL_LABEL
+    assert seen == [sentiment]
+    assert explanation
+
+
+def test_async_fused_call_matches_sync_path(provider_calls, unique_text):
+    calls, _ = provider_calls
+
+    sentiment, explanation = asyncio.run(llm_service.analyze_and_explain_async(unique_text))
+
+    assert calls == ["fused"]
+    assert sentiment_service.get_cached_sentiment(unique_text) == sentiment
+    assert explanation